@@ -20,9 +20,30 @@
 import os
 import logging
 import json
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import TYPE_CHECKING
 
-import pandas as pd
+from thoth.pipeline_helpers.common import check_available
 from thoth.pipeline_helpers.common import create_s3_adapter
+from thoth.pipeline_helpers.common import retrieve_documents
+from thoth.pipeline_helpers.instrumentation import CEPH_CONNECT
+from thoth.pipeline_helpers.instrumentation import CEPH_RETRIEVE
+from thoth.pipeline_helpers.instrumentation import CEPH_STORE
+from thoth.pipeline_helpers.instrumentation import span
+from thoth.pipeline_helpers.report import PR_NUMBER_KEY
+from thoth.pipeline_helpers.report import TopN
+from thoth.pipeline_helpers.report import render_table
+from thoth.pipeline_helpers.report import row_sort_value
+from thoth.pipeline_helpers.spool import WriteSpool
+from thoth.pipeline_helpers.storage import list_stored_documents
+from thoth.pipeline_helpers.storage import read_document
+from thoth.pipeline_helpers.storage import store_document
+
+if TYPE_CHECKING:
+    from thoth.storages import CephStore
 
 _DEBUG_LEVEL = bool(int(os.getenv("DEBUG_LEVEL", 0)))
 
@@ -36,6 +57,90 @@ _LOGGER = logging.getLogger("thoth.post_process_metrics")
 DEPLOYMENT_NAMESPACE = os.getenv("PIPELINE_HELPERS_DEPLOYMENT_NAMESPACE", "aicoe-ci")
 PR_FILE_PATH = os.getenv("PIPELINE_HELPERS_PR_FILE_PATH", "/workspace/pr/pr.json")
 MAX_LIMIT_RESULTS = int(os.getenv("PIPELINE_HELPERS_MAX_LIMIT_RESULTS", 10))
+MAX_WORKERS = int(os.getenv("PIPELINE_HELPERS_MAX_WORKERS", 8))
+RETRIEVE_RETRIES = int(os.getenv("PIPELINE_HELPERS_RETRIEVE_RETRIES", 3))
+REPORT_TABLE_FORMAT = os.getenv("PIPELINE_HELPERS_REPORT_TABLE_FORMAT", "markdown")
+SORT_BY_METRIC = os.getenv("PIPELINE_HELPERS_SORT_BY_METRIC", PR_NUMBER_KEY)
+SORT_DESCENDING = bool(int(os.getenv("PIPELINE_HELPERS_SORT_DESCENDING", 1)))
+INCREMENTAL_AGGREGATION = bool(int(os.getenv("PIPELINE_HELPERS_INCREMENTAL_AGGREGATION", 1)))
+DETECT_REGRESSIONS = bool(int(os.getenv("PIPELINE_HELPERS_DETECT_REGRESSIONS", 1)))
+REGRESSION_METRICS = os.getenv("PIPELINE_HELPERS_REGRESSION_METRICS", "latency|cpu|memory")
+REGRESSION_BASELINE_SIZE = int(os.getenv("PIPELINE_HELPERS_REGRESSION_BASELINE_SIZE", 20))
+REGRESSION_MIN_BASELINE_SIZE = int(os.getenv("PIPELINE_HELPERS_REGRESSION_MIN_BASELINE_SIZE", 3))
+REGRESSION_THRESHOLD = float(os.getenv("PIPELINE_HELPERS_REGRESSION_THRESHOLD", 3.0))
+REGRESSION_TOLERANCE = float(os.getenv("PIPELINE_HELPERS_REGRESSION_TOLERANCE", 0.1))
+
+_MANIFEST_DOCUMENT_ID = "aggregated_metrics_manifest"
+
+# Columns of processed metrics documents shown in the report, other groups are read whole.
+_INFO_COLUMNS = ("namespace deployment", "test URL")
+
+
+def _load_manifest(ceph_adapter: "CephStore") -> Dict[str, dict]:
+    """Load manifest of documents considered in the previous aggregation, keyed by document id."""
+    from thoth.storages.exceptions import NotFoundError
+
+    try:
+        with span(CEPH_RETRIEVE):
+            manifest: Dict[str, dict] = ceph_adapter.retrieve_document(_MANIFEST_DOCUMENT_ID)["documents"]
+    except NotFoundError:
+        _LOGGER.info("No manifest from a previous aggregation found, all documents will be retrieved.")
+        return {}
+    except Exception as exc:
+        _LOGGER.warning(f"Could not load manifest from a previous aggregation, all documents will be retrieved: {exc}")
+        return {}
+
+    _LOGGER.info(f"Loaded manifest from a previous aggregation with {len(manifest)} documents.")
+    return manifest
+
+
+def _extract_metrics(metrics_retrieved: dict) -> Tuple[dict, dict]:
+    """Extract model application metrics and platform metrics rows from a processed metrics document."""
+    metrics_retrieved["model_application_metrics"]["namespace deployment"] = metrics_retrieved["info_metrics"][
+        "namespace deployment"
+    ]
+    metrics_retrieved["model_application_metrics"]["test URL"] = metrics_retrieved["info_metrics"]["test URL"]
+    metrics_retrieved["platform_metrics"]["model_version"] = metrics_retrieved["model_application_metrics"][
+        "model_version"
+    ]
+    return metrics_retrieved["model_application_metrics"], metrics_retrieved["platform_metrics"]
+
+
+def _find_regressions(manifest: Dict[str, dict], pr_number: int) -> List[dict]:
+    """Find regressions of metrics of the given PR against previous PRs stored in the manifest."""
+    from thoth.pipeline_helpers.regressions import find_regressions
+    from thoth.pipeline_helpers.regressions import parse_document_id
+
+    history = []
+    for document_id, entry in manifest.items():
+        history_pr_number, overlay_name = parse_document_id(document_id)
+        if history_pr_number is not None:
+            history.append(
+                (
+                    history_pr_number,
+                    overlay_name,
+                    {**entry["model_application_metrics"], **entry["platform_metrics"]},
+                )
+            )
+
+    return find_regressions(
+        history,
+        pr_number,
+        metrics_pattern=REGRESSION_METRICS,
+        baseline_size=REGRESSION_BASELINE_SIZE,
+        min_baseline_size=REGRESSION_MIN_BASELINE_SIZE,
+        threshold=REGRESSION_THRESHOLD,
+        tolerance=REGRESSION_TOLERANCE,
+    )
+
+
+def _offer_top_result(top_results: TopN[Tuple[dict, dict]], entry: dict, position: int) -> None:
+    """Offer metrics of a document to the top results, ties are ranked in the order documents were listed."""
+    top_results.push(
+        (entry["model_application_metrics"], entry["platform_metrics"]),
+        row_sort_value(SORT_BY_METRIC, entry["model_application_metrics"], entry["platform_metrics"]),
+        order=position,
+    )
 
 
 def post_process_metrics() -> None:
@@ -51,7 +156,9 @@ def post_process_metrics() -> None:
             deployment_name=DEPLOYMENT_NAMESPACE,
             repo=repo,
         )
-        ceph_adapter.connect()
+        with span(CEPH_CONNECT):
+            ceph_adapter.connect()
+        check_available(ceph_adapter)
         is_connected = True
     except Exception as exc:
         _LOGGER.warning(exc)
@@ -64,35 +171,92 @@ def post_process_metrics() -> None:
     metrics_data["platform_metrics"] = []
 
     _LOGGER.info(f"Limit of results shown is set to {MAX_LIMIT_RESULTS}!")
+    _LOGGER.info(f"Results shown are sorted by {SORT_BY_METRIC!r} ({'descending' if SORT_DESCENDING else 'ascending'})")
+    top_results: TopN[Tuple[dict, dict]] = TopN(MAX_LIMIT_RESULTS, descending=SORT_DESCENDING)
+    regressions: Optional[List[dict]] = None
+
+    # Metrics spooled while Ceph was not available are stored first, so they are aggregated too.
+    spool = WriteSpool()
+    if is_connected:
+        try:
+            spool.flush()
+        except Exception as exc:
+            _LOGGER.warning(f"Failed to replay spooled writes: {exc}")
 
     if is_connected:
-        for document_id in ceph_adapter.get_document_listing():
-            if "processed_metrics" in document_id:
-                metrics_retrieved = ceph_adapter.retrieve_document(document_id)
-                _LOGGER.info(f"Retrieved data for {document_id}")
-                _LOGGER.debug(f"info_metrics: {metrics_retrieved['info_metrics']}")
-                _LOGGER.debug(f"model_application_metrics: {metrics_retrieved['model_application_metrics']}")
-                _LOGGER.debug(f"platform_metrics: {metrics_retrieved['platform_metrics']}")
-                metrics_retrieved["model_application_metrics"]["namespace deployment"] = metrics_retrieved[
-                    "info_metrics"
-                ]["namespace deployment"]
-                metrics_retrieved["model_application_metrics"]["test URL"] = metrics_retrieved["info_metrics"][
-                    "test URL"
-                ]
-                metrics_data["model_application_metrics"].append(metrics_retrieved["model_application_metrics"])
-                metrics_retrieved["platform_metrics"]["model_version"] = metrics_retrieved["model_application_metrics"][
-                    "model_version"
-                ]
-                metrics_data["platform_metrics"].append(metrics_retrieved["platform_metrics"])
+        manifest = _load_manifest(ceph_adapter) if INCREMENTAL_AGGREGATION else {}
+        new_manifest: Dict[str, dict] = {}
+        to_retrieve: Dict[str, dict] = {}
+
+        formats: Dict[str, str] = {}
+        positions: Dict[str, int] = {}
+
+        # Top results are selected as documents are listed and retrieved, not once all of them are.
+        for position, (document_id, etag, last_modified, document_format) in enumerate(
+            list_stored_documents(ceph_adapter, "processed_metrics")
+        ):
+            entry = manifest.get(document_id)
+            if entry is None or entry["etag"] != etag:
+                entry = {"etag": etag, "last_modified": last_modified}
+                to_retrieve[document_id] = entry
+                formats[document_id] = document_format
+                positions[document_id] = position
+            else:
+                _offer_top_result(top_results, entry, position)
+
+            new_manifest[document_id] = entry
+
+        _LOGGER.info(
+            f"Found {len(new_manifest)} documents, {len(to_retrieve)} new or changed since last aggregation, "
+            f"retrieving them using {MAX_WORKERS} workers..."
+        )
+
+        for document_id, metrics_retrieved in retrieve_documents(
+            ceph_adapter,
+            to_retrieve,
+            max_workers=MAX_WORKERS,
+            retries=RETRIEVE_RETRIES,
+            reader=lambda document_id: read_document(
+                ceph_adapter,
+                document_id,
+                columns={"info_metrics": _INFO_COLUMNS},
+                document_format=formats[document_id],
+            ),
+        ):
+            _LOGGER.info(f"Retrieved data for {document_id}")
+            _LOGGER.debug(f"info_metrics: {metrics_retrieved['info_metrics']}")
+            _LOGGER.debug(f"model_application_metrics: {metrics_retrieved['model_application_metrics']}")
+            _LOGGER.debug(f"platform_metrics: {metrics_retrieved['platform_metrics']}")
+            model_application_metrics, platform_metrics = _extract_metrics(metrics_retrieved)
+            to_retrieve[document_id]["model_application_metrics"] = model_application_metrics
+            to_retrieve[document_id]["platform_metrics"] = platform_metrics
+            _offer_top_result(top_results, to_retrieve[document_id], positions[document_id])
+
+        for entry in new_manifest.values():
+            metrics_data["model_application_metrics"].append(entry["model_application_metrics"])
+            metrics_data["platform_metrics"].append(entry["platform_metrics"])
+
+        if DETECT_REGRESSIONS:
+            regressions = _find_regressions(new_manifest, int(pr_info["Number"]))
 
     else:
         _LOGGER.info("Could not connect to Ceph to retrieve object stored!")
 
     _LOGGER.info(f"Processed data to be stored: {metrics_data}")
 
-    # Store on ceph
+    # Store on ceph, documents failing to store are not spooled, the next aggregation builds them again.
     if is_connected:
-        ceph_adapter.store_document(metrics_data, "aggregated_metrics")
+        try:
+            store_document(ceph_adapter, metrics_data, "aggregated_metrics")
+        except Exception as exc:
+            _LOGGER.warning(f"Failed to store aggregated metrics, they are stored by the next aggregation: {exc}")
+
+        if INCREMENTAL_AGGREGATION:
+            try:
+                with span(CEPH_STORE):
+                    ceph_adapter.store_document({"documents": new_manifest}, _MANIFEST_DOCUMENT_ID)
+            except Exception as exc:
+                _LOGGER.warning(f"Failed to store manifest of the aggregation: {exc}")
 
     # Store locally for next step
     with open("pr-comment", "w") as pr_comment:
@@ -101,27 +265,45 @@ def post_process_metrics() -> None:
         report += "# AICoE CI results"
 
         if is_connected:
-            if len(metrics_data["model_application_metrics"]) <= MAX_LIMIT_RESULTS:
-                df_metrics = pd.DataFrame(metrics_data["model_application_metrics"])
-                df_platform = pd.DataFrame(metrics_data["platform_metrics"])
-            else:
-                df_metrics = pd.DataFrame(metrics_data["model_application_metrics"][: MAX_LIMIT_RESULTS - 1])
-                df_platform = pd.DataFrame(metrics_data["platform_metrics"][: MAX_LIMIT_RESULTS - 1])
+            top_rows = top_results.items()
 
             report += "\n\n## Model and application metrics"
             report += (
                 "\n\nThe following table shows gathered metrics for model and application on your deployed models."
             )
-            report += "\n\n" + df_metrics.to_markdown(index=False)
+            report += "\n\n" + render_table((metrics for metrics, _ in top_rows), REPORT_TABLE_FORMAT)
 
             report += "\n\n## Platform metrics"
             report += "\n\nThe following table shows gathered metrics from platform on your deployed models."
-            report += "\n\n" + df_platform.to_markdown(index=False)
+            report += "\n\n" + render_table((platform for _, platform in top_rows), REPORT_TABLE_FORMAT)
+
+            if regressions is not None:
+                report += "\n\n## Regressions"
+                if regressions:
+                    report += (
+                        "\n\nThe following metrics of this PR regressed compared to the last"
+                        f" {REGRESSION_BASELINE_SIZE} PRs deployed before it."
+                    )
+                    report += "\n\n" + render_table(regressions, REPORT_TABLE_FORMAT)
+                else:
+                    report += "\n\nNo regressions found compared to PRs deployed before this one."
         else:
             report += (
                 "\n\nPipeline is not able to connect to Ceph to retrieve objects stored, contact Thoth maintainers!"
             )
 
+            try:
+                pending = spool.pending()
+            except Exception as exc:
+                _LOGGER.warning(f"Failed to read spooled writes: {exc}")
+                pending = 0
+
+            if pending:
+                report += (
+                    f"\n\nMetrics are not lost: {pending} pending writes are kept locally and will be stored"
+                    " once Ceph is reachable again."
+                )
+
         _LOGGER.info(f"PR comment is:\n{report}")
         pr_comment.write(report)
 
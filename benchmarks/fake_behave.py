@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# pipeline-helpers
+# Copyright(C) 2022 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Stand-in for behave writing synthetic metrics, arguments are ignored."""
+
+import json
+import os
+import random
+
+METRICS_FILE_PATH = os.getenv("PIPELINE_HELPERS_METRICS_FILE_PATH", "metrics.json")
+LATENCY_SAMPLES = int(os.getenv("BENCHMARK_LATENCY_SAMPLES", 1000))
+
+
+def main() -> None:
+    """Write metrics with a series of request latencies."""
+    generator = random.Random(LATENCY_SAMPLES)
+    metrics = {
+        "name": "benchmark",
+        "average_latency": 0.05,
+        "number_of_inferences": LATENCY_SAMPLES,
+        "latency": [round(generator.lognormvariate(-3.0, 0.5), 6) for _ in range(LATENCY_SAMPLES)],
+    }
+    with open(METRICS_FILE_PATH, "w") as metrics_file:
+        json.dump(metrics, metrics_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# pipeline-helpers
+# Copyright(C) 2022 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Local stand-ins for services used by pipeline helpers: S3 (Ceph), Prometheus and Quay.
+
+Each service is an HTTP server running in a background thread. S3 is served by moto, Prometheus and Quay
+are small servers good enough for the requests helpers make and nothing more.
+"""
+
+import json
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import Optional
+from typing import Tuple
+from typing import Type
+from urllib.parse import parse_qs
+from urllib.parse import urlsplit
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Base request handler, quiet and speaking HTTP/1.1."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+        """Do not log requests."""
+
+    def _respond(self, status: int, body: bytes = b"", headers: Optional[Dict[str, str]] = None) -> None:
+        """Send a response."""
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _respond_json(self, document: Any) -> None:
+        """Send a JSON response."""
+        self._respond(200, json.dumps(document).encode("utf-8"), {"Content-Type": "application/json"})
+
+
+class _Service:
+    """HTTP server running in a background thread."""
+
+    def __init__(self, handler: Type[BaseHTTPRequestHandler]) -> None:
+        """Initialize server on a free local port."""
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.server.daemon_threads = True
+        self.server.service = self  # type: ignore
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        """Get URL of the server."""
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self) -> "_Service":
+        """Start serving requests."""
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop serving requests."""
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _free_port() -> int:
+    """Get a local port free to listen on."""
+    with socket.socket() as free_socket:
+        free_socket.bind(("127.0.0.1", 0))
+        port: int = free_socket.getsockname()[1]
+        return port
+
+
+class MotoS3:
+    """S3 (Ceph) stand-in served by moto in a background thread, with a single bucket."""
+
+    def __init__(self, bucket: str) -> None:
+        """Initialize server on a free local port, serving the given bucket once started."""
+        from moto.server import ThreadedMotoServer
+
+        self.bucket = bucket
+        self._port = _free_port()
+        self._server = ThreadedMotoServer(ip_address="127.0.0.1", port=self._port, verbose=False)
+        self._client: Any = None
+        self.max_workers = 16
+
+    @property
+    def url(self) -> str:
+        """Get URL of the server."""
+        return f"http://127.0.0.1:{self._port}"
+
+    def start(self) -> "MotoS3":
+        """Start serving requests and create the bucket."""
+        import boto3
+        from botocore.config import Config
+
+        self._server.start()
+        self._client = boto3.client(
+            "s3",
+            endpoint_url=self.url,
+            region_name="us-east-1",
+            aws_access_key_id="benchmark",
+            aws_secret_access_key="benchmark",
+            config=Config(max_pool_connections=self.max_workers),
+        )
+        self._client.create_bucket(Bucket=self.bucket)
+        return self
+
+    def stop(self) -> None:
+        """Stop serving requests."""
+        self._server.stop()
+
+    def put_objects(self, objects: Iterable[Tuple[str, bytes]]) -> None:
+        """Store objects given as keys and bodies, concurrently."""
+
+        def put_object(item: Tuple[str, bytes]) -> None:
+            self._client.put_object(Bucket=self.bucket, Key=item[0], Body=item[1])
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # Results are consumed so that failures are raised.
+            list(executor.map(put_object, objects))
+
+    def _keys(self) -> Iterator[str]:
+        """List keys of all objects stored."""
+        for page in self._client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket):
+            for obj in page.get("Contents", []):
+                yield obj["Key"]
+
+    def clear(self) -> None:
+        """Delete all objects."""
+        keys = list(self._keys())
+        for start in range(0, len(keys), 1000):
+            self._client.delete_objects(
+                Bucket=self.bucket,
+                Delete={"Objects": [{"Key": key} for key in keys[start : start + 1000]]},  # noqa: E203
+            )
+
+    def __len__(self) -> int:
+        """Get number of objects stored."""
+        return sum(1 for _ in self._keys())
+
+
+class _PrometheusHandler(_Handler):
+    """Handle Prometheus HTTP API range queries with synthetic series."""
+
+    def do_GET(self) -> None:  # noqa: N802
+        """Answer connection checks and range queries."""
+        url = urlsplit(self.path)
+        if url.path.rstrip("/") != "/api/v1/query_range":
+            self._respond(200, b"OK")
+            return
+
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        start, end = float(query["start"]), float(query["end"])
+        step = float(query["step"].rstrip("s"))
+        prometheus: FakePrometheus = self.server.service  # type: ignore
+
+        values = []
+        timestamp, index = start, 0
+        while timestamp <= end:
+            values.append([timestamp, str(1.0 + (index % 10) / 10)])
+            timestamp += step
+            index += 1
+
+        series = {"metric": {"pod": "benchmark"}, "values": values}
+        result = {"resultType": "matrix", "result": [series] * prometheus.series}
+        self._respond_json({"status": "success", "data": result})
+
+
+class FakePrometheus(_Service):
+    """Prometheus stand-in answering every range query with the same synthetic series."""
+
+    def __init__(self, series: int = 1) -> None:
+        """Initialize server returning the given number of series per query."""
+        super().__init__(_PrometheusHandler)
+        self.series = series
+
+
+class _QuayHandler(_Handler):
+    """Handle Quay API requests for repository tags."""
+
+    def do_GET(self) -> None:  # noqa: N802
+        """Return tags of a repository."""
+        quay: FakeQuay = self.server.service  # type: ignore
+        tags = {f"v0.{minor}.{patch}": {} for minor in range(quay.minor_versions) for patch in range(3)}
+        tags["latest"] = {}
+        self._respond_json({"tags": tags})
+
+
+class FakeQuay(_Service):
+    """Quay stand-in reporting the same version tags for every repository."""
+
+    def __init__(self, minor_versions: int = 40) -> None:
+        """Initialize server reporting versions up to the given minor version."""
+        super().__init__(_QuayHandler)
+        self.minor_versions = minor_versions
+
+    @property
+    def api_url(self) -> str:
+        """Get URL of the Quay API."""
+        return f"{self.url}/api/v1"
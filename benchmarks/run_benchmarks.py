@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+# pipeline-helpers
+# Copyright(C) 2022 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark the pipeline flow end to end with synthetic data and local service stand-ins.
+
+For each number of stored documents, the bucket is seeded with processed metrics documents of previous PRs
+and helpers run one after another as in the pipeline, each in its own process:
+customize-object-deployments, bump-base-image-version, gather-metrics, gather-platform-metrics,
+post-process-metrics and aggregate-metrics (first without and then with the manifest of the previous
+aggregation). Wall time, throughput and peak RSS of each step are reported.
+
+    python benchmarks/run_benchmarks.py --sizes 10 100 1000 10000 --output benchmark.json
+
+Wall times can be compared to a baseline, the benchmark fails if a step is slower than allowed:
+
+    python benchmarks/run_benchmarks.py --sizes 10 100 --baseline benchmarks/baseline.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+_BENCHMARKS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+_REPOSITORY_DIRECTORY = os.path.dirname(_BENCHMARKS_DIRECTORY)
+sys.path.insert(0, _REPOSITORY_DIRECTORY)
+
+from benchmarks.fake_services import FakePrometheus  # noqa: E402
+from benchmarks.fake_services import FakeQuay  # noqa: E402
+from benchmarks.fake_services import MotoS3  # noqa: E402
+
+_LOGGER = logging.getLogger("thoth.pipeline_helpers.benchmarks")
+
+BUCKET = "benchmark"
+REPO = "thoth-station/benchmark"
+DEPLOYMENT_NAMESPACE = "aicoe-ci"
+OVERLAYS = ("cpu", "gpu")
+DOCUMENT_PREFIX = f"data/{DEPLOYMENT_NAMESPACE}/deployment-metrics/{REPO}"
+
+# Base images of the synthetic .aicoe-ci.yaml, all outdated against versions reported by the fake Quay.
+_BASE_IMAGES = (
+    "quay.io/thoth-station/s2i-thoth-ubi8-py38:v0.1.0",
+    "quay.io/thoth-station/s2i-thoth-ubi8-py39:v0.2.0",
+    "quay.io/thoth-station/s2i-thoth-f34-py39:v0.3.0",
+)
+
+
+def _processed_metrics(pr_number: int, overlay_name: str) -> Dict[str, Any]:
+    """Create a synthetic processed metrics document of a PR deployed with an overlay."""
+    model_version = f"pr-{pr_number}-{overlay_name}"
+    latency = 0.05 + (pr_number % 7) * 0.001
+    return {
+        "model_version": model_version,
+        "info_metrics": {
+            "test URL": f"https://github.com/{REPO}/blob/{pr_number:040x}/features",
+            "namespace deployment": DEPLOYMENT_NAMESPACE,
+        },
+        "model_application_metrics": {
+            "model_version": model_version,
+            "name": "benchmark",
+            "average_latency": latency,
+            "latency count": 1000,
+            "latency min": latency / 4,
+            "latency max": latency * 5,
+            "latency mean": latency,
+            "latency p50": latency,
+            "latency p95": latency * 1.5,
+            "latency p99": latency * 2,
+            "number_of_inferences": 1000,
+        },
+        "platform_metrics": {
+            "CPU max usage": 0.5 + (pr_number % 5) * 0.01,
+            "Memory max usage": f"{100 + pr_number % 11}Mi",
+        },
+    }
+
+
+def _seed_documents(s3: MotoS3, count: int) -> int:
+    """Store the given number of processed metrics documents of previous PRs, return number of the next PR."""
+    s3.clear()
+    documents = []
+    for index in range(count):
+        pr_number, overlay_name = index // len(OVERLAYS) + 1, OVERLAYS[index % len(OVERLAYS)]
+        key = f"{DOCUMENT_PREFIX}/{pr_number}/{overlay_name}/processed_metrics"
+        documents.append((key, json.dumps(_processed_metrics(pr_number, overlay_name), sort_keys=True).encode("utf-8")))
+    s3.put_objects(documents)
+
+    return (count - 1) // len(OVERLAYS) + 2 if count else 1
+
+
+def _prepare_workspace(workspace: str, pr_number: int) -> Dict[str, str]:
+    """Create files the pipeline provides to helpers, return paths to them."""
+    paths = {
+        name: os.path.join(workspace, name) for name in ("pr", "results", "cache", "repo", "work", "bin", "timings")
+    }
+    for path in paths.values():
+        os.makedirs(path, exist_ok=True)
+
+    paths["pr_file"] = os.path.join(paths["pr"], "pr.json")
+    with open(paths["pr_file"], "w") as pr_file:
+        json.dump(
+            {"Base": {"Repo": {"FullName": REPO, "Name": "benchmark"}, "Ref": "master"}, "Number": pr_number}, pr_file
+        )
+
+    with open(os.path.join(paths["repo"], ".aicoe-ci.yaml"), "w") as config_file:
+        config_file.write("check:\n  - thoth-build\nbuild:\n")
+        for index, base_image in enumerate(_BASE_IMAGES):
+            config_file.write(f"  - image-name: image-{index}\n    base-image: {base_image}\n")
+
+    # Overlays of the application repository, customized from the default deployment config.
+    for overlay_name in OVERLAYS:
+        overlay_directory = os.path.join(paths["work"], "manifests", "overlays", overlay_name)
+        os.makedirs(overlay_directory, exist_ok=True)
+        shutil.copy(
+            os.path.join(_REPOSITORY_DIRECTORY, "manifests", "template", "deploymentconfig.yaml"), overlay_directory
+        )
+
+    # Requirements are not installed, the benchmark measures helpers, not package installation.
+    thamos = os.path.join(paths["bin"], "thamos")
+    with open(thamos, "w") as thamos_file:
+        thamos_file.write("#!/bin/sh\nexit 0\n")
+    os.chmod(thamos, os.stat(thamos).st_mode | stat.S_IEXEC)
+
+    return paths
+
+
+def _environment(
+    paths: Dict[str, str], s3: MotoS3, prometheus: FakePrometheus, quay: FakeQuay, latency_samples: int
+) -> Dict[str, str]:
+    """Get environment of helpers pointing them at the workspace and the service stand-ins."""
+    fake_behave = os.path.join(_BENCHMARKS_DIRECTORY, "fake_behave.py")
+    return dict(
+        os.environ,
+        PATH=paths["bin"] + os.pathsep + os.getenv("PATH", ""),
+        PYTHONPATH=os.pathsep.join(filter(None, [_REPOSITORY_DIRECTORY, os.getenv("PYTHONPATH")])),
+        NO_PROXY="127.0.0.1,localhost",
+        no_proxy="127.0.0.1,localhost",
+        THOTH_S3_ENDPOINT_URL=s3.url,
+        THOTH_CEPH_KEY_ID="benchmark",
+        THOTH_CEPH_SECRET_KEY="benchmark",
+        THOTH_CEPH_BUCKET=BUCKET,
+        THOTH_CEPH_REGION="us-east-1",
+        AWS_REQUEST_CHECKSUM_CALCULATION="when_required",
+        AWS_RESPONSE_CHECKSUM_VALIDATION="when_required",
+        THANOS_ENDPOINT=prometheus.url,
+        THANOS_ACCESS_TOKEN="benchmark",
+        REPO_URL=f"https://github.com/{REPO}",
+        COMMIT_SHA="0" * 40,
+        REPOSITORY_PATH=paths["repo"],
+        BENCHMARK_LATENCY_SAMPLES=str(latency_samples),
+        PIPELINE_HELPERS_QUAY_API_URL=quay.api_url,
+        PIPELINE_HELPERS_CACHE_DIR=paths["cache"],
+        PIPELINE_HELPERS_TEKTON_RESULTS_DIR=paths["results"],
+        PIPELINE_HELPERS_PR_FILE_PATH=paths["pr_file"],
+        PIPELINE_HELPERS_DEPLOYMENT_NAMESPACE=DEPLOYMENT_NAMESPACE,
+        PIPELINE_HELPERS_OVERLAY_NAME=OVERLAYS[0],
+        PIPELINE_HELPERS_IMAGE_URL_DEPLOYMENT="quay.io/thoth-station/benchmark:pr",
+        PIPELINE_HELPERS_TEMPLATE_DIRECTORY=os.path.join(_REPOSITORY_DIRECTORY, "manifests", "template"),
+        PIPELINE_HELPERS_OUTPUT_DIRECTORY=paths["repo"],
+        PIPELINE_HELPERS_CUSTOMIZE_RESULT_FILE_PATH=os.path.join(paths["results"], "customize_result"),
+        PIPELINE_HELPERS_POD_NAME="benchmark-pod",
+        PIPELINE_HELPERS_TEST_TYPE=f"{sys.executable} {fake_behave}",
+        PIPELINE_HELPERS_TEST_NAME="benchmark",
+        PIPELINE_HELPERS_INSTALL_CACHE="0",
+        PIPELINE_HELPERS_TEST_RUNTIME_ENVIRONMENT_NAME="",
+    )
+
+
+def _run_step(command: str, env: Dict[str, str], paths: Dict[str, str], label: str) -> Tuple[float, float]:
+    """Run a helper in its own process, return its wall time in seconds and peak RSS in MiB."""
+    log_path = os.path.join(paths["work"], f"{label}.log")
+    env = dict(env, PIPELINE_HELPERS_TIMINGS_FILE_PATH=os.path.join(paths["timings"], f"{label}.json"))
+
+    with open(log_path, "wb") as log_file:
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, "-m", "thoth.pipeline_helpers", command],
+            cwd=paths["work"],
+            env=env,
+            stdout=log_file,
+            stderr=subprocess.STDOUT,
+        )
+        # Resource usage of the child alone, Popen.wait() would not report it.
+        _, status, usage = os.wait4(process.pid, 0)
+        duration = time.perf_counter() - start
+        process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+
+    if process.returncode != 0:
+        with open(log_path, "r", errors="replace") as log_file:
+            tail = log_file.read()[-4000:]
+        raise RuntimeError(f"Step {label} failed with exit code {process.returncode}:\n{tail}")
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    peak_rss = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    return duration, peak_rss
+
+
+def _catalogue_size() -> int:
+    """Get number of platform metrics queried by gather-platform-metrics."""
+    from thoth.pipeline_helpers.platform import load_catalogue
+
+    return len(load_catalogue(os.path.join(_REPOSITORY_DIRECTORY, "manifests", "platform_metrics.yaml")))
+
+
+def run_benchmark(
+    size: int, s3: MotoS3, prometheus: FakePrometheus, quay: FakeQuay, latency_samples: int
+) -> List[Dict[str, Any]]:
+    """Run the pipeline flow with the given number of stored documents, return a row per step."""
+    workspace = tempfile.mkdtemp(prefix=f"pipeline-helpers-benchmark-{size}-")
+    try:
+        pr_number = _seed_documents(s3, size - 1)
+        paths = _prepare_workspace(workspace, pr_number)
+        env = _environment(paths, s3, prometheus, quay, latency_samples)
+
+        # Label, helper subcommand and number of items processed by the step.
+        steps = [
+            ("customize", "customize-object-deployments", 3),
+            ("bump", "bump-base-image-version", len(_BASE_IMAGES)),
+            ("gather", "gather-metrics", latency_samples),
+            ("gather-platform", "gather-platform-metrics", _catalogue_size()),
+            ("post-process", "post-process-metrics", 1),
+            ("aggregate-cold", "aggregate-metrics", size),
+            ("aggregate-warm", "aggregate-metrics", size),
+        ]
+
+        rows = []
+        for label, command, items in steps:
+            duration, peak_rss = _run_step(command, env, paths, label)
+            with open(os.path.join(paths["timings"], f"{label}.json"), "r") as timings_file:
+                phases = json.load(timings_file)["phases"]
+
+            rows.append(
+                {
+                    "documents": size,
+                    "step": label,
+                    "items": items,
+                    "seconds": round(duration, 3),
+                    "items/s": round(items / duration, 1) if duration else None,
+                    "peak RSS MiB": round(peak_rss, 1),
+                    # Spans of concurrent requests add up, so this can exceed wall time of the step.
+                    "ceph span seconds": round(
+                        sum(timing["total_ns"] for phase, timing in phases.items() if phase.startswith("ceph_")) / 1e9,
+                        3,
+                    ),
+                }
+            )
+            _LOGGER.info(f"{size} documents, {label}: {duration:.2f}s, peak RSS {peak_rss:.1f} MiB")
+
+        stored = len(s3)
+        if stored < size:
+            raise RuntimeError(f"Expected at least {size} objects stored after the flow, found {stored}")
+
+        return rows
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+
+def _load_baseline(path: str) -> Dict[Tuple[int, str], float]:
+    """Load wall times of steps from a baseline written with --write-baseline, keyed by documents and step."""
+    with open(path, "r") as baseline_file:
+        baseline = json.load(baseline_file)
+
+    return {(row["documents"], row["step"]): row["seconds"] for row in baseline["steps"]}
+
+
+def _write_baseline(path: str, rows: List[Dict[str, Any]]) -> None:
+    """Write wall times of steps as a baseline."""
+    steps = [{"documents": row["documents"], "step": row["step"], "seconds": row["seconds"]} for row in rows]
+    with open(path, "w") as baseline_file:
+        json.dump({"steps": steps}, baseline_file, indent=2)
+        baseline_file.write("\n")
+
+
+def find_slowdowns(
+    rows: List[Dict[str, Any]], baseline: Dict[Tuple[int, str], float], max_slowdown: float, slack: float
+) -> List[Dict[str, Any]]:
+    """Find steps slower than max_slowdown times their baseline wall time plus slack seconds.
+
+    Slack keeps steps taking a fraction of a second from failing on noise. Steps without a baseline are
+    not checked.
+    """
+    slowdowns = []
+    for row in rows:
+        baseline_seconds = baseline.get((row["documents"], row["step"]))
+        if baseline_seconds is None:
+            _LOGGER.warning(f"No baseline for step {row['step']} with {row['documents']} documents")
+            continue
+
+        allowed = baseline_seconds * max_slowdown + slack
+        if row["seconds"] > allowed:
+            slowdowns.append(
+                {
+                    "documents": row["documents"],
+                    "step": row["step"],
+                    "seconds": row["seconds"],
+                    "baseline seconds": baseline_seconds,
+                    "allowed seconds": round(allowed, 3),
+                }
+            )
+
+    return slowdowns
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Run benchmarks and report results, exit with status 1 if a step is slower than allowed by the baseline."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000], help="Numbers of stored documents."
+    )
+    parser.add_argument(
+        "--latency-samples", type=int, default=1000, help="Number of latencies reported by the test per run."
+    )
+    parser.add_argument("--output", help="Write results as JSON to this file.")
+    parser.add_argument("--baseline", help="Compare wall times of steps to a baseline written with --write-baseline.")
+    parser.add_argument(
+        "--max-slowdown",
+        type=float,
+        default=2.0,
+        help="Slowdown allowed compared to the baseline, as a factor of its wall time.",
+    )
+    parser.add_argument(
+        "--slack", type=float, default=0.5, help="Seconds allowed on top of the slowdown, to absorb noise."
+    )
+    parser.add_argument("--write-baseline", help="Write wall times of steps as a baseline to this file.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+
+    from thoth.pipeline_helpers.report import render_table
+
+    s3, prometheus, quay = MotoS3(BUCKET).start(), FakePrometheus().start(), FakeQuay().start()
+    try:
+        rows = []
+        for size in args.sizes:
+            rows.extend(run_benchmark(size, s3, prometheus, quay, args.latency_samples))
+    finally:
+        for service in (s3, prometheus, quay):
+            service.stop()
+
+    print(render_table(rows))
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(rows, output_file, indent=2)
+
+    if args.write_baseline:
+        _write_baseline(args.write_baseline, rows)
+
+    if args.baseline:
+        slowdowns = find_slowdowns(rows, _load_baseline(args.baseline), args.max_slowdown, args.slack)
+        if slowdowns:
+            print(f"\nSteps slower than allowed by the baseline {args.baseline}:\n")
+            print(render_table(slowdowns))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -20,15 +20,23 @@
 import json
 import logging
 import os
-import requests
+import re
+import shutil
+import tempfile
 import typing
 import yaml
 
-from packaging import version
+from concurrent.futures import ProcessPoolExecutor
 from typing import Optional
-from thoth.common import init_logging
+from typing import TYPE_CHECKING
 
-init_logging()
+from thoth.pipeline_helpers.instrumentation import YAML_LOAD
+from thoth.pipeline_helpers.instrumentation import span
+from thoth.pipeline_helpers.path_query import compile_query
+from thoth.pipeline_helpers.path_query import get_value
+
+if TYPE_CHECKING:
+    from thoth.pipeline_helpers.version_index import TagIndex
 
 _DEBUG_LEVEL = bool(int(os.getenv("DEBUG_LEVEL", 0)))
 _LOGGER = logging.getLogger("thoth.bump_base_image_version")
@@ -38,85 +46,179 @@ if _DEBUG_LEVEL:
 
 CONFIG_FILE_PATH = os.getenv("CONFIG_FILE_PATH", ".aicoe-ci.yaml")
 REPOSITORY_PATH = os.getenv("REPOSITORY_PATH")  # type: Optional[str]
+REPOSITORY_PATHS = os.getenv("REPOSITORY_PATHS")  # type: Optional[str]
+BUMP_SUMMARY_FILE_PATH = os.getenv("BUMP_SUMMARY_FILE_PATH")  # type: Optional[str]
+BATCH_MAX_WORKERS = int(os.getenv("BATCH_MAX_WORKERS", os.cpu_count() or 1))
 BASE_IMAGE_FIELD_YAML = os.getenv("BASE_IMAGE_FIELD_YAML", "base-image")
 QUAY_TOKEN = os.getenv("THOTH_QUAY_TOKEN")
 
 
 def _find_config_files_base_image_keys(file_dict: dict) -> typing.List[list]:
     """Find all paths to a base image in a key-value config file."""
-    current = [[key, file_dict, [key]] for key in file_dict.keys()]
-    paths = []
-
-    while current:
-        next_ = []
-        for [key, dict_, current_path] in current:
-            if isinstance(key, str) and key == BASE_IMAGE_FIELD_YAML:
-                paths.append(current_path)
-            else:
-                if isinstance(dict_[key], list):
-                    for index, elem in enumerate(dict_[key]):
-                        next_.append([index, dict_[key], current_path + [index]])
-
-                elif isinstance(dict_[key], dict):
-                    for key_ in dict_[key].keys():
-                        next_.append([key_, dict_[key], current_path + [key_]])
-
-        current = next_
+    return list(compile_query(f'**["{BASE_IMAGE_FIELD_YAML}"]').paths(file_dict))
 
-    return paths
-
-
-def bump_base_image_versions() -> None:
-    """Bump the base image version for container images to the latest available on Quay."""
-    if REPOSITORY_PATH:
-        config_file = os.path.join(REPOSITORY_PATH, CONFIG_FILE_PATH)
 
-    else:
-        config_file = CONFIG_FILE_PATH
+def _rewrite_config_file(config_file: str, replacements: typing.Dict[str, str], paths: typing.List[list]) -> None:
+    """Replace base images in a config file in a single pass and write it atomically.
 
+    The file is rewritten as text so formatting and comments are preserved, the result is parsed back to
+    check base images found on the given paths were replaced before the file is written.
+    """
     with open(config_file, "r") as yaml_file:
-        loaded_file = yaml.safe_load(yaml_file)
+        content = yaml_file.read()
+
+    # Longest images first so an image is not matched by another one it starts with, the lookahead
+    # avoids matching a version that is a prefix of another one (e.g. v0.2.1 in v0.2.10).
+    pattern = re.compile(
+        "|".join(re.escape(image) for image in sorted(replacements, key=len, reverse=True)) + r"(?![\w.-])"
+    )
+    new_content = pattern.sub(lambda match: replacements[match.group(0)], content)
+
+    with span(YAML_LOAD):
+        old_file, new_file = yaml.safe_load(content), yaml.safe_load(new_content)
+    for path in paths:
+        old_value, new_value = get_value(old_file, path), get_value(new_file, path)
+        if new_value != replacements.get(old_value, old_value):
+            raise ValueError(f"Failed to replace base image {old_value!r} in {config_file}, found {new_value!r}")
+
+    directory = os.path.dirname(os.path.abspath(config_file))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as tmp_file:
+            tmp_file.write(new_content)
+        shutil.copymode(config_file, tmp_path)
+        os.replace(tmp_path, config_file)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+    for base_image, new_base_image in replacements.items():
+        _LOGGER.info(f"Replaced {base_image} with {new_base_image}")
+
+
+def _scan_config_file(config_file: str) -> typing.Tuple[typing.List[list], typing.List[str]]:
+    """Find paths to base images in a config file and base images on them, without the registry."""
+    with open(config_file, "r") as yaml_file:
+        with span(YAML_LOAD):
+            loaded_file = yaml.safe_load(yaml_file)
         base_image_paths = _find_config_files_base_image_keys(loaded_file)
 
         base_image_urls = []
         for base_image_path in base_image_paths:
-            path_index = 0
-            base_image_url = loaded_file
-            while path_index < len(base_image_path):
-                base_image_url = base_image_url[base_image_path[path_index]]
-                path_index += 1
-
+            base_image_url = get_value(loaded_file, base_image_path)
             base_image_urls.append("/".join(base_image_url.split("/")[1:]))
 
-    base_image_url_to_latest_version = {}
+    return base_image_paths, base_image_urls
+
+
+def _find_replacements(
+    base_image_urls: typing.List[str], repositories_tags: typing.Dict[str, "TagIndex"]
+) -> typing.Dict[str, str]:
+    """Map outdated base images to the same images with the latest version available."""
+    replacements = {}
 
     for base_image_url in base_image_urls:
-        _LOGGER.info(f"Requesting the latest base image version from Quay.io for {base_image_url}")
+        _LOGGER.info(f"Finding the latest base image version on Quay.io for {base_image_url}")
 
-        r = requests.get(
-            f"https://quay.io/api/v1/repository/{base_image_url.split(':')[0]}",
-            headers={"Authorization": f"Bearer {QUAY_TOKEN}"},
-        ).text
-        image_versions = [
-            version.strip("v") for version in json.loads(r).get("tags", {}).keys() if version.startswith("v")
-        ]
+        repository, current_version = base_image_url.split(":")[0], base_image_url.split(":")[1]
+        tag_index = repositories_tags[repository]
 
-        latest_image_version = base_image_url.split(":")[1].strip("v")
-        for image_version in image_versions:
-            if version.parse(image_version) > version.parse(latest_image_version):
-                latest_image_version = image_version
+        if tag_index.is_outdated(current_version):
+            base_image = "quay.io/" + base_image_url
+            replacements[base_image] = f"{base_image.split(':')[0]}:{tag_index.latest()}"
 
-        latest_image_version = "v" + latest_image_version
+    return replacements
 
-        base_image_url_to_latest_version["quay.io/" + base_image_url] = latest_image_version
 
-        current_version = base_image_url.split(":")[1]
-        if current_version != latest_image_version:
-            for base_image, latest_version in base_image_url_to_latest_version.items():
-                os.system(f"sed -i s@{base_image}@{base_image.split(':')[0] + ':' + latest_version}@g {config_file}")
+def bump_base_image_versions() -> None:
+    """Bump the base image version for container images to the latest available on Quay."""
+    from thoth.common import init_logging
+    from thoth.pipeline_helpers.quay import get_repositories_tags
+
+    init_logging()
+
+    if REPOSITORY_PATHS:
+        bump_base_image_versions_batch(REPOSITORY_PATHS.replace(",", " ").split())
+        return
+
+    if REPOSITORY_PATH:
+        config_file = os.path.join(REPOSITORY_PATH, CONFIG_FILE_PATH)
+
+    else:
+        config_file = CONFIG_FILE_PATH
+
+    base_image_paths, base_image_urls = _scan_config_file(config_file)
+    repositories_tags = get_repositories_tags(
+        (base_image_url.split(":")[0] for base_image_url in base_image_urls), token=QUAY_TOKEN
+    )
+    replacements = _find_replacements(base_image_urls, repositories_tags)
+
+    if replacements:
+        _rewrite_config_file(config_file, replacements, base_image_paths)
 
     _LOGGER.info(f"File {config_file} has been updated with latest base image versions.")
 
 
+def bump_base_image_versions_batch(repository_paths: typing.List[str]) -> dict:
+    """Bump base image versions in config files of multiple repositories.
+
+    Config files are scanned in a process pool and base images used across all the repositories are
+    resolved once. A summary of changes is written as JSON to BUMP_SUMMARY_FILE_PATH, or logged.
+    """
+    from thoth.pipeline_helpers.quay import get_repositories_tags
+
+    config_files = [os.path.join(repository_path, CONFIG_FILE_PATH) for repository_path in repository_paths]
+    _LOGGER.info(f"Scanning {len(config_files)} config files for base images...")
+
+    scanned: typing.Dict[str, typing.Tuple[typing.List[list], typing.List[str]]] = {}
+    summary: dict = {"repositories": [], "changed": []}
+    errors: typing.Dict[str, str] = {}
+
+    with ProcessPoolExecutor(max_workers=BATCH_MAX_WORKERS) as executor:
+        futures = [executor.submit(_scan_config_file, config_file) for config_file in config_files]
+        for config_file, future in zip(config_files, futures):
+            try:
+                scanned[config_file] = future.result()
+            except Exception as exc:
+                _LOGGER.error(f"Failed to scan {config_file}: {exc}")
+                errors[config_file] = str(exc)
+
+    repositories_tags = get_repositories_tags(
+        (base_image_url.split(":")[0] for _, base_image_urls in scanned.values() for base_image_url in base_image_urls),
+        token=QUAY_TOKEN,
+    )
+
+    for repository_path, config_file in zip(repository_paths, config_files):
+        result = {"repository": repository_path, "config_file": config_file, "changed": False, "replacements": {}}
+
+        if config_file in scanned:
+            base_image_paths, base_image_urls = scanned[config_file]
+            try:
+                replacements = _find_replacements(base_image_urls, repositories_tags)
+                if replacements:
+                    _rewrite_config_file(config_file, replacements, base_image_paths)
+                    result["changed"] = True
+                    result["replacements"] = replacements
+                    summary["changed"].append(repository_path)
+            except Exception as exc:
+                _LOGGER.error(f"Failed to bump base images in {config_file}: {exc}")
+                errors[config_file] = str(exc)
+
+        if config_file in errors:
+            result["error"] = errors[config_file]
+
+        summary["repositories"].append(result)
+
+    if BUMP_SUMMARY_FILE_PATH:
+        with open(BUMP_SUMMARY_FILE_PATH, "w") as summary_file:
+            json.dump(summary, summary_file, indent=2)
+        _LOGGER.info(f"Summary of changes written to {BUMP_SUMMARY_FILE_PATH}")
+    else:
+        _LOGGER.info(f"Summary of changes: {json.dumps(summary)}")
+
+    _LOGGER.info(f"Updated {len(summary['changed'])} of {len(repository_paths)} repositories.")
+    return summary
+
+
 if __name__ == "__main__":
     bump_base_image_versions()
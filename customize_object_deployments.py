@@ -17,15 +17,19 @@
 
 """This script run in a pipeline task to customize Kuberneetes objects for deployment of an AI model."""
 
-import io
 import json
-import yaml
 import os
 import logging
 import uuid
 
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Dict
+from typing import List
+from typing import Optional
 
+from thoth.pipeline_helpers.templates import TemplateCache
+from thoth.pipeline_helpers.templates import write_documents_if_changed
 
 _DEBUG_LEVEL = bool(int(os.getenv("DEBUG_LEVEL", 0)))
 
@@ -37,83 +41,185 @@ else:
 _LOGGER = logging.getLogger("thoth.customize_object_deployments")
 
 IMAGE_URL = os.environ["PIPELINE_HELPERS_IMAGE_URL_DEPLOYMENT"]
-OVERLAY_NAME = os.environ["PIPELINE_HELPERS_OVERLAY_NAME"]
+OVERLAY_NAME = os.getenv("PIPELINE_HELPERS_OVERLAY_NAME", "")
+# Render every overlay found in manifests/overlays, each to its own directory in the output directory.
+ALL_OVERLAYS = bool(int(os.getenv("PIPELINE_HELPERS_ALL_OVERLAYS", 0)))
+OVERLAYS_MAX_WORKERS = int(os.getenv("PIPELINE_HELPERS_OVERLAYS_MAX_WORKERS", os.cpu_count() or 1))
+# Result stating whether customized objects changed ("changed") or were left as they were ("no-op").
+RESULT_FILE_PATH = os.getenv("PIPELINE_HELPERS_CUSTOMIZE_RESULT_FILE_PATH", "/tekton/results/customize_result")
 DEPLOYMENT_CONFIG_NAME = os.getenv("PIPELINE_HELPERS_DEPLOYMENT_CONFIG_NAME", "deploymentconfig.yaml")
+PR_FILE_PATH = os.getenv("PIPELINE_HELPERS_PR_FILE_PATH", "/workspace/pr/pr.json")
+TEMPLATE_DIRECTORY = os.getenv("PIPELINE_HELPERS_TEMPLATE_DIRECTORY", "/opt/app-root/src/manifests/template")
+OUTPUT_DIRECTORY = os.getenv("PIPELINE_HELPERS_OUTPUT_DIRECTORY", "/workspace/repo")
+# If set, all customized objects are written to this file as a multi-document YAML instead of a file per object.
+MANIFESTS_OUTPUT_FILE = os.getenv("PIPELINE_HELPERS_MANIFESTS_OUTPUT_FILE")  # type: Optional[str]
 
+_TEMPLATES = TemplateCache()
 
-def _customize_deployment_config(label: str, uid: str, overlay_name: str = "") -> None:
+
+def _customize_deployment_config(label: str, uid: str, overlay_name: str = "") -> dict:
     """Customize DeploymentConfig."""
     path_manifests = Path.cwd().joinpath("manifests")
 
-    if OVERLAY_NAME:
+    if overlay_name:
         path_overlays = path_manifests.joinpath("overlays")
-        path_dc = path_overlays.joinpath(OVERLAY_NAME).joinpath(DEPLOYMENT_CONFIG_NAME)
+        path_dc = path_overlays.joinpath(overlay_name).joinpath(DEPLOYMENT_CONFIG_NAME)
     else:
         # Use default one for single deployment
-        path_dc = Path(f"/opt/app-root/src/manifests/template/{DEPLOYMENT_CONFIG_NAME}")
-
-    with open(path_dc, "r") as stream:
-        dc_loaded = yaml.safe_load(stream)
-
-    new_dc = dict(dc_loaded)
-    new_dc["spec"]["selector"]["service"] = overlay_name + "-" + uid
-    new_dc["metadata"]["name"] = label + "-" + overlay_name
-    new_dc["metadata"]["labels"] = {}
-    new_dc["metadata"]["labels"]["component"] = label
-    new_dc["metadata"]["labels"]["overlay_name"] = overlay_name
-    new_dc["metadata"]["labels"]["service"] = overlay_name + "-" + uid
-    new_dc["spec"]["template"]["spec"]["containers"][0]["name"] = overlay_name + "-" + uid
-    new_dc["spec"]["template"]["metadata"]["labels"]["service"] = overlay_name + "-" + uid
-    new_dc["spec"]["template"]["spec"]["containers"][0]["image"] = IMAGE_URL
-
-    _LOGGER.info(f"Updated Deployment Config: {new_dc}")
+        path_dc = Path(TEMPLATE_DIRECTORY).joinpath(DEPLOYMENT_CONFIG_NAME)
 
     # TODO: Handle cases with different S2i options
-    # Write DC YAML file
-    with io.open("/workspace/repo/customized_deploymentconfig.yaml", "w", encoding="utf8") as outfile:
-        yaml.dump(new_dc, outfile, default_flow_style=False, allow_unicode=True)
+    new_dc = _TEMPLATES.render(
+        path_dc,
+        {
+            "spec.selector.service": overlay_name + "-" + uid,
+            "metadata.name": label + "-" + overlay_name,
+            "metadata.labels": {"component": label, "overlay_name": overlay_name, "service": overlay_name + "-" + uid},
+            "spec.template.spec.containers[0].name": overlay_name + "-" + uid,
+            "spec.template.metadata.labels.service": overlay_name + "-" + uid,
+            "spec.template.spec.containers[0].image": IMAGE_URL,
+        },
+    )
+    _LOGGER.info(f"Updated Deployment Config: {new_dc}")
+    return new_dc
 
 
-def _customize_route(label: str, uid: str, overlay_name: str = "") -> None:
+def _customize_route(label: str, uid: str, overlay_name: str = "") -> dict:
     """Customize Route."""
-    with open("/opt/app-root/src/manifests/template/route.yaml", "r") as stream:
-        route_loaded = yaml.safe_load(stream)
-
-    new_route = dict(route_loaded)
-    new_route["metadata"]["name"] = overlay_name + "-" + uid
-    new_route["metadata"]["labels"]["service"] = overlay_name + "-" + uid
-    new_route["metadata"]["labels"]["component"] = label
-    new_route["metadata"]["labels"]["discover"] = label + "-" + overlay_name
-    new_route["metadata"]["labels"]["overlay_name"] = overlay_name
-    new_route["spec"]["to"]["name"] = overlay_name + "-" + uid
+    new_route = _TEMPLATES.render(
+        Path(TEMPLATE_DIRECTORY).joinpath("route.yaml"),
+        {
+            "metadata.name": overlay_name + "-" + uid,
+            "metadata.labels.service": overlay_name + "-" + uid,
+            "metadata.labels.component": label,
+            "metadata.labels.discover": label + "-" + overlay_name,
+            "metadata.labels.overlay_name": overlay_name,
+            "spec.to.name": overlay_name + "-" + uid,
+        },
+    )
     _LOGGER.info(f"Updated Route: {new_route}")
+    return new_route
 
-    # Write Route YAML file
-    with io.open("/workspace/repo/customized_route.yaml", "w", encoding="utf8") as outfile:
-        yaml.dump(new_route, outfile, default_flow_style=False, allow_unicode=True)
 
-
-def _customize_service(label: str, uid: str, overlay_name: str = "") -> None:
+def _customize_service(label: str, uid: str, overlay_name: str = "") -> dict:
     """Customize Service."""
-    with open("/opt/app-root/src/manifests/template/service.yaml", "r") as stream:
-        service_loaded = yaml.safe_load(stream)
-
-    new_service = dict(service_loaded)
-    new_service["metadata"]["name"] = overlay_name + "-" + uid
-    new_service["metadata"]["labels"]["service"] = overlay_name + "-" + uid
-    new_service["metadata"]["labels"]["component"] = label
-    new_service["metadata"]["labels"]["overlay_name"] = overlay_name
-    new_service["spec"]["selector"]["service"] = overlay_name + "-" + uid
+    new_service = _TEMPLATES.render(
+        Path(TEMPLATE_DIRECTORY).joinpath("service.yaml"),
+        {
+            "metadata.name": overlay_name + "-" + uid,
+            "metadata.labels.service": overlay_name + "-" + uid,
+            "metadata.labels.component": label,
+            "metadata.labels.overlay_name": overlay_name,
+            "spec.selector.service": overlay_name + "-" + uid,
+        },
+    )
     _LOGGER.info(f"Updated Service: {new_service}")
+    return new_service
+
+
+def _write_manifests(objects: List[dict], output_directory: str, inputs: Dict[str, str]) -> bool:
+    """Write customized objects, as a single multi-document file if requested or as a file per object.
+
+    Files already holding the same objects rendered from the same inputs are not rewritten. Return True if
+    any file was written.
+    """
+    if MANIFESTS_OUTPUT_FILE:
+        return write_documents_if_changed(objects, os.path.join(output_directory, MANIFESTS_OUTPUT_FILE), inputs)
+
+    changed = False
+    for name, document in zip(("deploymentconfig", "route", "service"), objects):
+        path = os.path.join(output_directory, f"customized_{name}.yaml")
+        if write_documents_if_changed([document], path, inputs):
+            changed = True
+        else:
+            _LOGGER.info(f"File {path} is up to date, not rewritten")
+
+    return changed
+
+
+def _write_result(changed: bool) -> None:
+    """Record whether customized objects changed, so the pipeline can skip redeploying unchanged ones."""
+    result = "changed" if changed else "no-op"
+    _LOGGER.info(f"Customized objects result: {result}")
+
+    if not os.path.isdir(os.path.dirname(RESULT_FILE_PATH)):
+        _LOGGER.debug(f"Directory for result file {RESULT_FILE_PATH} does not exist, result not written")
+        return
+
+    with open(RESULT_FILE_PATH, "w") as result_file:
+        result_file.write(result)
+
+
+def _discover_overlays() -> List[str]:
+    """Find names of overlays in the repository, directories in manifests/overlays with a DeploymentConfig."""
+    path_overlays = Path.cwd().joinpath("manifests").joinpath("overlays")
+    if not path_overlays.is_dir():
+        return []
 
-    # Write Service YAML file
-    with io.open("/workspace/repo/customized_service.yaml", "w", encoding="utf8") as outfile:
-        yaml.dump(new_service, outfile, default_flow_style=False, allow_unicode=True)
+    overlays = []
+    for path in sorted(path_overlays.iterdir()):
+        if not path.is_dir():
+            continue
+
+        if not path.joinpath(DEPLOYMENT_CONFIG_NAME).is_file():
+            _LOGGER.warning(f"Skipping overlay {path.name!r}, no {DEPLOYMENT_CONFIG_NAME} found in it")
+            continue
+
+        overlays.append(path.name)
+
+    return overlays
+
+
+def _render_manifests(label: str, uid: str, overlay_name: str, output_directory: str) -> bool:
+    """Render and write customized objects for an overlay, return True if any of them changed."""
+    # Parse all templates once, objects rendered are deep copies of them.
+    _TEMPLATES.load_directory(TEMPLATE_DIRECTORY)
+
+    objects = [
+        _customize_deployment_config(label, uid, overlay_name),
+        _customize_route(label, uid, overlay_name),
+        _customize_service(label, uid, overlay_name),
+    ]
+
+    inputs = {"image_url": IMAGE_URL, "label": label, "uid": uid, "overlay_name": overlay_name}
+    os.makedirs(output_directory, exist_ok=True)
+    return _write_manifests(objects, output_directory, inputs)
+
+
+def _render_all_overlays(label: str, uid: str) -> Dict[str, bool]:
+    """Render customized objects for all overlays in parallel, map overlay names to whether they changed."""
+    overlays = _discover_overlays()
+    if not overlays:
+        _LOGGER.warning("No overlays found in manifests/overlays, nothing to render")
+        return {}
+
+    _LOGGER.info(f"Rendering {len(overlays)} overlays using {OVERLAYS_MAX_WORKERS} workers: {overlays}")
+
+    # Templates are loaded before starting workers so that forked workers reuse them.
+    _TEMPLATES.load_directory(TEMPLATE_DIRECTORY)
+
+    with ProcessPoolExecutor(max_workers=min(OVERLAYS_MAX_WORKERS, len(overlays))) as executor:
+        futures = {
+            overlay_name: executor.submit(
+                _render_manifests, label, uid, overlay_name, os.path.join(OUTPUT_DIRECTORY, overlay_name)
+            )
+            for overlay_name in overlays
+        }
+        changed = {overlay_name: future.result() for overlay_name, future in futures.items()}
+
+    for overlay_name, overlay_changed in changed.items():
+        output_directory = os.path.join(OUTPUT_DIRECTORY, overlay_name)
+        _LOGGER.info(
+            f"Customized objects for overlay {overlay_name!r} in {output_directory} "
+            + ("changed" if overlay_changed else "are up to date")
+        )
+
+    return changed
 
 
 def customize_manifests() -> None:
     """Customize manifests for deployment of the application."""
-    with open("/workspace/pr/pr.json") as f:
+    with open(PR_FILE_PATH) as f:
         pr_info = json.load(f)
 
     label = f'{pr_info["Base"]["Repo"]["Name"]}-pr-{pr_info["Number"]}'
@@ -121,14 +227,12 @@ def customize_manifests() -> None:
     long_id = uuid.uuid5(uuid.NAMESPACE_DNS, label)
     uid = str(long_id).split("-")[0]
 
-    # Handle DC
-    _customize_deployment_config(label, uid, OVERLAY_NAME)
-
-    # Handle Route YAMLfile
-    _customize_route(label, uid, OVERLAY_NAME)
+    if ALL_OVERLAYS:
+        changed = any(_render_all_overlays(label, uid).values())
+    else:
+        changed = _render_manifests(label, uid, OVERLAY_NAME, OUTPUT_DIRECTORY)
 
-    # Handle Service YAML file
-    _customize_service(label, uid, OVERLAY_NAME)
+    _write_result(changed)
 
 
 if __name__ == "__main__":
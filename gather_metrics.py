@@ -17,13 +17,33 @@
 
 """This script run in a pipeline task to execute test and gather metrics for a AI model deployed."""
 
+import fcntl
+import hashlib
 import os
 import logging
 import json
+import re
+import shlex
+import shutil
+import site
 import sys
 import subprocess
+import time
+import yaml
 
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+from pathlib import Path
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from thoth.pipeline_helpers.cache import CACHE_DIR
+from thoth.pipeline_helpers.metrics_stream import merge_metrics_files
+from thoth.pipeline_helpers.metrics_stream import read_metrics
 
 _DEBUG_LEVEL = bool(int(os.getenv("DEBUG_LEVEL", 0)))
 
@@ -38,62 +58,308 @@ RUNTIME_ENVIRONMENT_TEST = os.getenv("PIPELINE_HELPERS_TEST_RUNTIME_ENVIRONMENT_
 METRICS_FILE_PATH = os.getenv("PIPELINE_HELPERS_METRICS_FILE_PATH", "metrics.json")
 TEST_TYPE = os.getenv("PIPELINE_HELPERS_TEST_TYPE", "behave")
 TEST_NAME = os.environ["PIPELINE_HELPERS_TEST_NAME"]
+TEKTON_RESULTS_DIR = os.getenv("PIPELINE_HELPERS_TEKTON_RESULTS_DIR", "/tekton/results")
+# Number of subprocesses the feature files are split across, each shard writes its own metrics file.
+TEST_SHARDS = int(os.getenv("PIPELINE_HELPERS_TEST_SHARDS", 1))
+FEATURES_DIRECTORY = os.getenv("PIPELINE_HELPERS_FEATURES_DIRECTORY", "features")
+# Rules merging numbers reported by each shard, e.g. "accuracy=mean,warmup_seconds=max".
+SHARD_MERGE_RULES = dict(
+    (key.strip(), rule.strip())
+    for key, _, rule in (item.partition("=") for item in os.getenv("PIPELINE_HELPERS_SHARD_MERGE_RULES", "").split(","))
+    if key.strip()
+)
+# Reuse virtual environments with requirements installed, keyed by lock file and runtime environment.
+INSTALL_CACHE = bool(int(os.getenv("PIPELINE_HELPERS_INSTALL_CACHE", 1)))
+VENV_CACHE_DIR = os.getenv("PIPELINE_HELPERS_VENV_CACHE_DIR", os.path.join(CACHE_DIR, "venvs"))
+LOCK_FILE_PATH = os.getenv("PIPELINE_HELPERS_TEST_LOCK_FILE_PATH")  # type: Optional[str]
 
+_LOCK_FILE_NAMES = ("Pipfile.lock", "requirements.txt")
+_VENV_COMPLETE_MARKER = ".complete"
+
+
+def _find_lock_file() -> Optional[str]:
+    """Find lock file of the test runtime environment, in its overlay if overlays are used."""
+    if LOCK_FILE_PATH:
+        return LOCK_FILE_PATH
+
+    directory = "."
+    if RUNTIME_ENVIRONMENT_TEST and os.path.isfile(".thoth.yaml"):
+        with open(".thoth.yaml", "r") as config_file:
+            overlays_dir = (yaml.safe_load(config_file) or {}).get("overlays_dir")
+
+        if overlays_dir:
+            directory = os.path.join(overlays_dir, RUNTIME_ENVIRONMENT_TEST)
+
+    for lock_file_name in _LOCK_FILE_NAMES:
+        lock_file = os.path.join(directory, lock_file_name)
+        if os.path.isfile(lock_file):
+            return lock_file
+
+    return None
 
-def gather_metrics() -> None:
-    """Gather metrics running a test script created by data scientist."""
-    # Install requirements from test overlay.
-    args_env = ""
 
+def _install_cache_key(lock_file: str) -> str:
+    """Compute key of installed requirements from the lock file content, the runtime environment and interpreter."""
+    digest = hashlib.sha256()
+    for part in (RUNTIME_ENVIRONMENT_TEST or "", sys.version, sys.executable):
+        digest.update(part.encode("utf-8") + b"\0")
+    with open(lock_file, "rb") as lock:
+        digest.update(lock.read())
+
+    return digest.hexdigest()
+
+
+def _install_args() -> List[str]:
+    """Get arguments of thamos install for the test runtime environment."""
     if RUNTIME_ENVIRONMENT_TEST:
-        args_env = f" -r {RUNTIME_ENVIRONMENT_TEST}"
+        return ["install", "-r", RUNTIME_ENVIRONMENT_TEST]
 
-    args = [f"thamos install{args_env}"]
+    return ["install"]
 
+
+def _run_install(args: List[str]) -> None:
+    """Run a command installing packages, raise CalledProcessError logging its error output if it fails."""
     _LOGGER.info(f"Args to be used to install: {args}")
+    process_output = subprocess.run(args, capture_output=True)
+    _LOGGER.info(f"After installing packages: {process_output.stdout.decode('utf-8')}")
 
-    try:
-        process_output = subprocess.run(
-            args,
-            shell=True,
-            capture_output=True,
+    if process_output.returncode != 0:
+        _LOGGER.error(f"Installing packages failed: {process_output.stderr.decode('utf-8')}")
+        process_output.check_returncode()
+
+
+def _install_requirements() -> None:
+    """Install requirements of the test runtime environment in the current environment."""
+    _run_install(["thamos"] + _install_args())
+
+
+def _activate_virtualenv(venv_path: str) -> None:
+    """Make commands run later use the given virtual environment."""
+    os.environ["VIRTUAL_ENV"] = venv_path
+    os.environ["PATH"] = os.path.join(venv_path, "bin") + os.pathsep + os.getenv("PATH", "")
+
+
+def _create_virtualenv(venv_path: str) -> None:
+    """Create a virtual environment seeing packages of this interpreter, also when it runs in a virtual environment."""
+    # A virtual environment created from another one is based on the base interpreter and does not see packages
+    # of the outer one, such as thamos and behave, even with system site packages. Make them visible via a .pth file.
+    python = getattr(sys, "_base_executable", sys.executable)
+    subprocess.run([python, "-m", "venv", "--system-site-packages", venv_path], check=True)
+    if sys.prefix == sys.base_prefix:
+        return
+
+    process_output = subprocess.run(
+        [os.path.join(venv_path, "bin", "python"), "-c", "import sysconfig; print(sysconfig.get_paths()['purelib'])"],
+        capture_output=True,
+        check=True,
+    )
+    site_packages = process_output.stdout.decode("utf-8").strip()
+    with open(os.path.join(site_packages, "_pipeline_helpers_outer_venv.pth"), "w") as pth_file:
+        pth_file.write("".join(f"{path}\n" for path in site.getsitepackages()))
+
+
+@contextmanager
+def _locked(path: str) -> Iterator[None]:
+    """Hold an exclusive lock of the given lock file, waiting for other processes holding it."""
+    with open(path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _install_requirements_cached(lock_file: str) -> bool:
+    """Install requirements in a virtual environment cached by lock file, return True if it was reused."""
+    venv_path = os.path.join(VENV_CACHE_DIR, _install_cache_key(lock_file))
+    os.makedirs(VENV_CACHE_DIR, exist_ok=True)
+
+    # Runs sharing the cache wait for the one building the virtual environment, instead of replacing it.
+    with _locked(f"{venv_path}.lock"):
+        return _install_requirements_locked(lock_file, venv_path)
+
+
+def _install_requirements_locked(lock_file: str, venv_path: str) -> bool:
+    """Install requirements in the given virtual environment unless it is complete, the caller holds its lock."""
+    complete_marker = os.path.join(venv_path, _VENV_COMPLETE_MARKER)
+
+    if os.path.isfile(complete_marker):
+        _LOGGER.info(f"Reusing virtual environment {venv_path} with requirements from {lock_file} installed")
+        _activate_virtualenv(venv_path)
+        return True
+
+    # Virtual environments cannot be moved, build it in place and mark it complete once installed.
+    _LOGGER.info(f"No cached virtual environment for {lock_file}, creating {venv_path}")
+    shutil.rmtree(venv_path, ignore_errors=True)
+    _create_virtualenv(venv_path)
+
+    thamos = shutil.which("thamos")
+    if thamos is None:
+        raise FileNotFoundError("thamos is not installed")
+
+    # Running thamos with the interpreter of the virtual environment installs packages into it.
+    _run_install([os.path.join(venv_path, "bin", "python"), thamos] + _install_args())
+
+    with open(complete_marker, "w"):
+        pass
+
+    _activate_virtualenv(venv_path)
+    return False
+
+
+def _test_command(arguments: List[str]) -> List[str]:
+    """Get command running tests with the given arguments, Python scripts are run by the virtual environment used."""
+    command = shlex.split(TEST_TYPE) + arguments
+    venv_path = os.getenv("VIRTUAL_ENV")
+    executable = shutil.which(command[0])
+    if not venv_path or executable is None or os.path.dirname(executable) == os.path.join(venv_path, "bin"):
+        return command
+
+    # Scripts such as behave installed outside of the virtual environment would run with their own interpreter,
+    # which does not see requirements installed in the virtual environment.
+    with open(executable, "rb") as executable_file:
+        shebang = executable_file.readline()
+
+    if shebang.startswith(b"#!") and b"python" in shebang:
+        return [os.path.join(venv_path, "bin", "python"), executable] + command[1:]
+
+    return command
+
+
+def _shard_metrics_file_path(shard: int) -> str:
+    """Get path to the metrics file written by the given shard."""
+    root, extension = os.path.splitext(METRICS_FILE_PATH)
+    return f"{root}-shard-{shard}{extension}"
+
+
+def _split_feature_files(shards: int) -> List[List[str]]:
+    """Split feature files selected by the test name across shards, empty shards are dropped."""
+    pattern = re.compile(TEST_NAME)
+    feature_files = sorted(
+        str(path) for path in Path(FEATURES_DIRECTORY).rglob("*.feature") if pattern.search(str(path))
+    )
+    return [feature_files[shard::shards] for shard in range(shards) if feature_files[shard::shards]]
+
+
+def _run_shard(shard: int, feature_files: List[str]) -> Tuple[datetime, datetime]:
+    """Run tests of a shard writing its metrics to its own file, return start and end of the run."""
+    env = dict(
+        os.environ,
+        PIPELINE_HELPERS_METRICS_FILE_PATH=_shard_metrics_file_path(shard),
+        PIPELINE_HELPERS_TEST_SHARD=str(shard),
+    )
+    test_command = _test_command(feature_files)
+    _LOGGER.info(f"Executing command to gather metrics in shard {shard}... {' '.join(test_command)}")
+
+    start = datetime.utcnow()
+    subprocess.run(test_command, env=env, check=True)
+    end = datetime.utcnow()
+
+    _LOGGER.info(f"Finished running test in shard {shard} successfully.")
+    return start, end
+
+
+def _run_sharded_tests(shards: int) -> Tuple[datetime, datetime]:
+    """Run tests split across shards in parallel and merge their metrics, return start and end of the run."""
+    feature_files = _split_feature_files(shards)
+    if not feature_files:
+        raise ValueError(f"No feature files matching {TEST_NAME!r} found in {FEATURES_DIRECTORY}")
+
+    _LOGGER.info(f"Running tests in {len(feature_files)} shards: {feature_files}")
+    with ThreadPoolExecutor(max_workers=len(feature_files)) as executor:
+        futures = [executor.submit(_run_shard, shard, files) for shard, files in enumerate(feature_files)]
+        timestamps: Dict[int, Tuple[datetime, datetime]] = {
+            shard: future.result() for shard, future in enumerate(futures)
+        }
+
+    shard_metrics_files = [_shard_metrics_file_path(shard) for shard in timestamps]
+    missing = [path for path in shard_metrics_files if not os.path.isfile(path)]
+    if missing:
+        raise FileNotFoundError(
+            f"Shards did not write metrics files {missing}, tests must write metrics to the file"
+            " at PIPELINE_HELPERS_METRICS_FILE_PATH when run in shards"
+        )
+
+    merge_metrics_files(shard_metrics_files, METRICS_FILE_PATH, rules=SHARD_MERGE_RULES)
+
+    with open(os.path.join(TEKTON_RESULTS_DIR, "gather_shard_timestamps"), "w") as result_shards:
+        result_shards.write(
+            json.dumps(
+                [
+                    {
+                        "shard": shard,
+                        "started": datetime.timestamp(start),
+                        "ended": datetime.timestamp(end),
+                        "feature_files": feature_files[shard],
+                    }
+                    for shard, (start, end) in timestamps.items()
+                ]
+            )
         )
-        _LOGGER.info(f"After installing packages: {process_output.stdout.decode('utf-8')}")
 
-    except Exception as behave_feature:
-        _LOGGER.error("error installing packages: %r", behave_feature)
+    return min(start for start, _ in timestamps.values()), max(end for _, end in timestamps.values())
+
+
+def gather_metrics() -> None:
+    """Gather metrics running a test script created by data scientist."""
+    # Install requirements from test overlay.
+    install_start = time.monotonic()
+    lock_file = _find_lock_file() if INSTALL_CACHE else None
+
+    try:
+        if lock_file:
+            _install_requirements_cached(lock_file)
+        else:
+            if INSTALL_CACHE:
+                _LOGGER.info("No lock file found for the test runtime environment, installing without cache")
+            _install_requirements()
+
+    except Exception as exc:
+        _LOGGER.error("error installing packages: %r", exc)
         sys.exit(1)
 
-    # Execute the supplied script.
-    test_command = f"{TEST_TYPE} -i {TEST_NAME}"
-    _LOGGER.info(f"Executing command to gather metrics... {test_command}")
+    install_duration = time.monotonic() - install_start
+    _LOGGER.info(f"Installing packages took {install_duration:.1f}s")
 
+    # Execute the supplied script.
     try:
-        start = datetime.utcnow()
-        subprocess.run(test_command, shell=True, check=True)
+        if TEST_SHARDS > 1:
+            start, end = _run_sharded_tests(TEST_SHARDS)
+        else:
+            test_command = _test_command(["-i", TEST_NAME])
+            _LOGGER.info(f"Executing command to gather metrics... {' '.join(test_command)}")
+            start = datetime.utcnow()
+            subprocess.run(test_command, check=True)
+            end = datetime.utcnow()
+
         _LOGGER.info("Finished running test successfully.")
-        end = datetime.utcnow()
 
     except Exception as exc:
         _LOGGER.error("Error running test: %r", exc)
         sys.exit(1)
 
-    # Load metrics from file created by behave.
-    with open(METRICS_FILE_PATH, "r") as stdout_file:
-        try:
-            stdout = json.load(stdout_file)
-        except Exception as exc:
-            _LOGGER.error(f"Error loading metrics: {exc}")
-            sys.exit(1)
-        _LOGGER.info(f"Metrics collected are {stdout}")
+    # Load metrics from file created by behave, series of numbers are summarized while reading.
+    try:
+        metrics = read_metrics(METRICS_FILE_PATH)
+    except Exception as exc:
+        _LOGGER.error(f"Error loading metrics: {exc}")
+        sys.exit(1)
+    _LOGGER.info(f"Metrics collected are {metrics}")
 
     # Store timestamps for platform metrics.
-    with open("/tekton/results/gather_timestamp_started", "w") as result_start:
+    with open(os.path.join(TEKTON_RESULTS_DIR, "gather_timestamp_started"), "w") as result_start:
         result_start.write(json.dumps(datetime.timestamp(start)))
 
-    with open("/tekton/results/gather_timestamp_ended", "w") as result_end:
+    with open(os.path.join(TEKTON_RESULTS_DIR, "gather_timestamp_ended"), "w") as result_end:
         result_end.write(json.dumps(datetime.timestamp(end)))
 
+    # Store durations of steps, to tell installation time from test time.
+    with open(os.path.join(TEKTON_RESULTS_DIR, "install_duration_seconds"), "w") as result_install:
+        result_install.write(json.dumps(round(install_duration, 3)))
+
+    with open(os.path.join(TEKTON_RESULTS_DIR, "test_duration_seconds"), "w") as result_test:
+        result_test.write(json.dumps(round((end - start).total_seconds(), 3)))
+
 
 if __name__ == "__main__":
     gather_metrics()
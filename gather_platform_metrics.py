@@ -22,8 +22,6 @@ import logging
 import json
 from datetime import datetime
 
-from prometheus_api_client import PrometheusConnect
-
 _DEBUG_LEVEL = bool(int(os.getenv("DEBUG_LEVEL", 0)))
 
 if _DEBUG_LEVEL:
@@ -39,10 +37,24 @@ THANOS_ACCESS_TOKEN = os.environ["THANOS_ACCESS_TOKEN"]
 POD_NAME = os.environ["PIPELINE_HELPERS_POD_NAME"]
 PLATFORM_METRICS_FILE_PATH = os.getenv("PIPELINE_HELPERS_PLATFORM_METRICS_FILE_PATH", "platform_metrics.json")
 DEPLOYMENT_NAMESPACE = os.getenv("PIPELINE_HELPERS_DEPLOYMENT_NAMESPACE", "aicoe-ci")
+TEKTON_RESULTS_DIR = os.getenv("PIPELINE_HELPERS_TEKTON_RESULTS_DIR", "/tekton/results")
+QUERY_STEP = os.getenv("PIPELINE_HELPERS_QUERY_STEP")  # chosen from the gather window if not set
+MAX_WORKERS = int(os.getenv("PIPELINE_HELPERS_MAX_WORKERS", 4))
+CATALOGUE_FILE_PATH = os.getenv(
+    "PIPELINE_HELPERS_PLATFORM_METRICS_CATALOGUE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "manifests", "platform_metrics.yaml"),
+)
 
 
 def gather_platform_metrics() -> None:
     """Gather platform metrics from Openshift API (scraped by Prometheus)."""
+    from prometheus_api_client import PrometheusConnect
+    from thoth.pipeline_helpers.platform import load_catalogue
+    from thoth.pipeline_helpers.platform import not_available
+
+    catalogue = load_catalogue(CATALOGUE_FILE_PATH)
+    _LOGGER.info("Gathering %d platform metrics from catalogue %r", len(catalogue), CATALOGUE_FILE_PATH)
+
     is_connected = False
 
     try:
@@ -56,12 +68,15 @@ def gather_platform_metrics() -> None:
         _LOGGER.warning(exc)
 
     if is_connected:
+        from thoth.pipeline_helpers.cache import DiskCache
+        from thoth.pipeline_helpers.platform import gather_catalogue_metrics
+
         # Store timestamps for platform metrics.
-        with open("/tekton/results/gather_timestamp_started", "r") as result_start:
+        with open(os.path.join(TEKTON_RESULTS_DIR, "gather_timestamp_started"), "r") as result_start:
             starttime = json.load(result_start)
             start = datetime.fromtimestamp(starttime)
 
-        with open("/tekton/results/gather_timestamp_ended", "r") as result_end:
+        with open(os.path.join(TEKTON_RESULTS_DIR, "gather_timestamp_ended"), "r") as result_end:
             endtime = json.load(result_end)
             end = datetime.fromtimestamp(endtime)
 
@@ -71,40 +86,23 @@ def gather_platform_metrics() -> None:
         _LOGGER.info("Considering namespace %r", DEPLOYMENT_NAMESPACE)
         _LOGGER.info("Considering pod name %r", POD_NAME)
 
-        # Memory usage
-        query_labels = f'{{namespace="{DEPLOYMENT_NAMESPACE}", container!="prometheus-proxy", pod="{POD_NAME}"}}'
-        query = f"sum(container_memory_working_set_bytes{query_labels}) by (pod)"
-        memory_usage = pc.custom_query_range(  # type: ignore
-            query=query,
-            start_time=start,
-            end_time=end,
-            step="1h",
-        )
-        _LOGGER.info("Memory Usage %r", memory_usage)
-
-        # CPU usage
-        query_labels = f'{{namespace="{DEPLOYMENT_NAMESPACE}", container!="prometheus-proxy", pod="{POD_NAME}"}}'
-        query = f"sum(node_namespace_pod_container:container_cpu_usage_seconds_total:sum_rate{query_labels}) by (pod)"
-        cpu_usage = pc.custom_query_range(  # type: ignore
-            query=query,
-            start_time=start,
-            end_time=end,
-            step="1h",
+        labels = {
+            "labels": f'{{namespace="{DEPLOYMENT_NAMESPACE}", container!="prometheus-proxy", pod="{POD_NAME}"}}',
+            "pod_labels": f'{{namespace="{DEPLOYMENT_NAMESPACE}", pod="{POD_NAME}"}}',
+        }
+        metric_data = gather_catalogue_metrics(
+            pc,
+            catalogue,
+            labels,
+            start,
+            end,
+            step=QUERY_STEP,
+            cache=DiskCache("platform-metrics"),
+            max_workers=MAX_WORKERS,
         )
-        _LOGGER.info("CPU Usage %r", cpu_usage)
-
-        if memory_usage and cpu_usage:
-            memory_usage_vector = [float(v[1]) / 1000000 for v in memory_usage[0]["values"] if float(v[1]) > 0]  # in MB
-            cpu_usage_vector = [float(v[1]) for v in cpu_usage[0]["values"] if float(v[1]) > 0]
-            metric_data = {
-                "CPU max usage": round(max(cpu_usage_vector), 4),
-                "Memory max usage": f"{round(max(memory_usage_vector))}Mi",
-            }
-        else:
-            metric_data = {"CPU max usage": "N/A", "Memory max usage": "N/A"}
     else:
         _LOGGER.warning("Pipeline is not able to gather metrics from platform!")
-        metric_data = {"CPU max usage": "N/A", "Memory max usage": "N/A"}
+        metric_data = not_available(catalogue)
 
     _LOGGER.info("Platform metrics: %r", metric_data)
 
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# pipeline-helpers
+# Copyright(C) 2022 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""This script converts metrics documents stored for a repository to the configured storage format."""
+
+import os
+import logging
+import json
+
+from thoth.pipeline_helpers.common import create_s3_adapter
+from thoth.pipeline_helpers.storage import STORAGE_FORMAT
+from thoth.pipeline_helpers.storage import migrate_documents
+
+_DEBUG_LEVEL = bool(int(os.getenv("DEBUG_LEVEL", 0)))
+
+if _DEBUG_LEVEL:
+    logging.basicConfig(level=logging.DEBUG)
+else:
+    logging.basicConfig(level=logging.INFO)
+
+_LOGGER = logging.getLogger("thoth.migrate_metrics_storage")
+
+DEPLOYMENT_NAMESPACE = os.getenv("PIPELINE_HELPERS_DEPLOYMENT_NAMESPACE", "aicoe-ci")
+PR_FILE_PATH = os.getenv("PIPELINE_HELPERS_PR_FILE_PATH", "/workspace/pr/pr.json")
+MIGRATION_DELETE_SOURCE = bool(int(os.getenv("PIPELINE_HELPERS_MIGRATION_DELETE_SOURCE", 0)))
+
+
+def migrate_metrics_storage() -> None:
+    """Convert processed and aggregated metrics documents of a repository to the configured storage format."""
+    with open(PR_FILE_PATH) as f:
+        pr_info = json.load(f)
+
+    repo = pr_info["Base"]["Repo"]["FullName"]
+
+    ceph_adapter = create_s3_adapter(
+        ceph_bucket_prefix="data",
+        deployment_name=DEPLOYMENT_NAMESPACE,
+        repo=repo,
+    )
+    ceph_adapter.connect()
+
+    for document_name in ("processed_metrics", "aggregated_metrics"):
+        migrated = migrate_documents(ceph_adapter, document_name, STORAGE_FORMAT, delete_source=MIGRATION_DELETE_SOURCE)
+        _LOGGER.info(f"Converted {migrated} {document_name} documents of {repo} to {STORAGE_FORMAT}")
+
+
+if __name__ == "__main__":
+    migrate_metrics_storage()
@@ -20,8 +20,15 @@
 import os
 import logging
 import json
+from typing import Optional
 
 from thoth.pipeline_helpers.common import create_s3_adapter
+from thoth.pipeline_helpers.common import get_deployment_metrics_prefix
+from thoth.pipeline_helpers.instrumentation import CEPH_CONNECT
+from thoth.pipeline_helpers.instrumentation import span
+from thoth.pipeline_helpers.metrics_stream import read_metrics
+from thoth.pipeline_helpers.spool import WriteSpool
+from thoth.pipeline_helpers.storage import update_stored_document
 
 _DEBUG_LEVEL = bool(int(os.getenv("DEBUG_LEVEL", 0)))
 
@@ -39,6 +46,7 @@ PLATFORM_METRICS_FILE_PATH = os.getenv("PIPELINE_HELPERS_PLATFORM_METRICS_FILE_P
 PR_FILE_PATH = os.getenv("PIPELINE_HELPERS_PR_FILE_PATH", "/workspace/pr/pr.json")
 PR_REPO_URL = os.environ["REPO_URL"]
 PR_COMMIT_SHA = os.environ["COMMIT_SHA"]
+UPDATE_RETRIES = int(os.getenv("PIPELINE_HELPERS_UPDATE_RETRIES", 5))
 
 
 def post_process_metrics() -> None:
@@ -57,9 +65,9 @@ def post_process_metrics() -> None:
         model_version = model_version + f"-{OVERLAY_NAME}"
         overlay_name = OVERLAY_NAME
 
-    with open(METRICS_FILE_PATH) as f:
-        metrics = json.load(f)
-        metrics["model_version"] = model_version
+    # Series of numbers (e.g. latencies of each request) are stored as "<metric> <statistic>" summaries.
+    metrics = read_metrics(METRICS_FILE_PATH, flatten=True)
+    metrics["model_version"] = model_version
 
     # Platform metrics
     with open(PLATFORM_METRICS_FILE_PATH) as f:
@@ -73,45 +81,62 @@ def post_process_metrics() -> None:
             pr_number=str(pr_info["Number"]),
             overlay_name=overlay_name,
         )
-        ceph_adapter.connect()
+        with span(CEPH_CONNECT):
+            ceph_adapter.connect()
         is_connected = True
     except Exception as exc:
         _LOGGER.warning(exc)
         is_connected = False
 
-    document_exist = False
-
-    if is_connected:
-        # Check if document exists
-        document_exist = ceph_adapter.document_exists(document_id=document_id)
-        _LOGGER.info(f"Document retrieval status: {document_exist}")
-
-    # All metrics
-    metrics_data = {}
-
-    if document_exist:
-        _LOGGER.info(f"Found data for {repo} in {document_id}!")
-
-        metrics_data = ceph_adapter.retrieve_document(document_id)
-        _LOGGER.info(f"Retrieved data: {metrics_data}")
-    else:
-        _LOGGER.info(f"Did not find data for {repo} in {document_id}!")
-
     info_metrics = {
         "test URL": f"{PR_REPO_URL}/blob/{PR_COMMIT_SHA}/features",
         "namespace deployment": DEPLOYMENT_NAMESPACE,
     }
+    processed_metrics = {
+        "model_version": model_version,
+        "info_metrics": info_metrics,
+        "model_application_metrics": metrics,
+        "platform_metrics": platform_metrics,
+    }
+
+    def update_metrics(metrics_data: Optional[dict]) -> dict:
+        """Update metrics stored for the PR, if any, with metrics processed."""
+        if metrics_data is None:
+            _LOGGER.info(f"Did not find data for {repo} in {document_id}!")
+            metrics_data = {}
+        else:
+            _LOGGER.info(f"Found data for {repo} in {document_id}!")
+            _LOGGER.info(f"Retrieved data: {metrics_data}")
 
-    metrics_data["model_version"] = model_version
-    metrics_data["info_metrics"] = info_metrics
-    metrics_data["model_application_metrics"] = metrics
-    metrics_data["platform_metrics"] = platform_metrics
+        metrics_data.update(processed_metrics)
 
-    _LOGGER.info(f"Processed data to be stored: {metrics_data}")
+        _LOGGER.info(f"Processed data to be stored: {metrics_data}")
+        return metrics_data
 
-    # Store on ceph
+    # Writes spooled while Ceph was not available are replayed first, so they do not override newer ones.
+    spool = WriteSpool()
     if is_connected:
-        ceph_adapter.store_document(metrics_data, document_id)
+        try:
+            spool.flush()
+        except Exception as exc:
+            _LOGGER.warning(f"Failed to replay spooled writes: {exc}")
+
+    # Store on ceph, concurrent runs for the same PR and overlay do not overwrite each other's updates.
+    if is_connected:
+        try:
+            update_stored_document(ceph_adapter, document_id, update_metrics, retries=UPDATE_RETRIES)
+            return
+        except Exception as exc:
+            _LOGGER.warning(f"Failed to store {document_id}: {exc}")
+    else:
+        update_metrics(None)
+
+    # Metrics are kept locally and stored once Ceph is reachable again.
+    spool.merge(
+        get_deployment_metrics_prefix("data", DEPLOYMENT_NAMESPACE, repo, str(pr_info["Number"]), overlay_name),
+        document_id,
+        processed_metrics,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# pipeline-helpers
+# Copyright(C) 2022 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests of the entry point of pipeline helpers."""
+
+import os
+import sys
+
+import pytest
+
+from thoth.pipeline_helpers import cli
+from thoth.pipeline_helpers.cli import measure_import_time
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules loaded only by helpers or code paths needing them.
+HEAVY_MODULES = ("pandas", "thoth.storages", "prometheus_api_client")
+
+
+@pytest.mark.parametrize("module", ["aggregate_metrics_results", "post_process_metrics", "gather_platform_metrics"])
+def test_import_does_not_load_heavy_modules(module, monkeypatch):
+    """Test importing a helper does not load modules which are slow to import."""
+    monkeypatch.chdir(REPOSITORY_ROOT)
+    for name in ("REPO_URL", "COMMIT_SHA", "THANOS_ENDPOINT", "THANOS_ACCESS_TOKEN", "PIPELINE_HELPERS_POD_NAME"):
+        monkeypatch.setenv(name, "test")
+
+    total, imports = measure_import_time(module, max_depth=None)
+
+    assert total > 0 and imports
+    heavy = [
+        name for name, _ in imports if any(name == heavy or name.startswith(f"{heavy}.") for heavy in HEAVY_MODULES)
+    ]
+    assert not heavy
+
+
+def test_main_outside_repository(tmp_path, monkeypatch):
+    """Test helpers are found when run from another working directory, such as the model repository."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "path", [path for path in sys.path if path not in ("", ".", REPOSITORY_ROOT)])
+    monkeypatch.delitem(sys.modules, "gather_metrics", raising=False)
+    monkeypatch.setenv("PIPELINE_HELPERS_TEST_NAME", "test")
+    monkeypatch.setitem(cli.HELPERS, "install-args", ("gather_metrics", "_install_args"))
+
+    cli.main(["install-args"])
+
+    assert os.path.dirname(os.path.abspath(sys.modules["gather_metrics"].__file__)) == REPOSITORY_ROOT
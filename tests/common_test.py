@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# pipeline-helpers
+# Copyright(C) 2022 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of Ceph helpers shared by pipeline helpers."""
+
+import random
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+import pytest
+
+from thoth.pipeline_helpers.common import ConcurrentUpdateError
+from thoth.pipeline_helpers.common import list_documents
+from thoth.pipeline_helpers.common import retrieve_documents
+from thoth.pipeline_helpers.common import update_document
+
+
+def test_retrieve_documents_ordered_with_retries(ceph_adapter, monkeypatch):
+    """Test documents retrieved concurrently are yielded in order, transient failures are retried."""
+    document_ids = [f"{pr}/cpu/metrics.json" for pr in range(40)]
+    for number, document_id in enumerate(document_ids):
+        ceph_adapter.store_document({"number": number}, document_id)
+
+    retrieve_document = ceph_adapter.retrieve_document
+    attempts: Counter = Counter()
+    lock = threading.Lock()
+
+    def flaky_retrieve_document(document_id: str) -> dict:
+        with lock:
+            attempts[document_id] += 1
+            attempt = attempts[document_id]
+        # Retrievals finish out of order, every third document fails on its first attempt.
+        time.sleep(random.uniform(0, 0.01))  # noqa: S311
+        if attempt == 1 and document_ids.index(document_id) % 3 == 0:
+            raise ConnectionError("connection reset")
+        return retrieve_document(document_id)
+
+    monkeypatch.setattr(ceph_adapter, "retrieve_document", flaky_retrieve_document)
+
+    retrieved = list(retrieve_documents(ceph_adapter, iter(document_ids), max_workers=4, retries=2, backoff=0))
+
+    assert [document_id for document_id, _ in retrieved] == document_ids
+    assert [document["number"] for _, document in retrieved] == list(range(len(document_ids)))
+    assert attempts == {document_id: 2 if number % 3 == 0 else 1 for number, document_id in enumerate(document_ids)}
+
+
+def test_retrieve_documents_gives_up(ceph_adapter, monkeypatch):
+    """Test retrieval fails once retries are exhausted, and missing documents are not retried."""
+    from thoth.storages.exceptions import NotFoundError
+
+    attempts: Counter = Counter()
+
+    def failing_retrieve_document(document_id: str) -> dict:
+        attempts[document_id] += 1
+        raise ConnectionError("connection reset")
+
+    with pytest.raises(NotFoundError):
+        list(retrieve_documents(ceph_adapter, ["missing.json"], retries=2, backoff=0))
+
+    monkeypatch.setattr(ceph_adapter, "retrieve_document", failing_retrieve_document)
+    with pytest.raises(ConnectionError):
+        list(retrieve_documents(ceph_adapter, ["metrics.json"], retries=2, backoff=0))
+
+    assert attempts == {"metrics.json": 3}
+
+
+def test_list_documents_prefix_and_pagination(ceph_adapter):
+    """Test documents are listed across pages, restricted to the given PR and overlay and matched on their name."""
+    for pr in ("1", "2", "10"):
+        for overlay in ("cpu", "gpu"):
+            for name in ("metrics.json", "processed.json"):
+                ceph_adapter.store_document({}, f"{pr}/{overlay}/{name}")
+    # Same prefix as the repository adapter, but a different repository.
+    ceph_adapter._s3.Object(ceph_adapter.bucket, ceph_adapter.prefix.rstrip("/") + "-other/1/cpu/metrics.json").put(
+        Body=b"{}"
+    )
+
+    listed = list(list_documents(ceph_adapter, "metrics.json", page_size=2))
+    assert [document_id for document_id, _, _ in listed] == [
+        f"{pr}/{overlay}/metrics.json" for pr in ("1", "10", "2") for overlay in ("cpu", "gpu")
+    ]
+    assert all(etag.startswith('"') and last_modified for _, etag, last_modified in listed)
+
+    listed_pr = [document_id for document_id, _, _ in list_documents(ceph_adapter, pr_number="1", page_size=1)]
+    assert listed_pr == [
+        f"1/{overlay}/{name}" for overlay in ("cpu", "gpu") for name in ("metrics.json", "processed.json")
+    ]
+
+    listed_overlay = list(list_documents(ceph_adapter, "processed.json", pr_number="2", overlay_name="gpu"))
+    assert [document_id for document_id, _, _ in listed_overlay] == ["2/gpu/processed.json"]
+
+
+def test_update_document(ceph_adapter):
+    """Test a document is created if it is not stored and updated otherwise."""
+    seen = []
+
+    def update(document: Optional[dict]) -> dict:
+        seen.append(document)
+        return {"count": (document or {}).get("count", 0) + 1}
+
+    assert update_document(ceph_adapter, "1/cpu/processed.json", update) == {"count": 1}
+    assert update_document(ceph_adapter, "1/cpu/processed.json", update) == {"count": 2}
+    assert seen == [None, {"count": 1}]
+    assert ceph_adapter.retrieve_document("1/cpu/processed.json") == {"count": 2}
+
+
+@pytest.mark.usefixtures("conditional_writes")
+def test_update_document_conflict_retry(ceph_adapter):
+    """Test an update is applied again to the document stored concurrently instead of overwriting it."""
+    ceph_adapter.store_document({"gather": 1}, "processed.json")
+    seen = []
+
+    def update(document: Optional[dict]) -> dict:
+        seen.append(document)
+        if len(seen) == 1:
+            # Another run stores its metrics between reading and storing the document.
+            ceph_adapter.store_document({"gather": 1, "platform": 2}, "processed.json")
+        return {**(document or {}), "aggregate": 3}
+
+    updated = update_document(ceph_adapter, "processed.json", update, backoff=0)
+
+    assert seen == [{"gather": 1}, {"gather": 1, "platform": 2}]
+    assert updated == {"gather": 1, "platform": 2, "aggregate": 3}
+    assert ceph_adapter.retrieve_document("processed.json") == updated
+
+
+@pytest.mark.usefixtures("conditional_writes")
+def test_update_document_conflict_on_creation(ceph_adapter):
+    """Test a document created concurrently is not overwritten by an update creating it."""
+    seen = []
+
+    def update(document: Optional[dict]) -> dict:
+        seen.append(document)
+        if document is None:
+            ceph_adapter.store_document({"gather": 1}, "processed.json")
+        return {**(document or {}), "aggregate": 3}
+
+    assert update_document(ceph_adapter, "processed.json", update, backoff=0) == {"gather": 1, "aggregate": 3}
+    assert seen == [None, {"gather": 1}]
+
+
+@pytest.mark.usefixtures("conditional_writes")
+def test_update_document_conflict_exhausted(ceph_adapter):
+    """Test an update changed concurrently on every attempt fails after the given number of retries."""
+    ceph_adapter.store_document({"version": 0}, "processed.json")
+    calls = []
+
+    def update(document: Optional[dict]) -> dict:
+        calls.append(document)
+        ceph_adapter.store_document({"version": len(calls)}, "processed.json")
+        return {"version": -1}
+
+    with pytest.raises(ConcurrentUpdateError):
+        update_document(ceph_adapter, "processed.json", update, retries=2, backoff=0)
+
+    assert len(calls) == 3
+    assert ceph_adapter.retrieve_document("processed.json") == {"version": 3}
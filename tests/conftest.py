@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# pipeline-helpers
+# Copyright(C) 2022 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Fixtures shared by tests."""
+
+from typing import Iterator
+from typing import TYPE_CHECKING
+
+import pytest
+
+if TYPE_CHECKING:
+    from thoth.storages import CephStore
+
+BUCKET = "thoth"
+PREFIX = "data/thoth/deployment-metrics/repo/"
+
+
+@pytest.fixture
+def ceph_adapter(monkeypatch: pytest.MonkeyPatch) -> Iterator["CephStore"]:
+    """Get a connected Ceph adapter for PREFIX in an empty bucket of a mocked S3."""
+    import boto3
+    from moto import mock_aws
+    from thoth.storages import CephStore
+
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+        monkeypatch.setenv(name, "testing")
+
+    with mock_aws():
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket=BUCKET)
+        adapter = CephStore(
+            PREFIX,
+            host="https://s3.amazonaws.com",
+            key_id="testing",
+            secret_key="testing",
+            bucket=BUCKET,
+            region="us-east-1",
+        )
+        adapter.connect()
+        yield adapter
+
+
+@pytest.fixture
+def conditional_writes(ceph_adapter: "CephStore") -> None:
+    """Skip the test if the mocked S3 does not reject conditional writes that fail, as older moto releases."""
+    import moto
+    from botocore.exceptions import ClientError
+    from thoth.pipeline_helpers.common import _put_object
+
+    key = f"{ceph_adapter.prefix}conditional-write-check"
+    _put_object(ceph_adapter, key, b"{}")
+    try:
+        _put_object(ceph_adapter, key, b"{}", IfMatch='"stale"')
+    except ClientError:
+        return
+    finally:
+        ceph_adapter._s3.Object(ceph_adapter.bucket, key).delete()
+
+    pytest.skip(f"moto {moto.__version__} does not support conditional writes of objects")
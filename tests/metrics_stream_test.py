@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# pipeline-helpers
+# Copyright(C) 2022 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests of reading and merging metrics files produced by tests."""
+
+import json
+
+import pytest
+
+from thoth.pipeline_helpers import metrics_stream
+from thoth.pipeline_helpers.metrics_stream import merge_metrics_files
+from thoth.pipeline_helpers.metrics_stream import read_metrics
+
+
+def _write_shards(tmp_path, suffix, *shards):
+    """Write metrics of shards, JSON lines files get one line per item of the given lists."""
+    paths = []
+    for index, shard in enumerate(shards):
+        path = tmp_path / f"metrics-shard-{index}{suffix}"
+        if suffix == ".jsonl":
+            path.write_text("".join(json.dumps(line) + "\n" for line in shard))
+        else:
+            path.write_text(json.dumps(shard))
+        paths.append(str(path))
+    return paths
+
+
+def test_read_metrics_summarizes_series(tmp_path):
+    """Test arrays of numbers are summarized while other values are kept."""
+    (path,) = _write_shards(tmp_path, ".json", {"name": "model", "latency": [1, 2, 3, 4], "labels": ["a", 1]})
+
+    assert read_metrics(path) == {
+        "name": "model",
+        "latency": pytest.approx(
+            {"count": 4, "min": 1.0, "max": 4.0, "mean": 2.5, "p50": 2.5, "p95": 3.85, "p99": 3.97}
+        ),
+        "labels": ["a", 1],
+    }
+    assert read_metrics(path, flatten=True)["latency p95"] == pytest.approx(3.85)
+
+
+def test_merge_metrics_files(tmp_path):
+    """Test counters are summed, equal numbers kept, differing numbers kept as a series and arrays concatenated."""
+    paths = _write_shards(
+        tmp_path,
+        ".json",
+        {"name": "model", "number_of_inferences": 10, "batch": 8, "average_latency": 0.1, "latency": [1, 2]},
+        {"name": "model", "number_of_inferences": 12, "batch": 8, "average_latency": 0.3, "latency": [3]},
+    )
+    output_path = str(tmp_path / "metrics.json")
+
+    merge_metrics_files(paths, output_path)
+
+    assert json.loads((tmp_path / "metrics.json").read_text()) == {
+        "name": "model",
+        "number_of_inferences": 22,
+        "batch": 8,
+        "average_latency": [0.1, 0.3],
+        "latency": [1.0, 2.0, 3.0],
+    }
+    merged = read_metrics(output_path, flatten=True)
+    assert merged["number_of_inferences"] == 22
+    assert merged["latency count"] == 3
+    assert merged["average_latency mean"] == pytest.approx(0.2)
+
+
+def test_merge_metrics_files_rules(tmp_path):
+    """Test numbers are merged by the rules given for their keys."""
+    paths = _write_shards(
+        tmp_path,
+        ".json",
+        {"accuracy": 0.5, "number_of_inferences": 10, "warmup": 1},
+        {"accuracy": 0.7, "number_of_inferences": 12, "warmup": 3},
+    )
+    output_path = str(tmp_path / "metrics.json")
+
+    merge_metrics_files(
+        paths, output_path, rules={"accuracy": "mean", "number_of_inferences": "first", "warmup": "max"}
+    )
+
+    assert json.loads((tmp_path / "metrics.json").read_text()) == {
+        "accuracy": pytest.approx(0.6),
+        "number_of_inferences": 10,
+        "warmup": 3,
+    }
+
+    with pytest.raises(ValueError):
+        merge_metrics_files(paths, output_path, rules={"accuracy": "median"})
+
+
+def test_merge_json_lines_files(tmp_path):
+    """Test JSON lines files merge the same way, series spanning lines are written in chunks."""
+    paths = _write_shards(
+        tmp_path,
+        ".jsonl",
+        [{"name": "model", "number_of_inferences": 2}, {"latency": 1}, {"latency": 2}],
+        [{"name": "model", "number_of_inferences": 1}, {"latency": 5}],
+    )
+    output_path = str(tmp_path / "metrics.jsonl")
+
+    merge_metrics_files(paths, output_path)
+
+    assert read_metrics(output_path, flatten=True) == {
+        "name": "model",
+        "number_of_inferences": 3,
+        "latency count": 3,
+        "latency min": 1.0,
+        "latency max": 5.0,
+        "latency mean": pytest.approx(8 / 3),
+        "latency p50": 2.0,
+        "latency p95": pytest.approx(4.7),
+        "latency p99": pytest.approx(4.94),
+    }
+
+
+def test_merge_metrics_files_streams_shards(tmp_path, monkeypatch):
+    """Test shards are not loaded at once, large arrays are read and written in chunks."""
+
+    def load(*args, **kwargs):
+        raise AssertionError("metrics file loaded at once")
+
+    monkeypatch.setattr(metrics_stream.json, "load", load)
+    monkeypatch.setattr(metrics_stream, "_WRITE_CHUNK_SIZE", 7)
+    latencies = [number / 10 for number in range(100)]
+    paths = _write_shards(tmp_path, ".json", {"latency": latencies[:60]}, {"latency": latencies[60:]})
+    output_path = str(tmp_path / "metrics.json")
+
+    merge_metrics_files(paths, output_path)
+
+    assert json.loads((tmp_path / "metrics.json").read_text()) == {"latency": latencies}
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# pipeline-helpers
+# Copyright(C) 2022 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests of path queries locating fields in documents."""
+
+import pytest
+
+from thoth.pipeline_helpers.path_query import compile_query
+from thoth.pipeline_helpers.path_query import find
+from thoth.pipeline_helpers.path_query import get_value
+from thoth.pipeline_helpers.path_query import set_values
+
+DOCUMENT = {
+    "metadata": {"name": "model", "labels": {"app.kubernetes.io/name": "model"}},
+    "build": [
+        {"image-name": "a", "base-image": "quay.io/a:v0.1.0"},
+        {"image-name": "b", "base-image": "quay.io/b:v0.2.0", "nested": {"base-image": "quay.io/c:v0.3.0"}},
+    ],
+    "base-image": "quay.io/root:v1.0.0",
+}
+
+
+def test_compile_query():
+    """Test queries are compiled once and invalid queries are rejected."""
+    assert compile_query("metadata.name") is compile_query("metadata.name")
+    assert len(compile_query('**["base-image"]').segments) == 2
+    assert len(compile_query("build[0].*").segments) == 3
+
+    for query in ("", ".metadata", "metadata..name", "metadata[name]", "build.[0]", "metadata name]"):
+        with pytest.raises(ValueError):
+            compile_query(query)
+
+
+def test_find():
+    """Test paths are found in document order, with values found on them."""
+    assert list(find(DOCUMENT, "metadata.name")) == [(["metadata", "name"], "model")]
+    assert list(find(DOCUMENT, 'metadata.labels["app.kubernetes.io/name"]')) == [
+        (["metadata", "labels", "app.kubernetes.io/name"], "model")
+    ]
+    assert [path for path, _ in find(DOCUMENT, "build[*].image-name")] == [
+        ["build", 0, "image-name"],
+        ["build", 1, "image-name"],
+    ]
+    assert [value for _, value in find(DOCUMENT, "build[1].*")] == [
+        "b",
+        "quay.io/b:v0.2.0",
+        {"base-image": "quay.io/c:v0.3.0"},
+    ]
+    # A recursive segment matches any number of levels, including none.
+    assert [path for path, _ in find(DOCUMENT, "**.base-image")] == [
+        ["build", 0, "base-image"],
+        ["build", 1, "base-image"],
+        ["build", 1, "nested", "base-image"],
+        ["base-image"],
+    ]
+    assert [path for path, _ in find(DOCUMENT, "build.**.base-image")] == [
+        ["build", 0, "base-image"],
+        ["build", 1, "base-image"],
+        ["build", 1, "nested", "base-image"],
+    ]
+    assert list(find(DOCUMENT, "build[2].image-name")) == []
+    assert list(find(DOCUMENT, "metadata.name.first")) == []
+
+
+def test_get_value():
+    """Test values are looked up on paths found."""
+    for path, value in find(DOCUMENT, "**.base-image"):
+        assert get_value(DOCUMENT, path) == value
+
+    assert get_value(DOCUMENT, []) is DOCUMENT
+    with pytest.raises(KeyError):
+        get_value(DOCUMENT, ["metadata", "namespace"])
+
+
+def test_set_values():
+    """Test values are set on matched paths and keys are created in mappings matched by the rest of the query."""
+    document = {"metadata": {"name": "model"}, "items": [{"name": "a"}, {"name": "b"}], "spec": {}}
+
+    assert set_values(document, "metadata.name", "renamed") == 1
+    assert set_values(document, "metadata.labels", {"service": "cpu"}) == 1
+    assert set_values(document, "items[*].image", "quay.io/a") == 2
+    assert set_values(document, "items[1]", {"name": "c"}) == 1
+    assert set_values(document, "missing.name", "value") == 0
+    assert set_values(document, "items[5]", "value") == 0
+
+    assert document == {
+        "metadata": {"name": "renamed", "labels": {"service": "cpu"}},
+        "items": [{"name": "a", "image": "quay.io/a"}, {"name": "c"}],
+        "spec": {},
+    }
+
+
+def test_set_values_recursive():
+    """Test recursive queries set only keys that exist, they do not create keys in every mapping reached."""
+    document = {"base-image": "a", "build": [{"base-image": "b", "nested": {}}, {"name": "c"}], "spec": {}}
+
+    assert set_values(document, '**["base-image"]', "new") == 2
+    assert set_values(document, "**.missing", "new") == 0
+    assert set_values(document, "build.**.name", "new") == 1
+
+    assert document == {
+        "base-image": "new",
+        "build": [{"base-image": "new", "nested": {}}, {"name": "new"}],
+        "spec": {},
+    }
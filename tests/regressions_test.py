@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# pipeline-helpers
+# Copyright(C) 2022 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests of detecting regressions of metrics against previous PRs."""
+
+import math
+
+import pytest
+
+from thoth.pipeline_helpers.regressions import find_regressions
+from thoth.pipeline_helpers.regressions import parse_document_id
+
+
+def _history(overlay_name, values, metric="latency p95"):
+    """Create history of a metric of PRs numbered from 1 in the order of the given values."""
+    return [(pr_number, overlay_name, {metric: value}) for pr_number, value in enumerate(values, start=1)]
+
+
+def test_parse_document_id():
+    """Test PR number and overlay name are parsed from ids of processed metrics documents."""
+    assert parse_document_id("12/cpu/processed_metrics") == (12, "cpu")
+    assert parse_document_id("12/processed_metrics") == (12, "")
+    assert parse_document_id("aggregated_metrics") == (None, "")
+    assert parse_document_id("manifest/cpu/processed_metrics") == (None, "cpu")
+
+
+def test_mad_threshold():
+    """Test values are regressions only if they exceed the median by more than threshold robust deviations."""
+    # Median 1.0, median absolute deviation 0.05, so values above 1.0 + 3 * 1.4826 * 0.05 ~ 1.222 regress.
+    baseline = [1.0, 1.1, 0.9, 1.0, 1.05]
+    history = _history("cpu", baseline + [1.2]) + _history("gpu", baseline + [1.25])
+
+    regressions = find_regressions(history, pr_number=6)
+
+    assert regressions == [
+        {
+            "overlay": "gpu",
+            "metric": "latency p95",
+            "value": 1.25,
+            "baseline median": 1.0,
+            "change": "+25.0%",
+            "robust z-score": pytest.approx(3.37, abs=0.01),
+            "baseline PRs": 5,
+        }
+    ]
+    assert find_regressions(history, pr_number=6, threshold=2.0)[0]["overlay"] == "cpu"
+
+
+def test_zero_mad():
+    """Test the relative tolerance applies if all baseline values are equal."""
+    history = _history("cpu", [1.0, 1.0, 1.0, 1.05]) + _history("gpu", [1.0, 1.0, 1.0, 1.2])
+    history += _history("zero", [0, 0, 0, 0.01])
+
+    regressions = find_regressions(history, pr_number=4, tolerance=0.1)
+
+    assert [(row["overlay"], row["change"]) for row in regressions] == [("gpu", "+20.0%"), ("zero", "n/a")]
+    assert all(math.isinf(row["robust z-score"]) for row in regressions)
+
+
+def test_too_few_baseline_points():
+    """Test metrics are compared only against enough preceding PRs, other values of metrics are ignored."""
+    history = _history("cpu", [1.0, 1.0, 5.0])
+    history += [
+        (1, "gpu", {"latency p95": 1.0, "latency p99": 1.0, "latency count": 10, "accuracy": 0.9}),
+        (2, "gpu", {"latency p95": 1.0, "latency count": 10, "accuracy": 0.9}),
+        (3, "gpu", {"latency p95": 1.0, "latency p99": 1.0, "latency count": 10, "accuracy": 0.9}),
+        (4, "gpu", {"latency p95": 2.0, "latency p99": 2.0, "latency count": 1000, "accuracy": 0.1}),
+        # Later PRs are not part of the baseline.
+        (5, "gpu", {"latency p95": 2.0, "latency p99": 2.0}),
+    ]
+
+    assert find_regressions(history, pr_number=3) == []
+    assert [row["metric"] for row in find_regressions(history, pr_number=4)] == ["latency p95"]
+    assert [row["metric"] for row in find_regressions(history, pr_number=4, min_baseline_size=2)] == [
+        "latency p95",
+        "latency p99",
+    ]
+    # Only the most recent PRs are the baseline.
+    history = _history("cpu", [3.0, 3.0, 3.0, 1.0, 1.0, 1.0, 2.0])
+    assert find_regressions(history, pr_number=7) == []
+    assert find_regressions(history, pr_number=7, baseline_size=3)[0]["baseline median"] == 1.0
+    assert find_regressions(_history("cpu", [1.0, 1.0, 1.0, 1.0, 0.5]), pr_number=5) == []
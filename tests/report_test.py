@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# pipeline-helpers
+# Copyright(C) 2022 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests of rendering reports on metrics gathered."""
+
+import pytest
+
+from thoth.pipeline_helpers.report import TopN
+from thoth.pipeline_helpers.report import render_markdown_table
+
+# Rows with tables rendered for them by pandas.DataFrame(rows).to_markdown(index=False).
+TABLES = {
+    "bool column with missing cells": (
+        [{"name": "a", "ok": True}, {"name": "b"}, {"name": "c", "ok": False}],
+        """\
+| name   |   ok |
+|:-------|-----:|
+| a      |    1 |
+| b      |  nan |
+| c      |    0 |""",
+    ),
+    "int column with missing cells": (
+        [{"name": "a", "replicas": 1}, {"name": "b"}, {"name": "c", "replicas": 3}],
+        """\
+| name   |   replicas |
+|:-------|-----------:|
+| a      |          1 |
+| b      |        nan |
+| c      |          3 |""",
+    ),
+    "all numeric": (
+        [{"pr": 1, "latency": 0.25}, {"pr": 2, "latency": 1.5}],
+        """\
+|   pr |   latency |
+|-----:|----------:|
+|    1 |      0.25 |
+|    2 |      1.5  |""",
+    ),
+    "all bool": (
+        [{"a": True, "b": False}],
+        """\
+|   a |   b |
+|----:|----:|
+|   1 |   0 |""",
+    ),
+    "decimal point alignment": (
+        [{"model": "m", "latency": 0.125}, {"model": "n", "latency": 12.5}, {"model": "o", "latency": 3.0}],
+        """\
+| model   |   latency |
+|:--------|----------:|
+| m       |     0.125 |
+| n       |    12.5   |
+| o       |     3     |""",
+    ),
+    "large int": (
+        [{"model": "m", "requests": 123456789, "latency": 0.5}, {"model": "n", "requests": 2, "latency": 1.25}],
+        """\
+| model   |   requests |   latency |
+|:--------|-----------:|----------:|
+| m       |  123456789 |      0.5  |
+| n       |          2 |      1.25 |""",
+    ),
+    "large int in all numeric": (
+        [{"requests": 123456789, "latency": 0.5}, {"requests": 2, "latency": 1.25}],
+        """\
+|    requests |   latency |
+|------------:|----------:|
+| 1.23457e+08 |      0.5  |
+| 2           |      1.25 |""",
+    ),
+    "strings holding numbers": (
+        [{"model": "m", "memory": "128", "cpu": "0.5"}, {"model": "n", "memory": "2048", "cpu": "12.25"}],
+        """\
+| model   |   memory |   cpu |
+|:--------|---------:|------:|
+| m       |      128 |  0.5  |
+| n       |     2048 | 12.25 |""",
+    ),
+    "strings and numbers": (
+        [{"model": "m", "memory": "128Mi"}, {"model": "n", "memory": 64}],
+        """\
+| model   | memory   |
+|:--------|:---------|
+| m       | 128Mi    |
+| n       | 64       |""",
+    ),
+    "none": (
+        [{"model": "m", "latency": None}, {"model": "n", "latency": 0.5}],
+        """\
+| model   |   latency |
+|:--------|----------:|
+| m       |     nan   |
+| n       |       0.5 |""",
+    ),
+    "empty": ([], ""),
+}
+
+
+@pytest.mark.parametrize("rows,expected", TABLES.values(), ids=list(TABLES))
+def test_render_markdown_table(rows, expected):
+    """Test markdown tables are rendered the same way pandas renders them."""
+    assert render_markdown_table(rows) == expected
+    assert render_markdown_table(iter(rows)) == expected
+
+
+@pytest.mark.parametrize("rows,expected", TABLES.values(), ids=list(TABLES))
+def test_render_markdown_table_pandas(rows, expected):
+    """Test tables expected are the ones rendered by pandas, if it is installed with a recent enough tabulate."""
+    pandas = pytest.importorskip("pandas")
+    try:
+        rendered = pandas.DataFrame(rows).to_markdown(index=False)
+    except ImportError as exc:
+        pytest.skip(f"pandas cannot render markdown: {exc}")
+
+    assert rendered == expected
+
+
+def test_top_n_ties():
+    """Test items with equal sort values keep the order they were offered in, items without a value come last."""
+    top: TopN[str] = TopN(3)
+    top.extend([("a", 1.0), ("none", None), ("b", 2.0), ("c", 1.0), ("d", 1.0)])
+    assert top.items() == ["b", "a", "c"]
+
+    top = TopN(4, descending=False)
+    top.extend([("none", None), ("a", 1.0), ("b", 2.0), ("c", 1.0)])
+    assert top.items() == ["a", "c", "b", "none"]
+
+
+def test_top_n_ties_given_order():
+    """Test ties are ranked by the order given with items, regardless of the order items were offered in."""
+    top: TopN[str] = TopN(2)
+    top.push("third", 1.0, order=3)
+    top.push("first", 1.0, order=1)
+    top.push("best", 5.0, order=4)
+    top.push("second", 1.0, order=2)
+    assert top.items() == ["best", "first"]
+    assert len(top) == 2
+
+    empty: TopN[str] = TopN(0)
+    empty.push("a", 1.0)
+    assert empty.items() == []
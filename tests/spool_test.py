@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# pipeline-helpers
+# Copyright(C) 2022 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests of spooling writes to Ceph and replaying them."""
+
+import json
+import threading
+import time
+from collections import Counter
+
+from thoth.pipeline_helpers.spool import MERGE
+from thoth.pipeline_helpers.spool import STORE
+from thoth.pipeline_helpers.spool import WriteSpool
+from thoth.pipeline_helpers.spool import coalesce
+from thoth.pipeline_helpers.storage import JSON_FORMAT
+from thoth.pipeline_helpers.storage import read_document
+
+from .conftest import PREFIX
+
+
+def _record(operation, document_id, document, spooled_at, document_format=None):
+    """Create a spool record of a write."""
+    return {
+        "operation": operation,
+        "prefix": PREFIX,
+        "document_id": document_id,
+        "document": document,
+        "spooled_at": spooled_at,
+        "format": document_format,
+    }
+
+
+def _write_spool(tmp_path, *records):
+    """Write a spool holding the given records."""
+    path = tmp_path / "pending_writes.jsonl"
+    path.write_text("".join(json.dumps(record) + "\n" for record in records))
+    return WriteSpool(str(path))
+
+
+def test_coalesce():
+    """Test writes of the same document are combined in the order they were spooled."""
+    writes = coalesce(
+        [
+            _record(MERGE, "1/metrics.json", {"a": 1, "b": 1}, 1),
+            _record(MERGE, "2/metrics.json", {"a": 1}, 2),
+            _record(MERGE, "1/metrics.json", {"b": 2, "c": 2}, 3),
+            _record(MERGE, "1/metrics.json", {"a": 0}, 4, document_format=JSON_FORMAT),
+            _record(STORE, "2/metrics.json", {"b": 5}, 5),
+            _record(MERGE, "2/metrics.json", {"c": 6}, 6),
+        ]
+    )
+
+    assert [(write["document_id"], write["format"]) for write in writes] == [
+        ("1/metrics.json", None),
+        ("2/metrics.json", None),
+        ("1/metrics.json", JSON_FORMAT),
+    ]
+    assert writes[0]["operation"] == MERGE
+    assert writes[0]["document"] == {"a": 1, "b": 2, "c": 2}
+    assert writes[0]["spooled_at"] == 3
+    # A document stored whole replaces keys merged before it.
+    assert writes[1]["operation"] == STORE
+    assert writes[1]["document"] == {"b": 5, "c": 6}
+    assert writes[1]["spooled_at"] == 6
+
+
+def test_flush(ceph_adapter, tmp_path):
+    """Test spooled writes are replayed in batches and removed from the spool, writes spooled meanwhile are kept."""
+    ceph_adapter.store_document({"gather": 1}, "1/metrics.json")
+    spool = WriteSpool(str(tmp_path / "pending_writes.jsonl"))
+    spool.merge(PREFIX, "1/metrics.json", {"platform": 2})
+    spool.merge(PREFIX, "2/metrics.json", {"platform": 3})
+    spool.merge(PREFIX, "1/metrics.json", {"platform": 4, "aggregate": 5})
+
+    def connect(prefix):
+        assert prefix == PREFIX
+        # Another helper spools a write while the spool is flushed.
+        spool.merge(PREFIX, "3/metrics.json", {"platform": 6})
+        return ceph_adapter
+
+    assert spool.flush(batch_size=2, connect=connect) == 3
+    assert read_document(ceph_adapter, "1/metrics.json") == {"gather": 1, "platform": 4, "aggregate": 5}
+    assert read_document(ceph_adapter, "2/metrics.json") == {"platform": 3}
+    assert spool.pending() == 1
+
+    assert spool.flush(connect=lambda prefix: ceph_adapter) == 1
+    assert read_document(ceph_adapter, "3/metrics.json") == {"platform": 6}
+    assert spool.pending() == 0
+    assert spool.flush(connect=lambda prefix: ceph_adapter) == 0
+
+
+def test_flush_keeps_order_of_failed_writes(ceph_adapter, tmp_path, monkeypatch):
+    """Test writes after a write that failed are not replayed before it, failed writes are kept in order."""
+    now = time.time()
+    spool = _write_spool(
+        tmp_path,
+        _record(MERGE, "1/metrics.json", {"platform": 1, "aggregate": 1}, now),
+        _record(MERGE, "2/metrics.json", {"platform": 2}, now),
+        _record(MERGE, "1/metrics.json", {"platform": 3}, now),
+        _record(MERGE, "2/metrics.json", {"aggregate": 4}, now),
+    )
+
+    replay = WriteSpool._replay
+    failing = [True]
+
+    def failing_replay(self, write, connect):
+        # Only the first write of the document fails, the write after it would succeed.
+        if failing[0] and write["document"] == {"platform": 1, "aggregate": 1}:
+            raise ConnectionError("connection reset")
+        replay(self, write, connect)
+
+    monkeypatch.setattr(WriteSpool, "_replay", failing_replay)
+    assert spool.flush(batch_size=1, connect=lambda prefix: ceph_adapter) == 2
+    assert read_document(ceph_adapter, "2/metrics.json") == {"platform": 2, "aggregate": 4}
+    assert not ceph_adapter.document_exists("1/metrics.json")
+
+    pending = [json.loads(line) for line in open(spool.path)]
+    assert [(record["document_id"], record["document"]) for record in pending] == [
+        ("1/metrics.json", {"platform": 1, "aggregate": 1}),
+        ("1/metrics.json", {"platform": 3}),
+    ]
+
+    failing[0] = False
+    assert spool.flush(connect=lambda prefix: ceph_adapter) == 1
+    assert read_document(ceph_adapter, "1/metrics.json") == {"platform": 3, "aggregate": 1}
+
+
+def test_flush_skips_stale_store(ceph_adapter, tmp_path):
+    """Test a spooled document is not stored over the document stored after it was spooled."""
+    ceph_adapter.store_document({"aggregate": "stored"}, "aggregated_metrics")
+    ceph_adapter.store_document({"aggregate": "stored"}, "other_metrics")
+    spool = _write_spool(
+        tmp_path,
+        _record(STORE, "aggregated_metrics", {"aggregate": "spooled"}, time.time() - 60),
+        _record(STORE, "other_metrics", {"aggregate": "spooled"}, time.time() + 60),
+    )
+
+    spool.flush(connect=lambda prefix: ceph_adapter)
+
+    assert read_document(ceph_adapter, "aggregated_metrics") == {"aggregate": "stored"}
+    assert read_document(ceph_adapter, "other_metrics") == {"aggregate": "spooled"}
+    assert spool.pending() == 0
+
+
+def test_concurrent_flush(tmp_path, monkeypatch):
+    """Test concurrent flushes of a spool replay each write once."""
+    replayed: Counter = Counter()
+    lock = threading.Lock()
+
+    def slow_replay(self, write, connect):
+        time.sleep(0.01)
+        with lock:
+            replayed[write["document_id"]] += 1
+
+    monkeypatch.setattr(WriteSpool, "_replay", slow_replay)
+    spool = WriteSpool(str(tmp_path / "pending_writes.jsonl"))
+    for number in range(20):
+        spool.merge(PREFIX, f"{number}/metrics.json", {"number": number})
+
+    written = []
+    threads = [
+        threading.Thread(
+            target=lambda: written.append(WriteSpool(spool.path).flush(batch_size=3, connect=lambda prefix: None))
+        )
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sum(written) == 20
+    assert replayed == {f"{number}/metrics.json": 1 for number in range(20)}
+    assert spool.pending() == 0
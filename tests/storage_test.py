@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# pipeline-helpers
+# Copyright(C) 2022 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of storing metrics documents as JSON or in the columnar format."""
+
+from thoth.pipeline_helpers.storage import COLUMNAR_FORMAT
+from thoth.pipeline_helpers.storage import JSON_FORMAT
+from thoth.pipeline_helpers.storage import columnar_object_key
+from thoth.pipeline_helpers.storage import encode_group
+from thoth.pipeline_helpers.storage import list_stored_documents
+from thoth.pipeline_helpers.storage import read_document
+from thoth.pipeline_helpers.storage import store_document
+from thoth.pipeline_helpers.storage import update_stored_document
+
+DOCUMENT = {
+    "metadata": {"pr": "1"},
+    "info_metrics": {"overlay": "cpu"},
+    "model_application_metrics": [{"latency p95": 0.1}, {"latency p95": 0.2}],
+    "platform_metrics": {"cpu": 0.5},
+}
+
+
+def test_list_stored_documents(ceph_adapter):
+    """Test documents stored in either format are listed once, in the format stored last."""
+    store_document(ceph_adapter, DOCUMENT, "1/cpu/metrics.json", document_format=JSON_FORMAT)
+    store_document(ceph_adapter, DOCUMENT, "2/cpu/metrics.json", document_format=COLUMNAR_FORMAT)
+    # Migrated to the columnar format, with the JSON document kept.
+    store_document(ceph_adapter, DOCUMENT, "3/cpu/metrics.json", document_format=JSON_FORMAT)
+    store_document(ceph_adapter, DOCUMENT, "3/cpu/metrics.json", document_format=COLUMNAR_FORMAT)
+    # Column groups missing, the document is skipped.
+    ceph_adapter.store_blob(
+        encode_group("info_metrics", DOCUMENT["info_metrics"]),
+        columnar_object_key("4/cpu/metrics.json", "info_metrics"),
+    )
+    ceph_adapter.store_document({}, "1/cpu/processed.json")
+
+    listed = list(list_stored_documents(ceph_adapter, "metrics.json"))
+
+    assert [(document_id, document_format) for document_id, _, _, document_format in listed] == [
+        ("1/cpu/metrics.json", JSON_FORMAT),
+        ("2/cpu/metrics.json", COLUMNAR_FORMAT),
+        ("3/cpu/metrics.json", COLUMNAR_FORMAT),
+    ]
+    # ETags of columnar documents combine ETags of all their column groups.
+    assert listed[1][1].count(",") == 2
+
+    for document_id, _, _, document_format in listed:
+        assert read_document(ceph_adapter, document_id, document_format=document_format) == DOCUMENT
+
+
+def test_read_document_columns(ceph_adapter):
+    """Test only the given column groups and columns are read from columnar documents."""
+    store_document(ceph_adapter, DOCUMENT, "metrics.json", document_format=COLUMNAR_FORMAT)
+
+    document = read_document(
+        ceph_adapter,
+        "metrics.json",
+        groups=["model_application_metrics"],
+        columns={"model_application_metrics": ["latency p95"]},
+    )
+
+    # Keys outside column groups are kept with the first group, which was not read.
+    assert document == {"model_application_metrics": DOCUMENT["model_application_metrics"]}
+
+    document = read_document(ceph_adapter, "metrics.json", groups=["info_metrics"], columns={"info_metrics": []})
+    assert document == {"metadata": {"pr": "1"}, "info_metrics": {}}
+
+
+def test_update_stored_document_from_columnar(ceph_adapter):
+    """Test a JSON document not stored yet is created from its columnar version."""
+    store_document(ceph_adapter, DOCUMENT, "metrics.json", document_format=COLUMNAR_FORMAT)
+
+    updated = update_stored_document(
+        ceph_adapter,
+        "metrics.json",
+        lambda document: {**(document or {}), "platform_metrics": {"cpu": 0.7}},
+        document_format=JSON_FORMAT,
+    )
+
+    assert updated == {**DOCUMENT, "platform_metrics": {"cpu": 0.7}}
+    assert read_document(ceph_adapter, "metrics.json", document_format=JSON_FORMAT) == updated
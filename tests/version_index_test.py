@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# pipeline-helpers
+# Copyright(C) 2022 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests of the index of image tags sorted by version."""
+
+import pytest
+
+from thoth.pipeline_helpers.version_index import TagIndex
+
+TAGS = ["v0.9.0", "latest", "v0.10.0", "v0.27.1", "v0.27.0", "v0.28.0rc1", "v1.0.0.dev1", "v0.27", "vnext", "0.30.0"]
+
+
+def test_version_ordering():
+    """Test tags are ordered by version they name, not as strings, pre-releases before releases."""
+    index = TagIndex(TAGS)
+
+    assert index.to_dict()["tags"] == ["v0.9.0", "v0.10.0", "v0.27", "v0.27.0", "v0.27.1", "v0.28.0rc1", "v1.0.0.dev1"]
+    assert index.latest() == "v1.0.0.dev1"
+    assert index.latest_within(0) == "v0.28.0rc1"
+    assert index.latest_within(0, 27) == "v0.27.1"
+    assert index.latest_within(0, 9) == "v0.9.0"
+    assert index.latest_within(0, 11) is None
+    # Pre-releases of 1.0.0 are within major version 1, not 0.
+    assert index.latest_within(1) == "v1.0.0.dev1"
+    assert index.latest_within(2) is None
+    assert index.latest_not_newer_than("v0.27.0") == "v0.27.0"
+    assert index.latest_not_newer_than("v0.26.5") == "v0.10.0"
+    assert index.latest_not_newer_than("v0.1.0") is None
+
+
+def test_non_semver_tags():
+    """Test tags without the prefix or not naming a version are ignored, and are outdated by any version."""
+    index = TagIndex(TAGS)
+
+    assert len(index) == 7
+    assert index.parse("latest") is None
+    assert index.parse("vnext") is None
+    assert index.parse("0.30.0") is None
+    assert index.parse("v0.27") == index.parse("v0.27.0")
+
+    assert index.is_outdated("latest")
+    assert index.is_outdated("v0.27.1")
+    assert not index.is_outdated("v1.0.0")
+    with pytest.raises(ValueError):
+        index.latest_not_newer_than("latest")
+
+    assert TagIndex(["0.30.0", "0.31.0"], prefix="").latest() == "0.31.0"
+
+    empty = TagIndex(["latest"])
+    assert empty.latest() is None
+    assert empty.latest_within(0) is None
+    assert not empty.is_outdated("latest")
+
+
+def test_serialization():
+    """Test an index is restored from its dictionary without sorting tags again."""
+    index = TagIndex(TAGS)
+    restored = TagIndex.from_dict(index.to_dict())
+
+    assert restored.to_dict() == index.to_dict()
+    assert restored.latest_within(0, 27) == "v0.27.1"
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# pipeline-helpers
+# Copyright(C) 2021 Francesco Murdaca
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""On-disk cache of JSON serializable values shared by pipeline steps."""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Any
+from typing import Optional
+
+_LOGGER = logging.getLogger("thoth.pipeline_helpers.cache")
+
+CACHE_DIR = os.getenv("PIPELINE_HELPERS_CACHE_DIR", "/workspace/cache/pipeline-helpers")
+
+
+class DiskCache:
+    """Cache JSON serializable values in files keyed by a hash of the key, optionally expiring them after a TTL.
+
+    The cache is best effort, values that cannot be read or written are treated as cache misses.
+    """
+
+    def __init__(self, namespace: str, ttl: Optional[float] = None, directory: Optional[str] = None) -> None:
+        """Initialize cache storing values under the given namespace in the cache directory."""
+        self.directory = os.path.join(directory or CACHE_DIR, namespace)
+        self.ttl = ttl
+
+    def _path(self, key: Any) -> str:
+        """Get path to the file storing value for the given key."""
+        digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def get(self, key: Any) -> Optional[Any]:
+        """Get value stored for the given key, None on cache miss."""
+        path = self._path(key)
+        try:
+            if self.ttl is not None and time.time() - os.path.getmtime(path) > self.ttl:
+                _LOGGER.debug("Cache entry %r expired", key)
+                return None
+
+            with open(path, "r") as cache_file:
+                return json.load(cache_file)
+        except FileNotFoundError:
+            return None
+        except Exception as exc:
+            _LOGGER.warning("Failed to read cache entry %r: %s", key, exc)
+            return None
+
+    def set(self, key: Any, value: Any) -> None:
+        """Store value for the given key, the file is replaced atomically."""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "w") as cache_file:
+                json.dump(value, cache_file)
+            os.replace(tmp_path, self._path(key))
+        except Exception as exc:
+            _LOGGER.warning("Failed to store cache entry %r: %s", key, exc)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# pipeline-helpers
+# Copyright(C) 2021 Francesco Murdaca
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Command line interface running pipeline helpers as subcommands of a single entry point.
+
+Helpers are imported only once their subcommand is selected, so each pipeline step pays
+only for the modules it actually uses.
+"""
+
+import argparse
+import importlib
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from thoth.pipeline_helpers.instrumentation import set_helper
+
+# Subcommand name mapped to module and function of the helper it runs.
+HELPERS: Dict[str, Tuple[str, str]] = {
+    "aggregate-metrics": ("aggregate_metrics_results", "post_process_metrics"),
+    "bump-base-image-version": ("bump_base_image_version", "bump_base_image_versions"),
+    "customize-object-deployments": ("customize_object_deployments", "customize_manifests"),
+    "gather-metrics": ("gather_metrics", "gather_metrics"),
+    "gather-platform-metrics": ("gather_platform_metrics", "gather_platform_metrics"),
+    "migrate-metrics-storage": ("migrate_metrics_storage", "migrate_metrics_storage"),
+    "post-process-metrics": ("post_process_metrics", "post_process_metrics"),
+}
+
+# Helper modules are kept in the root of the repository, next to the thoth package.
+REPOSITORY_ROOT = str(Path(__file__).resolve().parents[2])
+
+_IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure_import_time(module: str, max_depth: Optional[int] = 1) -> Tuple[int, List[Tuple[str, int]]]:
+    """Measure import time of a module in a fresh interpreter, in microseconds.
+
+    Return the total time and cumulative times of modules imported by it, directly by default or up to
+    the given depth of nested imports, all of them if the depth is None.
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        env=dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPOSITORY_ROOT, os.getenv("PYTHONPATH")]))),
+        check=True,
+    )
+
+    total = 0
+    imports: List[Tuple[str, int]] = []
+    nested: List[Tuple[str, int, int]] = []
+    for line in process.stderr.decode("utf-8").splitlines():
+        match = _IMPORTTIME_RE.match(line)
+        if not match:
+            continue
+
+        # Modules are reported after modules they import, nested imports are indented by two more spaces.
+        cumulative, depth, name = int(match.group(2)), (len(match.group(3)) - 1) // 2, match.group(4)
+        if name == module:
+            total = cumulative
+        elif depth > 0:
+            nested.append((name, depth, cumulative))
+
+        if depth > 0:
+            continue
+
+        if total:
+            imports = [(imported, time) for imported, level, time in nested if max_depth is None or level <= max_depth]
+            break
+
+        # Imports done on interpreter startup.
+        nested = []
+
+    return total, sorted(imports, key=lambda item: item[1], reverse=True)
+
+
+def _benchmark_imports(limit: int) -> None:
+    """Print import time of each helper module."""
+    for command, (module, _) in sorted(HELPERS.items()):
+        try:
+            total, imports = measure_import_time(module)
+        except subprocess.CalledProcessError as exc:
+            print(f"{command}: import of {module} failed: {exc.stderr.decode('utf-8').splitlines()[-1]}")
+            continue
+
+        print(f"{command}: {total / 1000:.1f}ms")
+        for name, cumulative in imports[:limit]:
+            print(f"    {name}: {cumulative / 1000:.1f}ms")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Run the pipeline helper selected on the command line."""
+    parser = argparse.ArgumentParser(prog="thoth.pipeline_helpers", description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    for command, (module, function) in HELPERS.items():
+        subparsers.add_parser(command, help=f"Run {module}.{function}.")
+
+    benchmark_parser = subparsers.add_parser(
+        "benchmark-imports", help="Report import time of each helper measured with -X importtime."
+    )
+    benchmark_parser.add_argument(
+        "--limit", type=int, default=5, help="Number of slowest direct imports shown per helper."
+    )
+
+    arguments = parser.parse_args(argv)
+
+    if arguments.command == "benchmark-imports":
+        _benchmark_imports(arguments.limit)
+        return
+
+    # Helpers run in the model repository, so their modules are not found relative to the working directory.
+    if REPOSITORY_ROOT not in sys.path:
+        sys.path.insert(0, REPOSITORY_ROOT)
+
+    set_helper(arguments.command)
+    module, function = HELPERS[arguments.command]
+    getattr(importlib.import_module(module), function)()
@@ -17,11 +17,31 @@
 
 """Common method for pipeline helpers task."""
 
+import json
 import logging
 import os
+import random
+import time
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+from typing import Callable
+from typing import Deque
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
 from typing import Optional
+from typing import Tuple
+from typing import TYPE_CHECKING
 
-from thoth.storages import CephStore
+from thoth.pipeline_helpers.instrumentation import CEPH_LIST
+from thoth.pipeline_helpers.instrumentation import CEPH_RETRIEVE
+from thoth.pipeline_helpers.instrumentation import CEPH_STORE
+from thoth.pipeline_helpers.instrumentation import span
+
+if TYPE_CHECKING:
+    from thoth.storages import CephStore
 
 _DEBUG_LEVEL = bool(int(os.getenv("DEBUG_LEVEL", 0)))
 
@@ -32,22 +52,241 @@ else:
 
 _LOGGER = logging.getLogger("thoth.gather_metrics")
 
+# Conditional request parameters of PutObject mapped to HTTP headers they are sent as.
+_CONDITION_HEADERS = {"IfMatch": "If-Match", "IfNoneMatch": "If-None-Match"}
+_CONDITIONS_CONTEXT_KEY = "pipeline_helpers_conditions"
+# Error codes of conditional writes rejected because the object changed since it was read.
+_CONFLICT_ERROR_CODES = frozenset({"PreconditionFailed", "ConditionalRequestConflict", "409", "412"})
 
-def create_s3_adapter(
+
+class ConcurrentUpdateError(Exception):
+    """A document was changed concurrently on every attempt to update it."""
+
+
+def get_deployment_metrics_key(
+    pr_number: Optional[str] = None,
+    overlay_name: Optional[str] = None,
+    document_id: Optional[str] = None,
+) -> str:
+    """Get key of a deployment metrics object relative to the repository prefix."""
+    return "/".join(part for part in (pr_number, overlay_name, document_id) if part)
+
+
+def get_deployment_metrics_prefix(
     ceph_bucket_prefix: str,
     deployment_name: str,
     repo: str,
     pr_number: Optional[str] = None,
     overlay_name: Optional[str] = None,
-) -> CephStore:
-    """Create Ceph adapter for deployment metrics."""
+) -> str:
+    """Get prefix of deployment metrics objects of a repository, or of a PR and overlay of it, ending with a slash."""
     prefix = f"{ceph_bucket_prefix}/{deployment_name}/deployment-metrics/{repo}"
 
-    if pr_number:
-        prefix = prefix + f"/{pr_number}"
+    key = get_deployment_metrics_key(pr_number, overlay_name)
+    if key:
+        prefix = prefix + f"/{key}"
 
-    if overlay_name:
-        prefix = prefix + f"/{overlay_name}"
+    return prefix + "/"
 
-    ceph = CephStore(prefix=prefix)
+
+def create_s3_adapter(
+    ceph_bucket_prefix: str,
+    deployment_name: str,
+    repo: str,
+    pr_number: Optional[str] = None,
+    overlay_name: Optional[str] = None,
+) -> "CephStore":
+    """Create Ceph adapter for deployment metrics."""
+    from thoth.storages import CephStore
+
+    ceph = CephStore(
+        prefix=get_deployment_metrics_prefix(ceph_bucket_prefix, deployment_name, repo, pr_number, overlay_name)
+    )
     return ceph
+
+
+def check_available(ceph_adapter: "CephStore") -> None:
+    """Check Ceph is reachable by listing a single object under the adapter prefix, raise if it is not.
+
+    Connecting an adapter does not reach Ceph, so outages show up only on the first request otherwise.
+    """
+    with span(CEPH_LIST):
+        ceph_adapter._s3.meta.client.list_objects_v2(Bucket=ceph_adapter.bucket, Prefix=ceph_adapter.prefix, MaxKeys=1)
+
+
+def list_documents(
+    ceph_adapter: "CephStore",
+    document_name: Optional[str] = None,
+    pr_number: Optional[str] = None,
+    overlay_name: Optional[str] = None,
+    page_size: int = 1000,
+) -> Iterator[Tuple[str, str, str]]:
+    """List documents page by page, yielding their id, ETag and last modification time.
+
+    The listing is restricted server side to the given PR and overlay of a repository adapter created by
+    `create_s3_adapter`. S3 has no suffix filter, so documents are matched on their name while pages are streamed.
+    """
+    prefix = ceph_adapter.prefix
+    key = get_deployment_metrics_key(pr_number, overlay_name)
+    if key:
+        prefix = prefix + f"{key}/"
+
+    paginator = ceph_adapter._s3.meta.client.get_paginator("list_objects_v2")
+    pages = iter(
+        paginator.paginate(Bucket=ceph_adapter.bucket, Prefix=prefix, PaginationConfig={"PageSize": page_size})
+    )
+    while True:
+        with span(CEPH_LIST):
+            page = next(pages, None)
+
+        if page is None:
+            return
+
+        for obj in page.get("Contents", []):
+            document_id = obj["Key"][len(ceph_adapter.prefix) :]  # noqa: E203
+            if document_name and document_id.rsplit("/", 1)[-1] != document_name:
+                continue
+
+            yield document_id, obj["ETag"], obj["LastModified"].isoformat()
+
+
+def _retrieve_document_with_retries(
+    ceph_adapter: "CephStore",
+    document_id: str,
+    retries: int,
+    backoff: float,
+    reader: Optional[Callable[[str], dict]] = None,
+) -> dict:
+    """Retrieve a document, retrying with exponential backoff on transient failures."""
+    from thoth.storages.exceptions import NotFoundError
+
+    attempt = 0
+    while True:
+        try:
+            if reader:
+                return reader(document_id)
+
+            with span(CEPH_RETRIEVE):
+                return ceph_adapter.retrieve_document(document_id)
+        except NotFoundError:
+            raise
+        except Exception as exc:
+            if attempt >= retries:
+                raise
+
+            delay = backoff * 2**attempt
+            _LOGGER.warning(f"Failed to retrieve {document_id} ({exc!r}), retrying in {delay}s...")
+            time.sleep(delay)
+            attempt += 1
+
+
+def retrieve_documents(
+    ceph_adapter: "CephStore",
+    document_ids: Iterable[str],
+    max_workers: int = 8,
+    retries: int = 3,
+    backoff: float = 0.5,
+    reader: Optional[Callable[[str], dict]] = None,
+) -> Iterator[Tuple[str, dict]]:
+    """Retrieve documents concurrently, yielding them in the order of the given document ids.
+
+    At most `max_workers` retrievals run at the same time and at most twice as many
+    results are kept in memory, so the document ids can be a lazy listing. Documents are
+    retrieved as JSON unless a reader taking a document id is given.
+    """
+    pending: Deque[Tuple[str, Future]] = deque()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for document_id in document_ids:
+            future = executor.submit(
+                _retrieve_document_with_retries, ceph_adapter, document_id, retries, backoff, reader
+            )
+            pending.append((document_id, future))
+
+            if len(pending) >= 2 * max_workers:
+                first_id, first_future = pending.popleft()
+                yield first_id, first_future.result()
+
+        while pending:
+            first_id, first_future = pending.popleft()
+            yield first_id, first_future.result()
+
+
+def _pop_conditions(params: Dict[str, Any], context: Dict[str, Any], **kwargs: Any) -> None:
+    """Move conditional request parameters of PutObject to the request context."""
+    conditions = {header: params.pop(param) for param, header in _CONDITION_HEADERS.items() if param in params}
+    if conditions:
+        context[_CONDITIONS_CONTEXT_KEY] = conditions
+
+
+def _add_condition_headers(request: Any, **kwargs: Any) -> None:
+    """Send conditional request parameters kept in the request context as headers."""
+    for header, value in request.context.get(_CONDITIONS_CONTEXT_KEY, {}).items():
+        request.headers[header] = value
+
+
+def _put_object(ceph_adapter: "CephStore", key: str, body: bytes, **conditions: str) -> None:
+    """Store an object under the given key, only if the given IfMatch or IfNoneMatch condition holds.
+
+    Older botocore releases do not know conditional PutObject parameters, so they are sent as headers.
+    """
+    client = ceph_adapter._s3.meta.client
+    client.meta.events.register(
+        "provide-client-params.s3.PutObject", _pop_conditions, unique_id=_CONDITIONS_CONTEXT_KEY + "-params"
+    )
+    client.meta.events.register(
+        "before-sign.s3.PutObject", _add_condition_headers, unique_id=_CONDITIONS_CONTEXT_KEY + "-headers"
+    )
+    client.put_object(Bucket=ceph_adapter.bucket, Key=key, Body=body, **conditions)
+
+
+def update_document(
+    ceph_adapter: "CephStore",
+    document_id: str,
+    update: Callable[[Optional[dict]], dict],
+    retries: int = 5,
+    backoff: float = 0.1,
+) -> dict:
+    """Update a JSON document atomically with optimistic concurrency, return the document stored.
+
+    The document is read with a single GET and passed to `update`, None if it is not stored. The updated
+    document is stored only if the document was not changed in the meantime, checked on its ETag, otherwise
+    it is read and updated again, at most `retries` times with randomized exponential backoff.
+    """
+    from botocore.exceptions import ClientError
+
+    key = f"{ceph_adapter.prefix}{document_id}"
+    client = ceph_adapter._s3.meta.client
+
+    attempt = 0
+    while True:
+        document: Optional[dict] = None
+        conditions = {"IfNoneMatch": "*"}
+        try:
+            with span(CEPH_RETRIEVE):
+                response = client.get_object(Bucket=ceph_adapter.bucket, Key=key)
+                document = json.loads(response["Body"].read().decode())
+            conditions = {"IfMatch": response["ETag"]}
+        except ClientError as exc:
+            if exc.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+                raise
+
+        updated = update(document)
+
+        try:
+            with span(CEPH_STORE):
+                _put_object(ceph_adapter, key, ceph_adapter.dict2blob(updated), **conditions)
+            return updated
+        except ClientError as exc:
+            if exc.response["Error"]["Code"] not in _CONFLICT_ERROR_CODES:
+                raise
+
+            if attempt >= retries:
+                raise ConcurrentUpdateError(
+                    f"Document {document_id} was changed concurrently on each of {attempt + 1} attempts to update it"
+                ) from exc
+
+            delay = backoff * 2**attempt * random.uniform(0.5, 1.5)  # noqa: S311
+            _LOGGER.info(f"Document {document_id} was changed concurrently, updating it again in {delay:.2f}s...")
+            time.sleep(delay)
+            attempt += 1
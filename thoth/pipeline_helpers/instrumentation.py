@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# pipeline-helpers
+# Copyright(C) 2022 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Time phases of pipeline helpers and report where their wall time goes.
+
+Phases are timed with spans measured by time.perf_counter_ns and aggregated per phase in memory. On exit
+timings are written as JSON to PIPELINE_HELPERS_TIMINGS_FILE_PATH and in Prometheus text format to
+PIPELINE_HELPERS_TIMINGS_PROMETHEUS_FILE_PATH, if set.
+"""
+
+import atexit
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+from typing import Optional
+from typing import TypeVar
+
+_LOGGER = logging.getLogger("thoth.pipeline_helpers.instrumentation")
+
+TIMINGS_FILE_PATH = os.getenv("PIPELINE_HELPERS_TIMINGS_FILE_PATH")  # type: Optional[str]
+TIMINGS_PROMETHEUS_FILE_PATH = os.getenv("PIPELINE_HELPERS_TIMINGS_PROMETHEUS_FILE_PATH")  # type: Optional[str]
+
+# Phases timed across helpers.
+CEPH_CONNECT = "ceph_connect"
+CEPH_LIST = "ceph_list"
+CEPH_RETRIEVE = "ceph_retrieve"
+CEPH_STORE = "ceph_store"
+YAML_LOAD = "yaml_load"
+YAML_DUMP = "yaml_dump"
+QUAY_REQUEST = "quay_request"
+PROMQL_QUERY = "promql_query"
+REPORT_RENDER = "report_render"
+
+_F = TypeVar("_F", bound=Callable[..., Any])
+
+_lock = threading.Lock()
+_timings: Dict[str, Dict[str, int]] = {}
+_helper = os.path.splitext(os.path.basename(sys.argv[0] if sys.argv and sys.argv[0] else "python"))[0]
+
+
+def set_helper(name: str) -> None:
+    """Set name of the helper run, reported with timings."""
+    global _helper
+    _helper = name
+
+
+def record(phase: str, duration_ns: int) -> None:
+    """Record a span of the given phase that took the given time in nanoseconds."""
+    with _lock:
+        timing = _timings.get(phase)
+        if timing is None:
+            _timings[phase] = {"count": 1, "total_ns": duration_ns, "min_ns": duration_ns, "max_ns": duration_ns}
+            return
+
+        timing["count"] += 1
+        timing["total_ns"] += duration_ns
+        if duration_ns < timing["min_ns"]:
+            timing["min_ns"] = duration_ns
+        if duration_ns > timing["max_ns"]:
+            timing["max_ns"] = duration_ns
+
+
+@contextmanager
+def span(phase: str) -> Iterator[None]:
+    """Time the enclosed block as a span of the given phase, failed spans are recorded too."""
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        record(phase, time.perf_counter_ns() - start)
+
+
+def timed(phase: str) -> Callable[[_F], _F]:
+    """Time each call of the decorated function as a span of the given phase."""
+
+    def decorator(function: _F) -> _F:
+        @functools.wraps(function)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with span(phase):
+                return function(*args, **kwargs)
+
+        return wrapper  # type: ignore
+
+    return decorator
+
+
+def get_timings() -> Dict[str, Dict[str, int]]:
+    """Get a copy of timings recorded so far keyed by phase."""
+    with _lock:
+        return {phase: dict(timing) for phase, timing in _timings.items()}
+
+
+def to_json() -> str:
+    """Serialize timings recorded to JSON."""
+    return json.dumps({"helper": _helper, "phases": get_timings()}, sort_keys=True, indent=2)
+
+
+def _escape_label(value: str) -> str:
+    """Escape a Prometheus label value."""
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def to_prometheus() -> str:
+    """Serialize timings recorded to Prometheus text exposition format."""
+    timings = get_timings()
+    lines = [
+        "# HELP pipeline_helpers_phase_duration_seconds Time spent in phases of pipeline helpers.",
+        "# TYPE pipeline_helpers_phase_duration_seconds summary",
+    ]
+    for phase, timing in sorted(timings.items()):
+        labels = f'helper="{_escape_label(_helper)}",phase="{_escape_label(phase)}"'
+        lines.append(f"pipeline_helpers_phase_duration_seconds_sum{{{labels}}} {timing['total_ns'] / 1e9}")
+        lines.append(f"pipeline_helpers_phase_duration_seconds_count{{{labels}}} {timing['count']}")
+
+    lines.extend(
+        [
+            "# HELP pipeline_helpers_phase_duration_max_seconds Longest span of phases of pipeline helpers.",
+            "# TYPE pipeline_helpers_phase_duration_max_seconds gauge",
+        ]
+    )
+    for phase, timing in sorted(timings.items()):
+        labels = f'helper="{_escape_label(_helper)}",phase="{_escape_label(phase)}"'
+        lines.append(f"pipeline_helpers_phase_duration_max_seconds{{{labels}}} {timing['max_ns'] / 1e9}")
+
+    return "\n".join(lines) + "\n"
+
+
+def write_timings(
+    file_path: Optional[str] = TIMINGS_FILE_PATH, prometheus_file_path: Optional[str] = TIMINGS_PROMETHEUS_FILE_PATH
+) -> None:
+    """Write timings recorded to the given files, as JSON and in Prometheus text format."""
+    for path, serialize in ((file_path, to_json), (prometheus_file_path, to_prometheus)):
+        if not path:
+            continue
+
+        try:
+            with open(path, "w") as timings_file:
+                timings_file.write(serialize())
+        except Exception as exc:
+            _LOGGER.warning(f"Failed to write timings to {path}: {exc}")
+
+
+if TIMINGS_FILE_PATH or TIMINGS_PROMETHEUS_FILE_PATH:
+    atexit.register(write_timings)
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+# pipeline-helpers
+# Copyright(C) 2022 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Read metrics files produced by tests, summarizing series of numbers while they are read.
+
+Metrics files are either a single JSON object or JSON lines (files ending with .jsonl or .ndjson), one
+object per line. Arrays of numbers, and numbers reported more than once for the same key in JSON lines,
+are reduced to summary statistics instead of being kept in memory as Python objects. A JSON object is
+parsed incrementally with ijson, it is loaded with json only where ijson is not installed.
+"""
+
+import json
+import logging
+import math
+import re
+from array import array
+from typing import Any
+from typing import Dict
+from typing import IO
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+_LOGGER = logging.getLogger("thoth.pipeline_helpers.metrics_stream")
+
+# Percentiles reported in summaries of series.
+PERCENTILES = (50, 95, 99)
+
+_JSON_LINES_SUFFIXES = (".jsonl", ".ndjson")
+# Numbers written at once when writing series of numbers.
+_WRITE_CHUNK_SIZE = 4096
+
+# Rules merging numbers reported once by each of several shards.
+SUM = "sum"
+MEAN = "mean"
+MIN = "min"
+MAX = "max"
+FIRST = "first"
+SERIES = "series"
+MERGE_RULES = (SUM, MEAN, MIN, MAX, FIRST, SERIES)
+# Metrics counting events, summed across shards unless a rule is given for them.
+COUNTER_RE = re.compile(r"^(number|count|total)_|_(count|total)$")
+
+
+def _is_number(value: Any) -> bool:
+    """Check whether the given value is a JSON number."""
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class SeriesSummary:
+    """Summary statistics of a series of numbers computed as the numbers are added.
+
+    Numbers are kept in a compact array of doubles, 8 bytes each, to compute exact percentiles.
+    """
+
+    def __init__(self, values: Iterable[float] = ()) -> None:
+        """Initialize summary with the given numbers."""
+        self.values = array("d")
+        self.min = math.inf
+        self.max = -math.inf
+        self.sum = 0.0
+        self.extend(values)
+
+    def add(self, value: float) -> None:
+        """Add a number to the series."""
+        value = float(value)
+        self.values.append(value)
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def extend(self, values: Iterable[float]) -> None:
+        """Add numbers to the series."""
+        for value in values:
+            self.add(value)
+
+    def __len__(self) -> int:
+        """Get number of numbers in the series."""
+        return len(self.values)
+
+    def to_dict(self) -> Dict[str, float]:
+        """Get count, min, max, mean and percentiles of the series."""
+        if not self.values:
+            return {"count": 0}
+
+        import numpy as np
+
+        percentiles = np.percentile(np.frombuffer(self.values, dtype=np.float64), PERCENTILES)
+        summary = {"count": len(self.values), "min": self.min, "max": self.max, "mean": self.sum / len(self.values)}
+        summary.update({f"p{percentile}": float(value) for percentile, value in zip(PERCENTILES, percentiles)})
+        return summary
+
+
+class _MetricsCollector:
+    """Collect metrics read from a file, numbers reported repeatedly for a key are summarized."""
+
+    def __init__(self) -> None:
+        """Initialize an empty collection of metrics."""
+        self.metrics: Dict[str, Any] = {}
+
+    def add(self, key: str, value: Any) -> None:
+        """Add a value reported for a metric."""
+        current = self.metrics.get(key)
+        if isinstance(current, SeriesSummary) and _is_number(value):
+            current.add(value)
+        elif key in self.metrics and _is_number(current) and _is_number(value):
+            self.metrics[key] = SeriesSummary((current, value))
+        else:
+            self.metrics[key] = value
+
+    def add_series(self, key: str, series: SeriesSummary) -> None:
+        """Add a series of numbers reported for a metric."""
+        current = self.metrics.get(key)
+        if isinstance(current, SeriesSummary):
+            current.extend(series.values)
+        elif key in self.metrics and _is_number(current):
+            series.add(current)
+            self.metrics[key] = series
+        else:
+            self.metrics[key] = series
+
+    def result(self, flatten: bool = False) -> Dict[str, Any]:
+        """Get metrics collected, summaries of series are dictionaries or flattened to "<key> <statistic>"."""
+        result: Dict[str, Any] = {}
+        for key, value in self.metrics.items():
+            if not isinstance(value, SeriesSummary):
+                result[key] = value
+            elif flatten:
+                result.update({f"{key} {statistic}": number for statistic, number in value.to_dict().items()})
+            else:
+                result[key] = value.to_dict()
+
+        return result
+
+
+def _build_value(events: Iterator[Tuple[str, Any]], builder: Any, depth: int) -> Any:
+    """Build a nested value from parser events, the builder was already fed events up to the given depth."""
+    for event, value in events:
+        builder.event(event, value)
+        if event in ("start_map", "start_array"):
+            depth += 1
+        elif event in ("end_map", "end_array"):
+            depth -= 1
+            if depth == 0:
+                return builder.value
+
+    raise ValueError("Unexpected end of metrics file")
+
+
+def _read_array(events: Iterator[Tuple[str, Any]], key: str, collector: _MetricsCollector) -> None:
+    """Read an array from parser events, summarizing it if it holds only numbers."""
+    import ijson
+
+    series = SeriesSummary()
+    for event, value in events:
+        if event == "number":
+            series.add(value)
+            continue
+
+        if event == "end_array":
+            collector.add_series(key, series)
+            return
+
+        # Not an array of numbers, keep it as it is.
+        builder = ijson.ObjectBuilder()
+        builder.event("start_array", None)
+        for number in series.values:
+            builder.event("number", int(number) if number.is_integer() else number)
+        builder.event(event, value)
+        depth = 2 if event in ("start_map", "start_array") else 1
+        collector.add(key, _build_value(events, builder, depth))
+        return
+
+    raise ValueError("Unexpected end of metrics file")
+
+
+def _read_json_stream(stream: IO[bytes], collector: _MetricsCollector) -> None:
+    """Read metrics from a JSON object using an incremental parser."""
+    import ijson
+
+    events = iter(ijson.basic_parse(stream, use_float=True))
+    event, _ = next(events, (None, None))
+    if event != "start_map":
+        raise ValueError("Metrics file does not hold a JSON object")
+
+    for event, key in events:
+        if event == "end_map":
+            return
+
+        event, value = next(events)
+        if event == "start_array":
+            _read_array(events, key, collector)
+        elif event == "start_map":
+            builder = ijson.ObjectBuilder()
+            builder.event(event, value)
+            collector.add(key, _build_value(events, builder, 1))
+        else:
+            collector.add(key, value)
+
+
+def _add_object(metrics: Dict[str, Any], collector: _MetricsCollector) -> None:
+    """Add metrics of an already parsed JSON object."""
+    if not isinstance(metrics, dict):
+        raise ValueError("Metrics file does not hold a JSON object")
+
+    for key, value in metrics.items():
+        if isinstance(value, list) and all(_is_number(item) for item in value):
+            collector.add_series(key, SeriesSummary(value))
+        else:
+            collector.add(key, value)
+
+
+def _collect_metrics(path: str) -> _MetricsCollector:
+    """Read metrics from a file into a collector, series of numbers are kept as summaries."""
+    collector = _MetricsCollector()
+
+    if path.endswith(_JSON_LINES_SUFFIXES):
+        with open(path, "r") as metrics_file:
+            for line in metrics_file:
+                if line.strip():
+                    _add_object(json.loads(line), collector)
+
+        return collector
+
+    try:
+        import ijson  # noqa: F401
+    except ImportError:
+        _LOGGER.warning("ijson is not installed, metrics file is loaded at once")
+        with open(path, "r") as metrics_file:
+            _add_object(json.load(metrics_file), collector)
+    else:
+        with open(path, "rb") as metrics_file:
+            _read_json_stream(metrics_file, collector)
+
+    return collector
+
+
+def read_metrics(path: str, flatten: bool = False) -> Dict[str, Any]:
+    """Read metrics from a file, arrays of numbers are reduced to summary statistics.
+
+    Summaries are dictionaries with count, min, max, mean and percentiles, if flatten is set they are
+    stored instead under keys "<key> <statistic>" (e.g. "latency p95").
+    """
+    return _collect_metrics(path).result(flatten=flatten)
+
+
+def _merge_numbers(key: str, values: List[float], rule: Optional[str]) -> Any:
+    """Merge numbers reported once by each of several shards following the given rule, or the default one."""
+    if rule is None:
+        if COUNTER_RE.search(key):
+            rule = SUM
+        elif all(value == values[0] for value in values):
+            return values[0]
+        else:
+            rule = SERIES
+
+    if rule == SUM:
+        return sum(values)
+    if rule == MEAN:
+        return sum(values) / len(values)
+    if rule == MIN:
+        return min(values)
+    if rule == MAX:
+        return max(values)
+    if rule == FIRST:
+        return values[0]
+    return SeriesSummary(values)
+
+
+def _merge_values(key: str, values: List[Any], rule: Optional[str]) -> Any:
+    """Merge values reported for a metric by several shards."""
+    if len(values) == 1:
+        return values[0]
+
+    if all(_is_number(value) for value in values):
+        return _merge_numbers(key, values, rule)
+
+    if all(_is_number(value) or isinstance(value, SeriesSummary) for value in values):
+        series = SeriesSummary()
+        for value in values:
+            if isinstance(value, SeriesSummary):
+                series.extend(value.values)
+            else:
+                series.add(value)
+        return series
+
+    if any(value != values[0] for value in values):
+        _LOGGER.warning(f"Metric {key!r} reported by several shards cannot be merged, keeping the first one")
+    return values[0]
+
+
+def _write_series(output_file: IO[str], series: SeriesSummary, start: int, end: int) -> None:
+    """Write numbers of a series in the given range as items of a JSON array, without the brackets."""
+    output_file.write(", ".join(map(json.dumps, series.values[start:end])))
+
+
+def _write_metrics(metrics: Dict[str, Any], output_path: str) -> None:
+    """Write metrics to a file, series of numbers are written in chunks and not converted to a list at once."""
+    series = {key: value for key, value in metrics.items() if isinstance(value, SeriesSummary)}
+
+    with open(output_path, "w") as output_file:
+        if output_path.endswith(_JSON_LINES_SUFFIXES):
+            # Arrays in JSON lines extend series of the same key, so a series can span lines.
+            output_file.write(json.dumps({key: value for key, value in metrics.items() if key not in series}) + "\n")
+            for key, value in series.items():
+                for start in range(0, len(value), _WRITE_CHUNK_SIZE):
+                    output_file.write(f"{{{json.dumps(key)}: [")
+                    _write_series(output_file, value, start, start + _WRITE_CHUNK_SIZE)
+                    output_file.write("]}\n")
+            return
+
+        output_file.write("{")
+        for index, (key, value) in enumerate(metrics.items()):
+            output_file.write(f"{', ' if index else ''}{json.dumps(key)}: ")
+            if key not in series:
+                output_file.write(json.dumps(value))
+                continue
+
+            output_file.write("[")
+            for start in range(0, len(value), _WRITE_CHUNK_SIZE):
+                if start:
+                    output_file.write(", ")
+                _write_series(output_file, value, start, start + _WRITE_CHUNK_SIZE)
+            output_file.write("]")
+        output_file.write("}\n")
+
+
+def merge_metrics_files(paths: Iterable[str], output_path: str, rules: Optional[Dict[str, str]] = None) -> None:
+    """Merge metrics files written by test shards into one, in the order of the given paths.
+
+    Each file is read incrementally the same way as by `read_metrics`. Numbers and arrays of numbers reported
+    for a key by several files are merged into one array. Numbers reported once by each file are merged by
+    the rule given for their key: sum, mean, min, max, first or series (an array of the numbers). Without a
+    rule, counters (e.g. number_of_inferences) are summed, a number reported the same by all files is kept
+    and differing numbers are kept as a series. For other values the value from the first file is kept.
+    """
+    rules = rules or {}
+    unknown = {key: rule for key, rule in rules.items() if rule not in MERGE_RULES}
+    if unknown:
+        raise ValueError(f"Unknown rules to merge metrics {unknown}, supported rules are {', '.join(MERGE_RULES)}")
+
+    reported: Dict[str, List[Any]] = {}
+    for path in paths:
+        for key, value in _collect_metrics(path).metrics.items():
+            reported.setdefault(key, []).append(value)
+
+    _write_metrics({key: _merge_values(key, values, rules.get(key)) for key, values in reported.items()}, output_path)
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# pipeline-helpers
+# Copyright(C) 2022 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Locate fields in documents loaded from YAML or JSON using glob-like path queries.
+
+Queries are made of segments separated by dots:
+
+* `name` matches a key of a mapping, `["name.with.dots"]` quotes a key,
+* `*` matches any key of a mapping,
+* `[0]` matches an item of a list, `[*]` any item of a list,
+* `**` matches any number of levels, including none.
+
+For example `**.base-image` matches every base-image key and `deploy[*].image` image keys of items
+listed under deploy.
+"""
+
+import re
+from functools import lru_cache
+from typing import Any
+from typing import FrozenSet
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Union
+
+PathElement = Union[str, int]
+
+_TOKEN_RE = re.compile(
+    r"""
+      (?P<dot>\.)?
+      (?:
+          (?P<recursive>\*\*)
+        | (?P<any_key>\*)
+        | \[(?P<index>\d+|\*)\]
+        | \[(?P<quote>["'])(?P<quoted>.*?)(?P=quote)\]
+        | (?P<key>[^.\[\]*]+)
+      )
+    """,
+    re.VERBOSE,
+)
+
+# Kinds of segments.
+_KEY, _ANY_KEY, _INDEX, _ANY_INDEX, _RECURSIVE = range(5)
+
+# A path is shared by all its descendants through a parent pointer: (parent, element), None for the root.
+_PathLink = Optional[Tuple[Any, PathElement]]
+
+
+def _materialize(link: _PathLink) -> List[PathElement]:
+    """Materialize path from a chain of parent pointers."""
+    path = []
+    while link is not None:
+        link, element = link
+        path.append(element)
+
+    path.reverse()
+    return path
+
+
+class PathQuery:
+    """Compiled path query, matching is done iteratively and matches are streamed lazily."""
+
+    def __init__(self, query: str) -> None:
+        """Compile the given query."""
+        self.query = query
+        self.segments: List[Tuple[int, Any]] = []
+
+        position = 0
+        while position < len(query):
+            match = _TOKEN_RE.match(query, position)
+            if not match or (match.group("dot") and (match.group("index") is not None or match.group("quote"))):
+                raise ValueError(f"Invalid path query {query!r} at position {position}")
+
+            if position == 0 and match.group("dot"):
+                raise ValueError(f"Invalid path query {query!r}, it cannot start with a dot")
+
+            is_bracket = match.group("index") is not None or match.group("quote") is not None
+            if position > 0 and not is_bracket and not match.group("dot"):
+                raise ValueError(f"Invalid path query {query!r} at position {position}, expected a dot")
+
+            if match.group("recursive"):
+                self.segments.append((_RECURSIVE, None))
+            elif match.group("any_key"):
+                self.segments.append((_ANY_KEY, None))
+            elif match.group("index") == "*":
+                self.segments.append((_ANY_INDEX, None))
+            elif match.group("index") is not None:
+                self.segments.append((_INDEX, int(match.group("index"))))
+            elif match.group("quote"):
+                self.segments.append((_KEY, match.group("quoted")))
+            else:
+                self.segments.append((_KEY, match.group("key")))
+
+            position = match.end()
+
+        if not self.segments:
+            raise ValueError("Path query cannot be empty")
+
+    def _closure(self, positions: FrozenSet[int]) -> FrozenSet[int]:
+        """Add positions reachable by matching recursive segments against no level."""
+        closure = set(positions)
+        for position in sorted(positions):
+            while position < len(self.segments) and self.segments[position][0] == _RECURSIVE:
+                position += 1
+                closure.add(position)
+
+        return frozenset(closure)
+
+    def _step(self, positions: FrozenSet[int], element: PathElement, is_mapping: bool) -> FrozenSet[int]:
+        """Get positions reached after descending to a child identified by the given key or index."""
+        reached = set()
+        for position in positions:
+            if position == len(self.segments):
+                continue
+
+            kind, argument = self.segments[position]
+            if kind == _RECURSIVE:
+                reached.add(position)
+            elif is_mapping and (kind == _ANY_KEY or (kind == _KEY and element == argument)):
+                reached.add(position + 1)
+            elif not is_mapping and (kind == _ANY_INDEX or (kind == _INDEX and element == argument)):
+                reached.add(position + 1)
+
+        return frozenset(reached)
+
+    def _children(self, value: Any, positions: FrozenSet[int]) -> Iterator[Tuple[PathElement, Any, bool]]:
+        """Iterate over children of a value that can be matched by segments on the given positions."""
+        kinds = {self.segments[position] for position in positions if position < len(self.segments)}
+        is_mapping = isinstance(value, dict)
+
+        if not is_mapping and not isinstance(value, list):
+            return
+
+        if all(kind in (_KEY, _INDEX) for kind, _ in kinds):
+            # Look up exact keys and indexes directly instead of iterating over all children.
+            for kind, argument in sorted(kinds, key=str):
+                if kind == _KEY and is_mapping and argument in value:
+                    yield argument, value[argument], True
+                elif kind == _INDEX and not is_mapping and -len(value) <= argument < len(value):
+                    yield argument, value[argument], False
+            return
+
+        items = value.items() if is_mapping else enumerate(value)
+        for element, child in items:
+            yield element, child, is_mapping
+
+    def find(self, document: Any) -> Iterator[Tuple[List[PathElement], Any]]:
+        """Find paths matching the query in a document, yielding each path with the value found on it."""
+        final = len(self.segments)
+        stack: List[Tuple[Any, FrozenSet[int], _PathLink]] = [(document, self._closure(frozenset([0])), None)]
+
+        while stack:
+            value, positions, link = stack.pop()
+            if final in positions:
+                yield _materialize(link), value
+
+            children = []
+            for element, child, is_mapping in self._children(value, positions):
+                child_positions = self._step(positions, element, is_mapping)
+                if child_positions:
+                    children.append((child, self._closure(child_positions), (link, element)))
+
+            # Push in reverse so children are visited in document order.
+            stack.extend(reversed(children))
+
+    def parent(self) -> "PathQuery":
+        """Get query matching parents of values matched by this query."""
+        if len(self.segments) < 2:
+            raise ValueError(f"Path query {self.query!r} has no parent")
+
+        parent = PathQuery.__new__(PathQuery)
+        parent.query = f"{self.query} (parent)"
+        parent.segments = self.segments[:-1]
+        return parent
+
+    def paths(self, document: Any) -> Iterator[List[PathElement]]:
+        """Find paths matching the query in a document."""
+        for path, _ in self.find(document):
+            yield path
+
+
+@lru_cache(maxsize=128)
+def compile_query(query: str) -> PathQuery:
+    """Compile a path query, compiled queries are cached."""
+    return PathQuery(query)
+
+
+def find(document: Any, query: str) -> Iterator[Tuple[List[PathElement], Any]]:
+    """Find paths matching a query in a document, yielding each path with the value found on it."""
+    return compile_query(query).find(document)
+
+
+def get_value(document: Any, path: List[PathElement]) -> Any:
+    """Get value on the given path in a document."""
+    for element in path:
+        document = document[element]
+
+    return document
+
+
+def set_values(document: Any, query: str, value: Any) -> int:
+    """Set value on all paths matching a query, return number of values set.
+
+    If the last segment of the query is a key, the key is also created in mappings matched by the rest
+    of the query when it does not exist yet. Queries with `**` match mappings at any depth, so they only
+    set keys that already exist.
+    """
+    compiled = compile_query(query)
+    kind, argument = compiled.segments[-1]
+
+    if kind != _KEY or any(segment_kind == _RECURSIVE for segment_kind, _ in compiled.segments):
+        matches = list(compiled.paths(document))
+        for path in matches:
+            get_value(document, path[:-1])[path[-1]] = value
+
+        return len(matches)
+
+    parents = compiled.parent().find(document) if len(compiled.segments) > 1 else iter([([], document)])
+    count = 0
+    for _, parent in list(parents):
+        if isinstance(parent, dict):
+            parent[argument] = value
+            count += 1
+
+    return count
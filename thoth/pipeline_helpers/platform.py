@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# pipeline-helpers
+# Copyright(C) 2021 Francesco Murdaca
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Query platform metrics scraped by Prometheus for a deployed AI model."""
+
+import logging
+import math
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from string import Template
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import TYPE_CHECKING
+
+import numpy as np
+import yaml
+
+from thoth.pipeline_helpers.cache import DiskCache
+from thoth.pipeline_helpers.instrumentation import PROMQL_QUERY
+from thoth.pipeline_helpers.instrumentation import YAML_LOAD
+from thoth.pipeline_helpers.instrumentation import span
+from thoth.pipeline_helpers.instrumentation import timed
+
+if TYPE_CHECKING:
+    from prometheus_api_client import PrometheusConnect
+
+_LOGGER = logging.getLogger("thoth.pipeline_helpers.platform")
+
+# Maximum number of samples requested per series, Prometheus rejects queries with more than 11000.
+MAX_POINTS = 250
+# Minimum step in seconds, samples are not scraped more often than this.
+MIN_STEP = 15
+
+_METRIC_DEFAULTS: Dict[str, Any] = {
+    "statistics": ["max"],
+    "scale": 1,
+    "precision": 4,
+    "unit": "",
+    "positive_only": True,
+}
+
+
+def query_step(start: datetime, end: datetime, max_points: int = MAX_POINTS, min_step: int = MIN_STEP) -> str:
+    """Get step for a range query so that the gather window is covered with at most max_points samples."""
+    window = max((end - start).total_seconds(), 0)
+    return f"{max(min_step, math.ceil(window / max_points))}s"
+
+
+def run_range_queries(
+    pc: "PrometheusConnect",
+    queries: Dict[str, str],
+    start: datetime,
+    end: datetime,
+    step: Optional[str] = None,
+    max_workers: int = 4,
+) -> Dict[str, List[dict]]:
+    """Run range queries concurrently, return results keyed by query name.
+
+    A failing query does not fail the others, its result is empty so the metric is reported as not available.
+    """
+    step = step or query_step(start, end)
+    _LOGGER.info("Running %d range queries with step %s", len(queries), step)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            name: executor.submit(
+                timed(PROMQL_QUERY)(pc.custom_query_range),  # type: ignore
+                query=query,
+                start_time=start,
+                end_time=end,
+                step=step,
+            )
+            for name, query in queries.items()
+        }
+
+    results: Dict[str, List[dict]] = {}
+    for name, future in futures.items():
+        try:
+            results[name] = future.result()
+        except Exception as exc:
+            _LOGGER.warning("Range query for %r failed, it is reported as not available: %s", name, exc)
+            results[name] = []
+
+    return results
+
+
+def series_values(series: dict, positive_only: bool = True) -> np.ndarray:
+    """Get sample values of a range query series as a float array."""
+    values = series.get("values") or []
+    if not values:
+        return np.empty(0)
+
+    array = np.asarray(values, dtype=object)[:, 1].astype(float)
+    if positive_only:
+        array = array[array > 0]
+
+    return array
+
+
+def statistics(values: np.ndarray) -> Optional[Dict[str, float]]:
+    """Compute max, mean and 95th percentile of sample values, None if there are no samples."""
+    if values.size == 0:
+        return None
+
+    return {
+        "max": float(values.max()),
+        "mean": float(values.mean()),
+        "p95": float(np.percentile(values, 95)),
+    }
+
+
+def series_statistics(result: List[dict], positive_only: bool = True) -> List[Dict[str, Any]]:
+    """Compute statistics of each series returned by a range query, series without samples are skipped."""
+    series_stats = []
+    for series in result:
+        stats = statistics(series_values(series, positive_only=positive_only))
+        if stats is not None:
+            series_stats.append({"metric": series.get("metric", {}), **stats})
+
+    return series_stats
+
+
+def load_catalogue(path: str) -> List[Dict[str, Any]]:
+    """Load catalogue of platform metrics to gather, filling in defaults of optional fields."""
+    with open(path, "r") as catalogue_file:
+        with span(YAML_LOAD):
+            catalogue = yaml.safe_load(catalogue_file)
+
+    metrics = []
+    for metric in catalogue["metrics"]:
+        for field in ("name", "query", "key"):
+            if field not in metric:
+                raise ValueError(f"Metric {metric!r} in catalogue {path!r} has no {field!r} configured")
+
+        metrics.append({**_METRIC_DEFAULTS, **metric})
+
+    return metrics
+
+
+def not_available(catalogue: List[Dict[str, Any]]) -> Dict[str, str]:
+    """Get platform metrics reported when they cannot be gathered."""
+    return {
+        metric["key"].format(statistic=statistic): "N/A" for metric in catalogue for statistic in metric["statistics"]
+    }
+
+
+def _format_value(metric: Dict[str, Any], value: float) -> Any:
+    """Scale and round value of a statistic as configured for the metric in the catalogue."""
+    value = value * metric["scale"]
+    rounded = round(value) if metric["precision"] == 0 else round(value, metric["precision"])
+    return f"{rounded}{metric['unit']}" if metric["unit"] else rounded
+
+
+def gather_catalogue_metrics(
+    pc: "PrometheusConnect",
+    catalogue: List[Dict[str, Any]],
+    labels: Dict[str, str],
+    start: datetime,
+    end: datetime,
+    step: Optional[str] = None,
+    cache: Optional[DiskCache] = None,
+    max_workers: int = 4,
+) -> Dict[str, Any]:
+    """Gather metrics in the catalogue, running queries not found in the cache concurrently.
+
+    Queries are templates substituted with the given labels. Non-empty results are cached keyed by
+    the query, which selects the pod, and the gather window.
+    """
+    step = step or query_step(start, end)
+    queries = {metric["name"]: Template(metric["query"]).substitute(labels) for metric in catalogue}
+
+    results: Dict[str, List[dict]] = {}
+    to_query = {}
+    for name, query in queries.items():
+        cached = cache.get([query, start.timestamp(), end.timestamp(), step]) if cache else None
+        if cached is not None:
+            _LOGGER.info("Using cached result for %r", name)
+            results[name] = cached
+        else:
+            to_query[name] = query
+
+    if to_query:
+        for name, result in run_range_queries(pc, to_query, start, end, step=step, max_workers=max_workers).items():
+            _LOGGER.debug("Result for %r: %r", name, result)
+            results[name] = result
+            if cache and result:
+                cache.set([to_query[name], start.timestamp(), end.timestamp(), step], result)
+
+    metric_data: Dict[str, Any] = {}
+    for metric in catalogue:
+        series_stats = series_statistics(results[metric["name"]], positive_only=metric["positive_only"])
+        for statistic in metric["statistics"]:
+            key = metric["key"].format(statistic=statistic)
+            metric_data[key] = _format_value(metric, series_stats[0][statistic]) if series_stats else "N/A"
+
+    return metric_data
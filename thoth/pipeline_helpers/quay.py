@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# pipeline-helpers
+# Copyright(C) 2022 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Retrieve tags of container image repositories hosted on Quay."""
+
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+from typing import Iterable
+from typing import Optional
+from typing import TYPE_CHECKING
+
+from thoth.pipeline_helpers.cache import DiskCache
+from thoth.pipeline_helpers.instrumentation import QUAY_REQUEST
+from thoth.pipeline_helpers.instrumentation import span
+from thoth.pipeline_helpers.version_index import TagIndex
+
+if TYPE_CHECKING:
+    import requests
+
+_LOGGER = logging.getLogger("thoth.pipeline_helpers.quay")
+
+QUAY_API_URL = os.getenv("PIPELINE_HELPERS_QUAY_API_URL", "https://quay.io/api/v1")
+QUAY_TIMEOUT = float(os.getenv("PIPELINE_HELPERS_QUAY_TIMEOUT", 30))
+QUAY_RETRIES = int(os.getenv("PIPELINE_HELPERS_QUAY_RETRIES", 3))
+QUAY_MAX_WORKERS = int(os.getenv("PIPELINE_HELPERS_QUAY_MAX_WORKERS", 8))
+QUAY_CACHE_TTL = float(os.getenv("PIPELINE_HELPERS_QUAY_CACHE_TTL", 3600))
+
+
+def create_session(token: Optional[str] = None, pool_size: int = QUAY_MAX_WORKERS) -> "requests.Session":
+    """Create a session with pooled connections to Quay retrying failed requests with backoff."""
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(total=QUAY_RETRIES, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504))
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=pool_size, pool_maxsize=pool_size)
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if token:
+        session.headers["Authorization"] = f"Bearer {token}"
+
+    return session
+
+
+def get_repository_tags(
+    session: "requests.Session", repository: str, prefix: str = "v", cache: Optional[DiskCache] = None
+) -> TagIndex:
+    """Get index of tags of a repository (e.g. thoth-station/s2i-thoth-ubi8-py38), empty if they cannot be retrieved."""
+    cached = cache.get([repository, prefix]) if cache else None
+    if cached is not None:
+        _LOGGER.debug(f"Using cached tags for {repository}")
+        return TagIndex.from_dict(cached)
+
+    _LOGGER.info(f"Requesting tags from Quay.io for {repository}")
+    try:
+        with span(QUAY_REQUEST):
+            response = session.get(f"{QUAY_API_URL}/repository/{repository}", timeout=QUAY_TIMEOUT)
+        response.raise_for_status()
+        tag_index = TagIndex(response.json().get("tags", {}).keys(), prefix=prefix)
+    except Exception as exc:
+        _LOGGER.warning(f"Failed to retrieve tags for {repository}: {exc}")
+        return TagIndex([], prefix=prefix)
+
+    if cache:
+        cache.set([repository, prefix], tag_index.to_dict())
+
+    return tag_index
+
+
+def get_repositories_tags(
+    repositories: Iterable[str],
+    prefix: str = "v",
+    token: Optional[str] = None,
+    max_workers: int = QUAY_MAX_WORKERS,
+    cache_ttl: Optional[float] = QUAY_CACHE_TTL,
+) -> Dict[str, TagIndex]:
+    """Get tag indexes of repositories, each unique repository is requested once and requests are run concurrently."""
+    unique_repositories = sorted(set(repositories))
+    cache = DiskCache("quay-tags", ttl=cache_ttl) if cache_ttl else None
+
+    with create_session(token, pool_size=max_workers) as session:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            tags = executor.map(
+                lambda repository: get_repository_tags(session, repository, prefix, cache), unique_repositories
+            )
+            return dict(zip(unique_repositories, tags))
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# pipeline-helpers
+# Copyright(C) 2022 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Detect regressions of metrics of a PR against the history of metrics of previous PRs.
+
+The baseline of each metric and overlay is the distribution of its values in the most recent PRs preceding
+the current one. A value is a regression if it exceeds the baseline median by more than a number of robust
+standard deviations (estimated from the median absolute deviation) and by more than a relative tolerance.
+Only metrics where higher values are worse, such as latency, CPU or memory usage, are considered, summary
+statistics of series which do not tell the quality of a deployment (such as "latency count") are not.
+"""
+
+import logging
+import re
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+
+from thoth.pipeline_helpers.report import metric_value
+
+_LOGGER = logging.getLogger("thoth.pipeline_helpers.regressions")
+
+# Scale of the median absolute deviation to estimate standard deviation of normally distributed values.
+_MAD_SCALE = 1.4826
+
+DEFAULT_METRICS_PATTERN = r"latency|cpu|memory"
+# Statistics of series summarized as "<metric> <statistic>" where higher values are not worse, e.g. the number
+# of requests served or the fastest request.
+EXCLUDED_STATISTICS = ("count", "min")
+
+
+def parse_document_id(document_id: str) -> Tuple[Optional[int], str]:
+    """Get PR number and overlay name from id of a processed metrics document, e.g. "12/overlay/processed_metrics"."""
+    parts = document_id.split("/")
+    overlay_name = parts[1] if len(parts) > 2 else ""
+    try:
+        return int(parts[0]), overlay_name
+    except ValueError:
+        return None, overlay_name
+
+
+def find_regressions(
+    history: Iterable[Tuple[int, str, Dict[str, Any]]],
+    pr_number: int,
+    metrics_pattern: str = DEFAULT_METRICS_PATTERN,
+    baseline_size: int = 20,
+    min_baseline_size: int = 3,
+    threshold: float = 3.0,
+    tolerance: float = 0.1,
+    excluded_statistics: Iterable[str] = EXCLUDED_STATISTICS,
+) -> List[Dict[str, Any]]:
+    """Find metrics of the given PR that regressed against the baseline of previous PRs, per overlay.
+
+    History holds PR number, overlay name and metrics of each stored deployment. Return a row per
+    regression, ordered by overlay and metric.
+    """
+    pattern = re.compile(metrics_pattern, re.IGNORECASE)
+    excluded_suffixes = tuple(f" {statistic}" for statistic in excluded_statistics)
+
+    # Metric values of each overlay keyed by PR number.
+    overlays: Dict[str, Dict[int, Dict[str, float]]] = {}
+    for history_pr_number, overlay_name, metrics in history:
+        if history_pr_number > pr_number:
+            continue
+
+        values = overlays.setdefault(overlay_name, {}).setdefault(history_pr_number, {})
+        for metric, value in metrics.items():
+            if not pattern.search(metric) or metric.endswith(excluded_suffixes):
+                continue
+
+            number = metric_value(value)
+            if number is not None:
+                values[metric] = number
+
+    regressions = []
+    for overlay_name, prs in sorted(overlays.items()):
+        current = prs.get(pr_number)
+        baseline_prs = sorted(pr for pr in prs if pr < pr_number)[-baseline_size:]
+        if not current or len(baseline_prs) < min_baseline_size:
+            continue
+
+        metrics = sorted(current)
+        baseline = np.full((len(baseline_prs), len(metrics)), np.nan)
+        for row, baseline_pr in enumerate(baseline_prs):
+            for column, metric in enumerate(metrics):
+                baseline[row, column] = prs[baseline_pr].get(metric, np.nan)
+
+        current_values = np.array([current[metric] for metric in metrics])
+        samples = np.sum(~np.isnan(baseline), axis=0)
+        enough = samples >= min_baseline_size
+        if not enough.any():
+            continue
+
+        with np.errstate(all="ignore"):
+            median = np.nanmedian(baseline[:, enough], axis=0)
+            mad = np.nanmedian(np.abs(baseline[:, enough] - median), axis=0) * _MAD_SCALE
+            allowed = np.maximum(threshold * mad, tolerance * np.abs(median))
+            regressed = current_values[enough] - median > allowed
+            score = np.where(mad > 0, (current_values[enough] - median) / mad, np.inf)
+
+        for index in np.flatnonzero(regressed):
+            metric = np.asarray(metrics)[enough][index]
+            base = float(median[index])
+            regressions.append(
+                {
+                    "overlay": overlay_name or "-",
+                    "metric": str(metric),
+                    "value": float(current_values[enough][index]),
+                    "baseline median": base,
+                    "change": f"{(current_values[enough][index] - base) / abs(base):+.1%}" if base else "n/a",
+                    "robust z-score": round(float(score[index]), 2),
+                    "baseline PRs": int(samples[enough][index]),
+                }
+            )
+
+    _LOGGER.info(f"Found {len(regressions)} regressions of PR {pr_number} against previous PRs")
+    return regressions
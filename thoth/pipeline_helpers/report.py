@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# pipeline-helpers
+# Copyright(C) 2021 Francesco Murdaca
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Helpers to build reports on metrics gathered for AI model deployments."""
+
+import heapq
+import html
+import itertools
+import math
+import re
+from typing import Any
+from typing import Dict
+from typing import Generic
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import TypeVar
+
+from thoth.pipeline_helpers.instrumentation import REPORT_RENDER
+from thoth.pipeline_helpers.instrumentation import timed
+
+_NUMBER_RE = re.compile(r"^\s*([-+]?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)")
+_PR_NUMBER_RE = re.compile(r"^pr-(\d+)")
+
+# Key used to sort rows by PR number parsed from the model version.
+PR_NUMBER_KEY = "pr_number"
+
+_T = TypeVar("_T")
+
+# Cell value used for keys missing in a row, rendered as NaN the same way pandas does.
+_MISSING = object()
+
+# Column types ordered from the least to the most generic one, as considered when rendering tables.
+_NONE, _BOOL, _INT, _FLOAT, _TEXT = range(5)
+
+
+def metric_value(value: Any) -> Optional[float]:
+    """Get numeric value of a metric, parsing a leading number from strings such as "128Mi"."""
+    if isinstance(value, bool):
+        return None
+
+    if isinstance(value, (int, float)):
+        return float(value)
+
+    if isinstance(value, str):
+        match = _NUMBER_RE.match(value)
+        if match:
+            return float(match.group(1))
+
+    return None
+
+
+def row_sort_value(metric: str, *rows: dict) -> Optional[float]:
+    """Get value of the given metric to sort by, looking it up in the given rows in order."""
+    for row in rows:
+        if metric == PR_NUMBER_KEY:
+            match = _PR_NUMBER_RE.match(str(row.get("model_version", "")))
+            if match:
+                return float(match.group(1))
+        elif metric in row:
+            return metric_value(row[metric])
+
+    return None
+
+
+class TopN(Generic[_T]):
+    """Keep the N items with the highest (or lowest) sort value out of a stream of items.
+
+    Only N items are kept in memory at any time. Items without a sort value are ranked last, ties keep the
+    order in which items were offered, or the order given with them.
+    """
+
+    def __init__(self, size: int, descending: bool = True) -> None:
+        """Initialize the selection for the given number of items."""
+        self.size = size
+        self.descending = descending
+        self._heap: List[Tuple[Tuple[bool, float], int, _T]] = []
+        self._counter = itertools.count()
+
+    def push(self, item: _T, value: Optional[float], order: Optional[int] = None) -> None:
+        """Offer an item with its sort value to the selection, ties are ranked by the given order if any."""
+        if self.size <= 0:
+            return
+
+        if value is None:
+            key = (False, 0.0)
+        else:
+            key = (True, value if self.descending else -value)
+
+        entry = (key, -(next(self._counter) if order is None else order), item)
+        if len(self._heap) < self.size:
+            heapq.heappush(self._heap, entry)
+        else:
+            heapq.heappushpop(self._heap, entry)
+
+    def extend(self, items: Iterable[Tuple[_T, Optional[float]]]) -> None:
+        """Offer items with their sort values to the selection."""
+        for item, value in items:
+            self.push(item, value)
+
+    def items(self) -> List[_T]:
+        """Get the selected items, most relevant first."""
+        return [item for _, _, item in sorted(self._heap, reverse=True)]
+
+    def __len__(self) -> int:
+        """Get number of items selected."""
+        return len(self._heap)
+
+
+def _is_number(value: Any) -> bool:
+    """Check whether the given value is a number or a string holding a number."""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return False
+
+    if isinstance(value, str) and (math.isinf(number) or math.isnan(number)):
+        return value.lower() in ("inf", "-inf", "nan")
+
+    return True
+
+
+def _is_int(value: Any) -> bool:
+    """Check whether the given value is an integer or a string holding an integer."""
+    if type(value) is int:
+        return True
+
+    if isinstance(value, str):
+        try:
+            int(value)
+        except ValueError:
+            return False
+        return True
+
+    return False
+
+
+def _cell_type(value: Any) -> int:
+    """Get type of a cell value."""
+    if value is None:
+        return _NONE
+    if hasattr(value, "isoformat"):
+        return _TEXT
+    if type(value) is bool or value in ("True", "False"):
+        return _BOOL
+    if _is_int(value):
+        return _INT
+    if _is_number(value):
+        return _FLOAT
+    return _TEXT
+
+
+def _after_point(value: str) -> int:
+    """Get number of characters after the decimal point of a formatted number, -1 if there is none."""
+    if not _is_number(value) or _is_int(value):
+        return -1
+
+    position = value.rfind(".")
+    if position < 0:
+        position = value.lower().rfind("e")
+
+    return len(value) - position - 1 if position >= 0 else -1
+
+
+def _columns(rows: Iterable[Dict[str, Any]]) -> Dict[str, List[Any]]:
+    """Split rows into columns, a union of keys in order of appearance with missing cells marked."""
+    columns: Dict[str, List[Any]] = {}
+    row_count = 0
+
+    for row in rows:
+        for key, value in row.items():
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = [_MISSING] * row_count
+            column.append(value)
+
+        row_count += 1
+        for column in columns.values():
+            if len(column) < row_count:
+                column.append(_MISSING)
+
+    return columns
+
+
+def _column_dtype(column: List[Any]) -> str:
+    """Get dtype pandas would infer for a column: "bool", "int", "float" or "object"."""
+    present = [value for value in column if value is not _MISSING and value is not None]
+    has_missing = len(present) != len(column)
+
+    if not present:
+        return "float" if any(value is _MISSING for value in column) else "object"
+
+    if all(type(value) is bool for value in present):
+        return "object" if has_missing else "bool"
+
+    if all(isinstance(value, int) and not isinstance(value, bool) for value in present):
+        return "float" if has_missing else "int"
+
+    if all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in present):
+        return "float"
+
+    return "object"
+
+
+def _normalize_columns(columns: Dict[str, List[Any]]) -> List[List[Any]]:
+    """Convert cell values the same way a pandas DataFrame built from the rows would expose them."""
+    dtypes = [_column_dtype(column) for column in columns.values()]
+    normalized = []
+
+    for column, dtype in zip(columns.values(), dtypes):
+        if dtype == "float":
+            normalized.append([math.nan if value is _MISSING or value is None else float(value) for value in column])
+        elif dtype == "object":
+            normalized.append([math.nan if value is _MISSING else value for value in column])
+        else:
+            normalized.append(list(column))
+
+    if dtypes and (all(dtype in ("int", "float") for dtype in dtypes) or all(dtype == "bool" for dtype in dtypes)):
+        # Homogeneous frames expose NumPy scalars which are all rendered as floats.
+        normalized = [[float(value) for value in column] for column in normalized]
+
+    return normalized
+
+
+def _format_cell(value: Any, column_type: int) -> str:
+    """Format a cell value for the given column type."""
+    if value is None:
+        return ""
+
+    if column_type == _FLOAT and _is_number(value):
+        return format(float(value), "g")
+
+    return f"{value}"
+
+
+def _align_column(header: str, cells: List[str], numeric: bool) -> Tuple[List[str], int]:
+    """Align cells of a column, numbers are aligned on their decimal point and text is flushed left."""
+    if numeric:
+        decimals = [_after_point(cell) for cell in cells]
+        max_decimals = max(decimals, default=-1)
+        cells = [cell + (max_decimals - cell_decimals) * " " for cell, cell_decimals in zip(cells, decimals)]
+    else:
+        cells = [cell.strip() for cell in cells]
+
+    width = max([len(header) + 2] + [len(cell) for cell in cells])
+    if numeric:
+        return [cell.rjust(width) for cell in cells], width
+
+    return [cell.ljust(width) for cell in cells], width
+
+
+def render_markdown_table(rows: Iterable[Dict[str, Any]]) -> str:
+    """Render rows as a markdown table.
+
+    Columns are the union of keys of all rows, cells missing in a row are rendered as nan. The output
+    matches pandas.DataFrame(rows).to_markdown(index=False) without requiring pandas or tabulate.
+    """
+    columns = _columns(rows)
+    if not columns:
+        return ""
+
+    headers = list(columns)
+    header_cells = []
+    separator_cells = []
+    aligned_columns = []
+
+    for header, column in zip(headers, _normalize_columns(columns)):
+        column_type = max([_BOOL] + [_cell_type(value) for value in column])
+        numeric = column_type in (_INT, _FLOAT)
+        cells, width = _align_column(header, [_format_cell(value, column_type) for value in column], numeric)
+        aligned_columns.append(cells)
+
+        if numeric:
+            header_cells.append(header.rjust(width))
+            separator_cells.append("-" * (width + 1) + ":")
+        else:
+            header_cells.append(header.ljust(width))
+            separator_cells.append(":" + "-" * (width + 1))
+
+    lines = ["| " + " | ".join(header_cells) + " |", "|" + "|".join(separator_cells) + "|"]
+    lines.extend("| " + " | ".join(cells) + " |" for cells in zip(*aligned_columns))
+    return "\n".join(lines)
+
+
+def render_html_table(rows: Iterable[Dict[str, Any]]) -> str:
+    """Render rows as an HTML table, columns are the union of keys of all rows."""
+    columns = _columns(rows)
+    if not columns:
+        return ""
+
+    lines = ["<table>", "<thead>", "<tr>" + "".join(f"<th>{html.escape(str(h))}</th>" for h in columns) + "</tr>"]
+    lines.extend(["</thead>", "<tbody>"])
+    for cells in zip(*columns.values()):
+        lines.append(
+            "<tr>"
+            + "".join(f"<td>{'' if c is _MISSING or c is None else html.escape(str(c))}</td>" for c in cells)
+            + "</tr>"
+        )
+    lines.extend(["</tbody>", "</table>"])
+    return "\n".join(lines)
+
+
+@timed(REPORT_RENDER)
+def render_table(rows: Iterable[Dict[str, Any]], table_format: str = "markdown") -> str:
+    """Render rows as a table in the given format, "markdown" or "html"."""
+    if table_format == "markdown":
+        return render_markdown_table(rows)
+    elif table_format == "html":
+        return render_html_table(rows)
+
+    raise ValueError(f"Unknown table format {table_format!r}, supported formats are markdown and html")
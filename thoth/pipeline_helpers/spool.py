@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# pipeline-helpers
+# Copyright(C) 2022 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Spool writes to Ceph in a local file while Ceph is unavailable and replay them once it is reachable again.
+
+The spool is an append-only JSON lines file in the workspace shared by pipeline runs, each line records a
+pending write of a document: either storing it whole or merging top level keys into the document stored.
+Writes are appended under an exclusive file lock and synced to disk, so concurrent helpers can share a spool.
+Flushes hold another exclusive lock from reading the spool until it is rewritten, so only one of them replays
+a pending write. Writes of a document are replayed in the order they were spooled, a document stored after
+a write was spooled is not overwritten by it.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+from typing import TYPE_CHECKING
+
+from thoth.pipeline_helpers.cache import CACHE_DIR
+
+if TYPE_CHECKING:
+    from thoth.storages import CephStore
+
+_LOGGER = logging.getLogger("thoth.pipeline_helpers.spool")
+
+SPOOL_PATH = os.getenv("PIPELINE_HELPERS_SPOOL_PATH", os.path.join(CACHE_DIR, "spool", "pending_writes.jsonl"))
+SPOOL_BATCH_SIZE = int(os.getenv("PIPELINE_HELPERS_SPOOL_BATCH_SIZE", 50))
+
+STORE = "store"
+MERGE = "merge"
+
+
+def _connect(prefix: str) -> "CephStore":
+    """Create a Ceph adapter for the given prefix and connect it."""
+    from thoth.storages import CephStore
+
+    ceph_adapter = CephStore(prefix=prefix)
+    ceph_adapter.connect()
+    return ceph_adapter
+
+
+def _write_key(record: Dict[str, Any]) -> Tuple[str, str, Optional[str]]:
+    """Get key identifying the document a record writes."""
+    return record["prefix"], record["document_id"], record.get("format")
+
+
+def _stored_after(ceph_adapter: "CephStore", document_id: str, document_format: Optional[str], since: float) -> bool:
+    """Check whether a document was stored after the given time, in the given format or STORAGE_FORMAT."""
+    from botocore.exceptions import ClientError
+    from thoth.pipeline_helpers.storage import COLUMN_GROUPS
+    from thoth.pipeline_helpers.storage import COLUMNAR_FORMAT
+    from thoth.pipeline_helpers.storage import STORAGE_FORMAT
+    from thoth.pipeline_helpers.storage import columnar_object_key
+
+    if (document_format or STORAGE_FORMAT) == COLUMNAR_FORMAT:
+        keys = [columnar_object_key(document_id, group) for group in COLUMN_GROUPS]
+    else:
+        keys = [document_id]
+
+    client = ceph_adapter._s3.meta.client
+    for key in keys:
+        try:
+            response = client.head_object(Bucket=ceph_adapter.bucket, Key=f"{ceph_adapter.prefix}{key}")
+        except ClientError as exc:
+            if exc.response["Error"]["Code"] not in ("404", "NoSuchKey", "NotFound"):
+                raise
+            continue
+
+        if response["LastModified"].timestamp() > since:
+            return True
+
+    return False
+
+
+def coalesce(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Combine records of the same document into a single write, applying them in the order they were spooled."""
+    writes: Dict[Tuple[str, str, Optional[str]], Dict[str, Any]] = {}
+    for record in records:
+        key = _write_key(record)
+        write = writes.get(key)
+        if write is None or record["operation"] == STORE:
+            writes[key] = dict(record, document=dict(record["document"]))
+        else:
+            # Merged keys override keys of the document stored or merged before.
+            write["document"].update(record["document"])
+            write["spooled_at"] = record["spooled_at"]
+
+    return list(writes.values())
+
+
+class WriteSpool:
+    """Pending writes of documents to Ceph kept in a local append-only file."""
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        """Initialize spool kept in the given file, SPOOL_PATH by default."""
+        self.path = path or SPOOL_PATH
+
+    @contextmanager
+    def _locked(self, suffix: str = ".lock") -> Iterator[None]:
+        """Hold an exclusive lock of the spool, the lock file outlives spool files replaced on flush."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(f"{self.path}{suffix}", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _append(self, operation: str, prefix: str, document_id: str, document: Dict[str, Any], **kwargs: Any) -> None:
+        """Append a pending write to the spool and sync it to disk."""
+        record = {
+            "operation": operation,
+            "prefix": prefix,
+            "document_id": document_id,
+            "document": document,
+            "spooled_at": time.time(),
+            **kwargs,
+        }
+        line = json.dumps(record, sort_keys=True) + "\n"
+
+        with self._locked(), open(self.path, "a") as spool_file:
+            spool_file.write(line)
+            spool_file.flush()
+            os.fsync(spool_file.fileno())
+
+        _LOGGER.warning(f"Ceph is not available, {operation} of {prefix}{document_id} was spooled to {self.path}")
+
+    def store(
+        self, prefix: str, document_id: str, document: Dict[str, Any], document_format: Optional[str] = None
+    ) -> None:
+        """Spool storing a document whole, in the given storage format or the default one."""
+        self._append(STORE, prefix, document_id, document, format=document_format)
+
+    def merge(
+        self, prefix: str, document_id: str, fields: Dict[str, Any], document_format: Optional[str] = None
+    ) -> None:
+        """Spool merging top level keys into a document, created if it is not stored."""
+        self._append(MERGE, prefix, document_id, fields, format=document_format)
+
+    def _read(self) -> Tuple[List[Dict[str, Any]], int]:
+        """Read pending writes, return them and size of the spool read."""
+        with self._locked():
+            try:
+                with open(self.path, "rb") as spool_file:
+                    content = spool_file.read()
+            except FileNotFoundError:
+                return [], 0
+
+        records = []
+        for line in content.splitlines():
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                _LOGGER.error(f"Dropping malformed record from spool {self.path}: {line[:200]!r}")
+
+        return records, len(content)
+
+    def _rewrite(self, read_size: int, records: List[Dict[str, Any]]) -> int:
+        """Replace the first read_size bytes of the spool with the given records, return their size.
+
+        Writes appended after the spool was read are kept.
+        """
+        with self._locked():
+            with open(self.path, "rb") as spool_file:
+                spool_file.seek(read_size)
+                appended = spool_file.read()
+
+            content = b"".join(json.dumps(record, sort_keys=True).encode("utf-8") + b"\n" for record in records)
+            directory = os.path.dirname(os.path.abspath(self.path))
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as tmp_file:
+                    tmp_file.write(content + appended)
+                    tmp_file.flush()
+                    os.fsync(tmp_file.fileno())
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+        return len(content)
+
+    def pending(self) -> int:
+        """Get number of pending writes."""
+        return len(self._read()[0])
+
+    def _replay(self, write: Dict[str, Any], connect: Callable[[str], "CephStore"]) -> None:
+        """Replay a pending write, writes storing a document are dropped if the document was stored since."""
+        from thoth.pipeline_helpers.storage import store_document
+        from thoth.pipeline_helpers.storage import update_stored_document
+
+        ceph_adapter = connect(write["prefix"])
+        if write["operation"] == STORE:
+            if _stored_after(ceph_adapter, write["document_id"], write.get("format"), write["spooled_at"]):
+                _LOGGER.warning(
+                    f"Dropping spooled write of {write['prefix']}{write['document_id']}, it was stored since"
+                )
+                return
+
+            store_document(ceph_adapter, write["document"], write["document_id"], document_format=write.get("format"))
+        elif write["operation"] == MERGE:
+            update_stored_document(
+                ceph_adapter,
+                write["document_id"],
+                lambda document: {**(document or {}), **write["document"]},
+                document_format=write.get("format"),
+            )
+        else:
+            raise ValueError(f"Unknown spooled operation {write['operation']!r}")
+
+    def flush(
+        self,
+        batch_size: int = SPOOL_BATCH_SIZE,
+        max_workers: int = 4,
+        connect: Optional[Callable[[str], "CephStore"]] = None,
+    ) -> int:
+        """Replay pending writes in batches, return number of documents written.
+
+        Writes of the same document within a batch are combined into one. Writes that fail are kept in
+        the spool, with later writes of the same document, progress is saved after each batch so an interrupted
+        flush does not replay writes again.
+        A flush waits for one running concurrently to finish, writes can be spooled meanwhile.
+        """
+        with self._locked(".flush.lock"):
+            return self._flush(batch_size, max_workers, connect)
+
+    def _flush(self, batch_size: int, max_workers: int, connect: Optional[Callable[[str], "CephStore"]]) -> int:
+        """Replay pending writes in batches, the caller holds the flush lock."""
+        records, read_size = self._read()
+        if not records:
+            return 0
+
+        _LOGGER.info(f"Replaying {len(records)} writes spooled in {self.path} in batches of {batch_size}")
+
+        adapters: Dict[str, "CephStore"] = {}
+
+        def connect_cached(prefix: str) -> "CephStore":
+            # Adapters are shared by writes of the same prefix, they are cheap to create but not free.
+            if prefix not in adapters:
+                adapters[prefix] = (connect or _connect)(prefix)
+            return adapters[prefix]
+
+        written = 0
+        failed: List[Dict[str, Any]] = []
+        failed_keys: Set[Tuple[str, str, Optional[str]]] = set()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for start in range(0, len(records), batch_size):
+                batch = records[start : start + batch_size]  # noqa: E203
+                writes = []
+                for write in coalesce(batch):
+                    # A later write replayed before an earlier one that failed would be overwritten by it.
+                    if _write_key(write) in failed_keys:
+                        failed.append(write)
+                    else:
+                        writes.append(write)
+
+                # Adapters are created upfront, so worker threads do not race creating them.
+                for prefix in {write["prefix"] for write in writes}:
+                    try:
+                        connect_cached(prefix)
+                    except Exception as exc:
+                        _LOGGER.warning(f"Could not connect to Ceph for {prefix}: {exc}")
+
+                futures = [
+                    executor.submit(self._replay, write, connect_cached) if write["prefix"] in adapters else None
+                    for write in writes
+                ]
+                for write, future in zip(writes, futures):
+                    try:
+                        if future is None:
+                            raise ConnectionError(f"no connection to Ceph for {write['prefix']}")
+                        future.result()
+                        written += 1
+                    except Exception as exc:
+                        _LOGGER.warning(f"Failed to replay write of {write['prefix']}{write['document_id']}: {exc}")
+                        failed.append(write)
+                        failed_keys.add(_write_key(write))
+
+                read_size = self._rewrite(read_size, failed + records[start + batch_size :])  # noqa: E203
+
+        if failed:
+            _LOGGER.warning(f"{len(failed)} spooled writes could not be replayed, they are kept in {self.path}")
+        _LOGGER.info(f"Replayed {written} spooled writes")
+        return written
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+# pipeline-helpers
+# Copyright(C) 2022 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Store metrics documents as JSON or in a compact columnar format.
+
+In the columnar format each column group of a document (info_metrics, model_application_metrics and
+platform_metrics) is stored as its own gzip compressed JSON lines object named
+"<document id>.<group>.jsonl.gz". The first line is a header, each following line holds values of one
+column for all rows, so readers retrieve only groups they need and decode only columns they use.
+"""
+
+import gzip
+import json
+import logging
+import os
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import TYPE_CHECKING
+
+from thoth.pipeline_helpers.common import list_documents
+from thoth.pipeline_helpers.common import update_document
+from thoth.pipeline_helpers.instrumentation import CEPH_RETRIEVE
+from thoth.pipeline_helpers.instrumentation import CEPH_STORE
+from thoth.pipeline_helpers.instrumentation import span
+
+if TYPE_CHECKING:
+    from thoth.storages import CephStore
+
+_LOGGER = logging.getLogger("thoth.pipeline_helpers.storage")
+
+JSON_FORMAT = "json"
+COLUMNAR_FORMAT = "columnar"
+STORAGE_FORMAT = os.getenv("PIPELINE_HELPERS_STORAGE_FORMAT", JSON_FORMAT)
+
+# Column groups of metrics documents, in the order they are stored.
+COLUMN_GROUPS = ("info_metrics", "model_application_metrics", "platform_metrics")
+SCHEMA_VERSION = 1
+
+_COLUMNAR_SUFFIX = ".jsonl.gz"
+
+
+def columnar_object_key(document_id: str, group: str) -> str:
+    """Get key of the object storing a column group of a document in the columnar format."""
+    return f"{document_id}.{group}{_COLUMNAR_SUFFIX}"
+
+
+def encode_group(group: str, value: Any, extra: Optional[Dict[str, Any]] = None) -> bytes:
+    """Encode a column group, a single row (dict) or a list of rows, as gzip compressed JSON lines."""
+    rows: List[Dict[str, Any]] = value if isinstance(value, list) else [value]
+
+    names = set()
+    for row in rows:
+        names.update(row)
+
+    header = {
+        "schema_version": SCHEMA_VERSION,
+        "group": group,
+        "rows": len(rows),
+        "shape": "rows" if isinstance(value, list) else "row",
+        "extra": extra or {},
+    }
+    lines = [json.dumps(header, sort_keys=True)]
+    # Columns are sorted the same way keys of documents stored as JSON are.
+    for name in sorted(names):
+        column: Dict[str, Any] = {"name": name, "values": [row.get(name) for row in rows]}
+        missing = [index for index, row in enumerate(rows) if name not in row]
+        if missing:
+            column["missing"] = missing
+        lines.append(json.dumps(column))
+
+    return gzip.compress(("\n".join(lines) + "\n").encode("utf-8"), mtime=0)
+
+
+def decode_group(blob: bytes, columns: Optional[Iterable[str]] = None) -> Tuple[Dict[str, Any], Any]:
+    """Decode a column group, return its header and its value restricted to the given columns if any."""
+    lines = gzip.decompress(blob).decode("utf-8").splitlines()
+    header = json.loads(lines[0])
+    if header.get("schema_version") != SCHEMA_VERSION:
+        raise ValueError(f"Unsupported schema version {header.get('schema_version')!r} of group {header['group']!r}")
+
+    wanted = set(columns) if columns is not None else None
+    rows: List[Dict[str, Any]] = [{} for _ in range(header["rows"])]
+    for line in lines[1:]:
+        column = json.loads(line)
+        if wanted is not None and column["name"] not in wanted:
+            continue
+
+        missing = set(column.get("missing", ()))
+        for index, (row, cell) in enumerate(zip(rows, column["values"])):
+            if index not in missing:
+                row[column["name"]] = cell
+
+    return header, rows if header["shape"] == "rows" else rows[0]
+
+
+def store_document(
+    ceph_adapter: "CephStore", document: Dict[str, Any], document_id: str, document_format: Optional[str] = None
+) -> None:
+    """Store a metrics document in the given format, STORAGE_FORMAT by default."""
+    document_format = document_format or STORAGE_FORMAT
+
+    if document_format == JSON_FORMAT:
+        with span(CEPH_STORE):
+            ceph_adapter.store_document(document, document_id)
+        return
+
+    if document_format != COLUMNAR_FORMAT:
+        raise ValueError(f"Unknown storage format {document_format!r}, supported formats are json and columnar")
+
+    # Keys outside column groups are kept in the header of the first group stored.
+    extra: Optional[Dict[str, Any]] = {key: value for key, value in document.items() if key not in COLUMN_GROUPS}
+    for group in COLUMN_GROUPS:
+        if group not in document:
+            continue
+
+        with span(CEPH_STORE):
+            ceph_adapter.store_blob(
+                encode_group(group, document[group], extra), columnar_object_key(document_id, group)
+            )
+        extra = None
+
+
+def _read_columnar_document(
+    ceph_adapter: "CephStore",
+    document_id: str,
+    groups: Iterable[str],
+    columns: Optional[Dict[str, Iterable[str]]] = None,
+) -> Dict[str, Any]:
+    """Read column groups of a document stored in the columnar format."""
+    document: Dict[str, Any] = {}
+    for group in groups:
+        with span(CEPH_RETRIEVE):
+            blob = ceph_adapter.retrieve_blob(columnar_object_key(document_id, group))
+
+        header, value = decode_group(blob, (columns or {}).get(group))
+        document.update(header.get("extra", {}))
+        document[group] = value
+
+    return document
+
+
+def _read_document_in_format(
+    ceph_adapter: "CephStore",
+    document_id: str,
+    document_format: str,
+    groups: Iterable[str],
+    columns: Optional[Dict[str, Iterable[str]]] = None,
+) -> Dict[str, Any]:
+    """Read a metrics document stored in the given format."""
+    if document_format == COLUMNAR_FORMAT:
+        return _read_columnar_document(ceph_adapter, document_id, groups, columns)
+
+    with span(CEPH_RETRIEVE):
+        document: Dict[str, Any] = ceph_adapter.retrieve_document(document_id)
+
+    return document
+
+
+def read_document(
+    ceph_adapter: "CephStore",
+    document_id: str,
+    groups: Optional[Iterable[str]] = None,
+    columns: Optional[Dict[str, Iterable[str]]] = None,
+    document_format: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Read a metrics document stored in either format.
+
+    Only the given column groups, and only the given columns of a group, are read from columnar documents,
+    JSON documents are read whole. Without a format, STORAGE_FORMAT is tried first and the other format
+    next. NotFoundError is raised if the document is not stored.
+    """
+    from thoth.storages.exceptions import NotFoundError
+
+    groups = tuple(groups or COLUMN_GROUPS)
+    if document_format:
+        formats: Tuple[str, ...] = (document_format,)
+    elif STORAGE_FORMAT == COLUMNAR_FORMAT:
+        formats = (COLUMNAR_FORMAT, JSON_FORMAT)
+    else:
+        formats = (JSON_FORMAT, COLUMNAR_FORMAT)
+
+    for candidate_format in formats[:-1]:
+        try:
+            return _read_document_in_format(ceph_adapter, document_id, candidate_format, groups, columns)
+        except NotFoundError:
+            _LOGGER.debug(f"Document {document_id} not stored as {candidate_format}")
+
+    return _read_document_in_format(ceph_adapter, document_id, formats[-1], groups, columns)
+
+
+def update_stored_document(
+    ceph_adapter: "CephStore",
+    document_id: str,
+    update: Callable[[Optional[Dict[str, Any]]], Dict[str, Any]],
+    document_format: Optional[str] = None,
+    retries: int = 5,
+    backoff: float = 0.1,
+) -> Dict[str, Any]:
+    """Update a metrics document stored in the given format, STORAGE_FORMAT by default, return the document stored.
+
+    JSON documents are updated atomically with conditional writes. Column groups of columnar documents are
+    separate objects which cannot be written together conditionally, so they are read and stored as usual.
+    A JSON document not stored yet is created from its columnar version, if there is one.
+    """
+    from thoth.storages.exceptions import NotFoundError
+
+    document_format = document_format or STORAGE_FORMAT
+
+    if document_format == COLUMNAR_FORMAT:
+        try:
+            document: Optional[Dict[str, Any]] = read_document(ceph_adapter, document_id)
+        except NotFoundError:
+            document = None
+
+        updated = update(document)
+        store_document(ceph_adapter, updated, document_id, document_format=COLUMNAR_FORMAT)
+        return updated
+
+    if document_format != JSON_FORMAT:
+        raise ValueError(f"Unknown storage format {document_format!r}, supported formats are json and columnar")
+
+    def update_json(document: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        if document is None:
+            try:
+                document = read_document(ceph_adapter, document_id, document_format=COLUMNAR_FORMAT)
+            except NotFoundError:
+                pass
+
+        return update(document)
+
+    return update_document(ceph_adapter, document_id, update_json, retries=retries, backoff=backoff)
+
+
+def _choose_format(
+    json_entry: Optional[Tuple[str, str]], columnar_entries: Dict[str, Tuple[str, str]]
+) -> Optional[Tuple[str, str, str]]:
+    """Choose the most recently stored complete format of a document, return its ETag, modification time and format."""
+    columnar_entry = None
+    if all(group in columnar_entries for group in COLUMN_GROUPS):
+        columnar_entry = (
+            ",".join(columnar_entries[group][0] for group in COLUMN_GROUPS),
+            max(columnar_entries[group][1] for group in COLUMN_GROUPS),
+        )
+
+    if columnar_entry and (json_entry is None or columnar_entry[1] >= json_entry[1]):
+        return columnar_entry[0], columnar_entry[1], COLUMNAR_FORMAT
+
+    if json_entry:
+        return json_entry[0], json_entry[1], JSON_FORMAT
+
+    return None
+
+
+def list_stored_documents(ceph_adapter: "CephStore", document_name: str) -> Iterator[Tuple[str, str, str, str]]:
+    """List documents with the given name stored in either format.
+
+    Yield id, ETag, modification time and format of each document. If a document is stored in both formats,
+    the one stored last is listed. The ETag of a columnar document combines ETags of all its column groups.
+    """
+    group_suffixes = {f".{group}{_COLUMNAR_SUFFIX}": group for group in COLUMN_GROUPS}
+
+    current_id: Optional[str] = None
+    json_entry: Optional[Tuple[str, str]] = None
+    columnar_entries: Dict[str, Tuple[str, str]] = {}
+
+    def flush() -> Iterator[Tuple[str, str, str, str]]:
+        chosen = _choose_format(json_entry, columnar_entries)
+        if current_id is not None and chosen:
+            yield (current_id,) + chosen
+        elif current_id is not None:
+            _LOGGER.warning(f"Document {current_id} is stored incompletely in the columnar format, skipping it")
+
+    # Objects of a document share its id as a prefix, so they are listed one after another.
+    for object_id, etag, last_modified in list_documents(ceph_adapter):
+        directory, _, name = object_id.rpartition("/")
+        prefix = f"{directory}/" if directory else ""
+
+        if name == document_name:
+            document_id, group = object_id, None
+        elif name.startswith(document_name) and name[len(document_name) :] in group_suffixes:  # noqa: E203
+            document_id, group = prefix + document_name, group_suffixes[name[len(document_name) :]]  # noqa: E203
+        else:
+            continue
+
+        if document_id != current_id:
+            yield from flush()
+            current_id, json_entry, columnar_entries = document_id, None, {}
+
+        if group is None:
+            json_entry = (etag, last_modified)
+        else:
+            columnar_entries[group] = (etag, last_modified)
+
+    yield from flush()
+
+
+def migrate_documents(
+    ceph_adapter: "CephStore",
+    document_name: str,
+    document_format: str,
+    delete_source: bool = False,
+) -> int:
+    """Convert documents with the given name to the given format, return number of documents converted."""
+    migrated = 0
+    for document_id, _, _, stored_format in list(list_stored_documents(ceph_adapter, document_name)):
+        if stored_format == document_format:
+            continue
+
+        document = read_document(ceph_adapter, document_id, document_format=stored_format)
+        store_document(ceph_adapter, document, document_id, document_format=document_format)
+        _LOGGER.info(f"Converted {document_id} from {stored_format} to {document_format}")
+
+        if delete_source:
+            if stored_format == JSON_FORMAT:
+                ceph_adapter.delete(document_id)
+            else:
+                for group in COLUMN_GROUPS:
+                    ceph_adapter.delete(columnar_object_key(document_id, group))
+
+        migrated += 1
+
+    return migrated
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# pipeline-helpers
+# Copyright(C) 2022 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Templates of Kubernetes objects parsed once and rendered as customized copies."""
+
+import copy
+import hashlib
+import io
+import json
+import os
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Optional
+from typing import Union
+
+import yaml
+
+from thoth.pipeline_helpers.instrumentation import YAML_DUMP
+from thoth.pipeline_helpers.instrumentation import YAML_LOAD
+from thoth.pipeline_helpers.instrumentation import span
+from thoth.pipeline_helpers.path_query import set_values
+
+try:
+    from yaml import CSafeDumper as SafeDumper
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeDumper  # type: ignore
+    from yaml import SafeLoader  # type: ignore
+
+_PathType = Union[str, Path]
+
+
+class TemplateCache:
+    """Cache of parsed templates, each template file is read and parsed only once."""
+
+    def __init__(self) -> None:
+        """Initialize an empty cache."""
+        self._templates: Dict[str, Any] = {}
+
+    def load(self, path: _PathType) -> Any:
+        """Get the parsed template stored in the given file, do not modify it in place."""
+        key = os.path.abspath(path)
+        template = self._templates.get(key)
+        if template is None:
+            with open(path, "r") as stream, span(YAML_LOAD):
+                template = yaml.load(stream, Loader=SafeLoader)
+            self._templates[key] = template
+
+        return template
+
+    def load_directory(self, directory: _PathType) -> Dict[str, Any]:
+        """Load all YAML templates in the given directory, keyed by their file name."""
+        return {path.name: self.load(path) for path in sorted(Path(directory).glob("*.yaml"))}
+
+    def render(self, path: _PathType, fields: Dict[str, Any]) -> dict:
+        """Render a copy of a template with fields located by path queries set to the given values."""
+        document: dict = copy.deepcopy(self.load(path))
+        for query, value in fields.items():
+            if not set_values(document, query, value):
+                raise ValueError(f"Field {query!r} not found in template {str(path)!r}")
+
+        return document
+
+
+def dump_documents(documents: Iterable[Any]) -> str:
+    """Serialize documents to a YAML multi-document stream."""
+    with span(YAML_DUMP):
+        return yaml.dump_all(documents, Dumper=SafeDumper, default_flow_style=False, allow_unicode=True)
+
+
+def write_documents(documents: Iterable[Any], path: _PathType) -> None:
+    """Write documents to a YAML file in a single write."""
+    content = dump_documents(documents)
+    with io.open(path, "w", encoding="utf8") as outfile:
+        outfile.write(content)
+
+
+def content_hash(content: str, inputs: Optional[Dict[str, Any]] = None) -> str:
+    """Compute a stable hash of rendered content together with inputs it was rendered from."""
+    digest = hashlib.sha256(json.dumps(inputs or {}, sort_keys=True).encode("utf8"))
+    digest.update(content.encode("utf8"))
+    return digest.hexdigest()
+
+
+def write_documents_if_changed(
+    documents: Iterable[Any], path: _PathType, inputs: Optional[Dict[str, Any]] = None
+) -> bool:
+    """Write documents to a YAML file unless it already holds them rendered from the same inputs.
+
+    The hash of the content and inputs is kept next to the file in a hidden .sha256 file. Return True if
+    the file was written.
+    """
+    content = dump_documents(documents)
+    digest = content_hash(content, inputs)
+    hash_path = os.path.join(os.path.dirname(os.path.abspath(path)), f".{os.path.basename(path)}.sha256")
+
+    try:
+        with open(hash_path, "r") as hash_file, io.open(path, "r", encoding="utf8") as existing_file:
+            if hash_file.read().strip() == digest and existing_file.read() == content:
+                return False
+    except FileNotFoundError:
+        pass
+
+    with io.open(path, "w", encoding="utf8") as outfile:
+        outfile.write(content)
+
+    with open(hash_path, "w") as hash_file:
+        hash_file.write(digest)
+
+    return True
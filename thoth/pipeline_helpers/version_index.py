@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# pipeline-helpers
+# Copyright(C) 2022 Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Index of image tags sorted by the version they name."""
+
+from bisect import bisect_left
+from bisect import bisect_right
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+
+from packaging.version import InvalidVersion
+from packaging.version import Version
+
+
+class TagIndex:
+    """Index of tags naming versions, e.g. v0.27.0, answering latest version queries in logarithmic time.
+
+    Each tag is parsed once when the index is built, tags not starting with the prefix or not naming a
+    valid version are ignored.
+    """
+
+    def __init__(self, tags: Iterable[str], prefix: str = "v", _sorted: bool = False) -> None:
+        """Build index of the given tags."""
+        self.prefix = prefix
+
+        entries = []
+        for tag in tags:
+            version = self.parse(tag)
+            if version is not None:
+                entries.append((version, tag))
+
+        if not _sorted:
+            entries.sort()
+
+        self._versions: List[Version] = [version for version, _ in entries]
+        self._tags: List[str] = [tag for _, tag in entries]
+
+    def parse(self, tag: str) -> Optional[Version]:
+        """Parse version named by a tag, None if the tag does not name a version."""
+        if not tag.startswith(self.prefix):
+            return None
+
+        try:
+            return Version(tag[len(self.prefix) :])  # noqa: E203
+        except InvalidVersion:
+            return None
+
+    def _tag_before(self, index: int) -> Optional[str]:
+        """Get tag preceding the given position in the index, None if there is none."""
+        return self._tags[index - 1] if index > 0 else None
+
+    def latest(self) -> Optional[str]:
+        """Get tag naming the latest version."""
+        return self._tag_before(len(self._tags))
+
+    def latest_within(self, major: int, minor: Optional[int] = None) -> Optional[str]:
+        """Get tag naming the latest version with the given major (and minor) version."""
+        if minor is None:
+            upper_bound, release = Version(f"{major + 1}.dev0"), (major,)
+        else:
+            upper_bound, release = Version(f"{major}.{minor + 1}.dev0"), (major, minor)
+
+        index = bisect_left(self._versions, upper_bound)
+        if index > 0 and (self._versions[index - 1].release + (0, 0))[: len(release)] == release:
+            return self._tags[index - 1]
+
+        return None
+
+    def latest_not_newer_than(self, tag: str) -> Optional[str]:
+        """Get tag naming the latest version not newer than the one named by the given tag."""
+        version = self.parse(tag)
+        if version is None:
+            raise ValueError(f"Tag {tag!r} does not name a version")
+
+        return self._tag_before(bisect_right(self._versions, version))
+
+    def is_outdated(self, tag: str) -> bool:
+        """Check whether a newer version than the one named by the given tag is available."""
+        version = self.parse(tag)
+        return bool(self._versions) and (version is None or self._versions[-1] > version)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize index to a JSON serializable dictionary, tags are stored sorted."""
+        return {"prefix": self.prefix, "tags": list(self._tags)}
+
+    @classmethod
+    def from_dict(cls, dictionary: Dict[str, Any]) -> "TagIndex":
+        """Deserialize index created by to_dict, without sorting tags again."""
+        return cls(dictionary["tags"], prefix=dictionary["prefix"], _sorted=True)
+
+    def __len__(self) -> int:
+        """Get number of tags in the index."""
+        return len(self._tags)